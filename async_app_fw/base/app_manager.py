@@ -4,8 +4,9 @@ import itertools
 import logging
 import gc
 import traceback
+from collections import deque
 
-from async_app_fw.controller.handler import register_instance, get_dependent_services, HANDLER_FILTER, FILTER_TYPE as DEFAULT_FILTER_TYPE
+from async_app_fw.controller.handler import register_instance, get_dependent_services, is_batch_handler, HANDLER_FILTER, FILTER_TYPE as DEFAULT_FILTER_TYPE
 from async_app_fw.event import event
 from async_app_fw.event.event import EventBase, EventReplyBase, EventRequestBase
 from async_app_fw.lib import hub
@@ -17,6 +18,23 @@ LOG = logging.getLogger('async_app_fw.base.app_manager')
 
 SERVICE_BRICKS = {}
 
+# events queued to an app and not handled yet, 0 is unbounded.
+DEFAULT_EVENT_QUEUE_SIZE = 0
+# what send_event does when the event queue of the app is full.
+# wait: keep the event in order in a backlog, queued by one task as room frees up.
+EVENT_OVERFLOW_WAIT = 'wait'
+# drop: discard the event and return False, requests are kept.
+EVENT_OVERFLOW_DROP = 'drop'
+# raise: raise EventQueueFull.
+EVENT_OVERFLOW_RAISE = 'raise'
+DEFAULT_EVENT_OVERFLOW_POLICY = EVENT_OVERFLOW_WAIT
+# events the event loop of an app takes from its queue per wake-up.
+DEFAULT_EVENT_BATCH_SIZE = 256
+
+
+class EventQueueFull(Exception):
+    pass
+
 
 def lookup_service_brick(name):
     return SERVICE_BRICKS.get(name)
@@ -49,6 +67,8 @@ class EventLoopStop(EventBase):
 class BaseApp(object):
     _CONTEXT = {}
     _EVENTS = []
+    EVENT_QUEUE_SIZE = DEFAULT_EVENT_QUEUE_SIZE
+    EVENT_BATCH_SIZE = DEFAULT_EVENT_BATCH_SIZE
 
     event_loop_stop = EventLoopStop
 
@@ -61,9 +81,28 @@ class BaseApp(object):
         self.name = self.__class__.__name__
         self.event_handlers = {}
         self.observers = {}
+        # handlers and observer names by (ev_cls, state), compiled on the
+        # first event of the pair and dropped when handlers or observers
+        # change. Replaced rather than cleared, shards read them too.
+        self._handler_table = {}
+        self._observer_table = {}
+        # ev_cls with handlers of observe_event_batch, those with only
+        # such handlers and the default filter, and _split_handlers by
+        # (ev_cls, state) like _handler_table.
+        self._batch_ev_classes = frozenset()
+        self._batch_only_ev_classes = frozenset()
+        self._batch_handler_table = {}
         self.tasks = []
         self._event_loop_task = None
-        self.events = hub.Queue()
+        self.events = hub.Queue(self.EVENT_QUEUE_SIZE)
+        # EVENT_OVERFLOW_*, for a full events queue.
+        self.event_overflow_policy = DEFAULT_EVENT_OVERFLOW_POLICY
+        self.event_overflows = 0
+        # events waiting for room in the queue, see _put_event.
+        self._event_backlog = deque()
+        # shard of app_hub whose loop runs the app, events sent by other
+        # shards are handed off to it.
+        self.shard = app_hub.current_shard() or app_hub.main_shard
 
         if hasattr(self.__class__, 'LOGGER_NAME'):
             self.logger = logging.getLogger(self.__class__.LOGGER_NAME)
@@ -104,25 +143,47 @@ class BaseApp(object):
         assert callable(handler)
         self.event_handlers.setdefault(ev_cls, [])
         self.event_handlers[ev_cls].append(handler)
+        self._handler_table = {}
+        self._batch_handler_table = {}
+        self._classify_handlers(ev_cls)
 
     def unregister_handler(self, ev_cls, handler):
         assert callable(handler)
         self.event_handlers[ev_cls].remove(handler)
         if not self.event_handlers[ev_cls]:
             del self.event_handlers[ev_cls]
+        self._handler_table = {}
+        self._batch_handler_table = {}
+        self._classify_handlers(ev_cls)
+
+    def _classify_handlers(self, ev_cls):
+        batch = [is_batch_handler(h, ev_cls) for h in self.event_handlers.get(ev_cls, ())]
+        batch_ev_classes = self._batch_ev_classes - {ev_cls}
+        batch_only_ev_classes = self._batch_only_ev_classes - {ev_cls}
+        if any(batch):
+            batch_ev_classes |= {ev_cls}
+            # events of these are grouped by _dispatch_events, which looks
+            # up their handlers once per group.
+            if all(batch) and ev_cls.FILTER_TYPE == DEFAULT_FILTER_TYPE:
+                batch_only_ev_classes |= {ev_cls}
+        self._batch_ev_classes = batch_ev_classes
+        self._batch_only_ev_classes = batch_only_ev_classes
 
     def register_observer(self, ev_cls, name, states=None):
         states = states or set()
         ev_cls_observers = self.observers.setdefault(ev_cls, {})
         ev_cls_observers.setdefault(name, set()).update(states)
+        self._observer_table = {}
 
     def unregister_observer(self, ev_cls, name):
         observers = self.observers.get(ev_cls, {})
         observers.pop(name)
+        self._observer_table = {}
 
     def unregister_observer_all_event(self, name):
         for observers in self.observers.values():
             observers.pop(name, None)
+        self._observer_table = {}
 
     def observe_event(self, ev_cls, states=None):
         brick = _lookup_service_brick_by_ev_cls(ev_cls)
@@ -135,7 +196,7 @@ class BaseApp(object):
             brick.unregister_observer(ev_cls, self.name)
 
     def get_handlers(self, ev, state=None):
-        """Returns a list of handlers for the specific event.
+        """Returns a tuple of handlers for the specific event.
 
         :param ev: The event to handle.
         :param state: The current state. ("dispatcher")
@@ -145,18 +206,39 @@ class BaseApp(object):
                       The default is None.
         """
         ev_cls = ev.__class__
-        handlers = self.event_handlers.get(ev_cls, [])
-        handler_filter = HANDLER_FILTER.get(ev_cls.FILTER_TYPE)
+        if ev_cls.FILTER_TYPE == DEFAULT_FILTER_TYPE:
+            # the default filter only looks at ev_cls and state.
+            try:
+                return self._handler_table[ev_cls, state]
+            except KeyError:
+                handlers = self._filter_handlers(ev, ev_cls, state)
+                self._handler_table[ev_cls, state] = handlers
+                return handlers
+            except TypeError:
+                # unhashable state.
+                pass
 
-        return filter(lambda hanlder: handler_filter(hanlder, ev, ev_cls, state), handlers)
+        return self._filter_handlers(ev, ev_cls, state)
 
-    def get_observers(self, ev, state):
-        observers = []
-        for k, v in self.observers.get(ev.__class__, {}).items():
-            if not state or not v or state in v:
-                observers.append(k)
+    def _filter_handlers(self, ev, ev_cls, state):
+        handler_filter = HANDLER_FILTER.get(ev_cls.FILTER_TYPE)
+        return tuple(handler for handler in self.event_handlers.get(ev_cls, ())
+                     if handler_filter(handler, ev, ev_cls, state))
 
-        return observers
+    def get_observers(self, ev, state):
+        ev_cls = ev.__class__
+        try:
+            return self._observer_table[ev_cls, state]
+        except KeyError:
+            observers = self._filter_observers(ev_cls, state)
+            self._observer_table[ev_cls, state] = observers
+            return observers
+        except TypeError:
+            return self._filter_observers(ev_cls, state)
+
+    def _filter_observers(self, ev_cls, state):
+        return tuple(name for name, states in self.observers.get(ev_cls, {}).items()
+                     if not state or not states or state in states)
 
     def send_request(self, req) -> asyncio.Task:
         """
@@ -175,18 +257,14 @@ class BaseApp(object):
         return app_hub.spawn(req.reply_q.get)
 
     async def _event_loop(self):
+        events = self.events
         try:
-            while self.is_active or self.events.empty():
-                ev, state = await self.events.get()
-                handlers = self.get_handlers(ev, state)
-                for handler in handlers:
-                    try:
-                        handler(ev)
-                    except:
-                        LOG.exception('%s: Exception occurred during handler processing. '
-                                      'Backtrace from offending handler '
-                                      '[%s] servicing event [%s] follows.',
-                                      self.name, handler.__name__, ev.__class__.__name__)
+            while self.is_active or events.empty():
+                # the queued events up to EVENT_BATCH_SIZE per wake-up.
+                batch = [await events.get()]
+                while len(batch) < self.EVENT_BATCH_SIZE and not events.empty():
+                    batch.append(events.get_nowait())
+                self._dispatch_events(batch)
         except asyncio.CancelledError as e:
             LOG.info(f'App {self.name}, _event_loop been canceled.')
 
@@ -197,15 +275,144 @@ class BaseApp(object):
         except asyncio.QueueEmpty:
             pass
 
+    def _dispatch_events(self, batch):
+        """
+        Call the handlers of each (ev, state) of batch. Each handler of
+        observe_event_batch is called with the list of its events of one
+        ev_cls, before a handler of a single event of another ev_cls, so
+        events reach the handlers in the order they were sent.
+        """
+        batch_ev_classes = self._batch_ev_classes
+        batch_only_ev_classes = self._batch_only_ev_classes
+        batches = {}
+        # ev_cls of batches, which have handlers of single events too.
+        batched = set()
+        # ev_cls with only batch handlers: ([ev], [state]) in order.
+        grouped = {}
+        for ev, state in batch:
+            ev_cls = ev.__class__
+            if ev_cls in batch_only_ev_classes:
+                group = grouped.get(ev_cls)
+                if group is None:
+                    grouped[ev_cls] = ([ev], [state])
+                else:
+                    group[0].append(ev)
+                    group[1].append(state)
+                continue
+            if ev_cls in batch_ev_classes:
+                handlers, batch_handlers = self._split_handlers(ev, state)
+            else:
+                handlers, batch_handlers = self.get_handlers(ev, state), ()
+            if handlers and (grouped or batched and batched != {ev_cls}):
+                self._call_batch_handlers(batches, grouped)
+                batched.clear()
+            for handler in handlers:
+                try:
+                    handler(ev)
+                except:
+                    LOG.exception('%s: Exception occurred during handler processing. '
+                                  'Backtrace from offending handler '
+                                  '[%s] servicing event [%s] follows.',
+                                  self.name, handler.__name__, ev_cls.__name__)
+            for handler in batch_handlers:
+                batches.setdefault((handler, ev_cls), []).append(ev)
+                batched.add(ev_cls)
+
+        if batches or grouped:
+            self._call_batch_handlers(batches, grouped)
+
+    def _call_batch_handlers(self, batches, grouped):
+        """Call the batch handlers with the events collected by _dispatch_events, then clear them."""
+        for ev_cls, (evs, states) in grouped.items():
+            state = states[0]
+            if states.count(state) == len(states):
+                # handlers of one state, looked up once for the group.
+                for handler in self._split_handlers(evs[0], state)[1]:
+                    batches.setdefault((handler, ev_cls), []).extend(evs)
+                continue
+            for ev, state in zip(evs, states):
+                for handler in self._split_handlers(ev, state)[1]:
+                    batches.setdefault((handler, ev_cls), []).append(ev)
+        grouped.clear()
+
+        for (handler, ev_cls), evs in batches.items():
+            try:
+                handler(evs)
+            except:
+                LOG.exception('%s: Exception occurred during handler processing. '
+                              'Backtrace from offending handler '
+                              '[%s] servicing %d events [%s] follows.',
+                              self.name, handler.__name__, len(evs), ev_cls.__name__)
+        batches.clear()
+
+    def _split_handlers(self, ev, state):
+        """get_handlers split into (handlers, batch handlers)."""
+        ev_cls = ev.__class__
+        if ev_cls.FILTER_TYPE == DEFAULT_FILTER_TYPE:
+            try:
+                return self._batch_handler_table[ev_cls, state]
+            except KeyError:
+                split = self._filter_batch_handlers(ev, ev_cls, state)
+                self._batch_handler_table[ev_cls, state] = split
+                return split
+            except TypeError:
+                pass
+
+        return self._filter_batch_handlers(ev, ev_cls, state)
+
+    def _filter_batch_handlers(self, ev, ev_cls, state):
+        handlers = self.get_handlers(ev, state)
+        return (tuple(h for h in handlers if not is_batch_handler(h, ev_cls)),
+                tuple(h for h in handlers if is_batch_handler(h, ev_cls)))
+
     async def _send_event(self, ev, state):
         await self.events.put((ev, state))
 
+    def _put_event(self, ev, state):
+        """
+        Queue (ev, state) without a task, see event_overflow_policy for a
+        full queue. Return False if ev is discarded.
+        """
+        item = (ev, state)
+        if not self._event_backlog:
+            try:
+                self.events.put_nowait(item)
+                return True
+            except asyncio.QueueFull:
+                pass
+
+        return self._event_overflow(item)
+
+    def _event_overflow(self, item):
+        ev = item[0]
+        self.event_overflows += 1
+        policy = self.event_overflow_policy
+        if policy == EVENT_OVERFLOW_RAISE:
+            raise EventQueueFull(f'Event queue of {self.name} is full.')
+        if policy == EVENT_OVERFLOW_DROP and not isinstance(ev, EventRequestBase):
+            LOG.debug('Event queue of %s is full, %s is dropped.', self.name, ev.__class__.__name__)
+            return False
+
+        backlog = self._event_backlog
+        backlog.append(item)
+        if len(backlog) == 1:
+            app_hub.spawn(self._queue_event_backlog)
+        return True
+
+    async def _queue_event_backlog(self):
+        backlog = self._event_backlog
+        while backlog:
+            await self.events.put(backlog[0])
+            backlog.popleft()
+
     def send_event_to_self(self, ev, state=None):
         self.send_event(self.name, ev, state)
 
     def send_event(self, name, ev, state=None):
         """
         Send the specified event to the RyuApp instance specified by name.
+        The event is queued at once, no task is created for it. Return
+        False if it's lost or discarded, see event_overflow_policy.
         """
 
         if name in SERVICE_BRICKS:
@@ -213,13 +420,16 @@ class BaseApp(object):
                 ev.src = self.name
             LOG.debug("EVENT %s->%s %s",
                       self.name, name, ev.__class__.__name__)
-            send_task = app_hub.spawn(
-                SERVICE_BRICKS[name]._send_event, ev, state)
-            return send_task
+            app = SERVICE_BRICKS[name]
+            if not app.shard.in_thread():
+                # sent by a connection served by another shard.
+                app.shard.call_soon(app._put_event, ev, state)
+                return True
+            return app._put_event(ev, state)
         else:
             LOG.debug("EVENT LOST %s->%s %s",
                       self.name, name, ev.__class__.__name__)
-            return None
+            return False
 
     def send_event_to_observers(self, ev, state=None):
         """
@@ -65,7 +65,7 @@ class _Caller(object):
     """Describe how to handle an event class.
     """
 
-    def __init__(self, ev_types, ev_source):
+    def __init__(self, ev_types, ev_source, batch=False):
         """Initialize _Caller.
 
         :param ev_type: A list of states or a state, in which this
@@ -74,9 +74,12 @@ class _Caller(object):
         :param ev_source: The module which generates the event.
                           ev_cls.__module__ for set_ev_cls.
                           None for set_ev_handler.
+        :param batch: True if the handler takes a list of the events,
+                      see observe_event_batch.
         """
         self.ev_types = ev_types
         self.ev_source = ev_source
+        self.batch = batch
 
 
 # should be named something like 'observe_event'
@@ -90,6 +93,27 @@ def observe_event(ev_cls, ev_types=None):
     return _set_ev_cls_dec
 
 
+def observe_event_batch(ev_cls, ev_types=None):
+    """
+    observe_event for a handler which takes a list of events of one
+    ev_cls. Events drained from the queue of the app in one wake-up are
+    given to it at once, after the other handlers have handled them and
+    before an event sent later reaches a handler of single events.
+    """
+    def _set_ev_cls_dec(handler):
+        if 'callers' not in dir(handler):
+            handler.callers = {}
+        for e in _listify(ev_cls):
+            handler.callers[e] = _Caller(_listify(ev_types), e.__module__, batch=True)
+        return handler
+    return _set_ev_cls_dec
+
+
+def is_batch_handler(handler, ev_cls):
+    caller = getattr(handler, 'callers', {}).get(ev_cls)
+    return caller is not None and caller.batch
+
+
 def observe_event_from_self(ev_cls, ev_types):
     def _observe_event_from_self(handler):
         frame = inspect.currentframe()
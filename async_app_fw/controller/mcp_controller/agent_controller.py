@@ -30,41 +30,111 @@ from socket import IPPROTO_TCP
 from socket import TCP_NODELAY
 from socket import SHUT_WR
 from async_app_fw.controller.mcp_controller.mcp_state import MC_DISCONNECT, MC_HANDSHAK
-from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+from async_app_fw.controller.mcp_controller.mcp_controller import MAX_STRIPES, MachineConnection
+from async_app_fw.controller.mcp_controller.mcp_session import DEFAULT_RESUME_TIMEOUT, SessionTable
+from async_app_fw.controller.mcp_controller.mcp_shm import DEFAULT_SHM_SIZE
+from async_app_fw.controller.mcp_controller.mcp_transport import DEFAULT_UNIX_PATH, TRANSPORT_STREAM, UNIX_TRANSPORTS, \
+    get_connection_factory, peer_address
 
 # from ryu import cfg
-from async_app_fw.lib import hub
+from async_app_fw.lib import hub, tls
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
+from async_app_fw.protocol.mcp.mcp_capability import DEFAULT_FEATURES, Capability
 
 LOG = logging.getLogger(
     'Machine Agent Controller')
 
 LOG.setLevel(logging.DEBUG)
 
+# connections opened to master, the primary one included.
+DEFAULT_STRIPES = 1
+
 class MachineControlAgentController(object):
     # def __init__(self, host='169.254.0.111', port=7930):
-    def __init__(self, host='127.0.0.1', port=7930):
+    def __init__(self, host='127.0.0.1', port=7930, transport=TRANSPORT_STREAM,
+                 capability: Capability = None, stripes=DEFAULT_STRIPES, path=DEFAULT_UNIX_PATH,
+                 shm_size=DEFAULT_SHM_SIZE, ssl_args=None, resume_timeout=DEFAULT_RESUME_TIMEOUT):
         self.host = host
         self.port = port
+        self.transport = transport
+        self.capability = capability
+        # services are pinned to one of stripes connections by their id.
+        assert 0 < stripes <= MAX_STRIPES, f'Invalid stripe count {stripes}.'
+        self.stripes = stripes
+        # unix domain socket of master for unix transports, host and port are not used then.
+        self.path = path
+        # shared memory ring offered to master on a unix domain socket, see mcp_shm.
+        self.shm_size = shm_size
+        # certfile, keyfile, ca_certs, server_hostname and insecure of TLS,
+        # see lib.tls. One context is used for every connection, so stripes
+        # and reconnects resume the session of the previous connection.
+        self.ssl_args = {}
+        if ssl_args:
+            ssl_args = dict(ssl_args)
+            server_hostname = ssl_args.pop('server_hostname', None)
+            self.ssl_args = {'ssl_ctx': tls.client_context(**ssl_args), 'server_hostname': server_hostname}
+        # session of the primary connection, resumed by the next one
+        # within resume_timeout sec, see mcp_session. None if 0.
+        self.sessions = None
+        if resume_timeout > 0:
+            self.sessions = SessionTable(resume_timeout)
+        elif capability is None:
+            self.capability = Capability(DEFAULT_FEATURES & ~mcproto.MCP_CAP_RESUME)
+
+    def _client(self):
+        if self.transport in UNIX_TRANSPORTS:
+            addr = (self.path,)
+        else:
+            addr = (self.host, self.port)
+
+        return hub.StreamClient(
+            addr=addr,
+            connection_factory=get_connection_factory(self.transport), **self.ssl_args)
 
     async def attempt_connecting_loop(self, interval=None):
-        agent = hub.StreamClient(
-            addr=(self.host, self.port))
-        await agent.connect_loop(machine_connection_factory, interval=interval)
+        agent = self._client()
+        await agent.connect_loop(self._connection_factory, interval=interval)
+
+    async def _connection_factory(self, reader: StreamReader, writer: StreamWriter):
+        await machine_connection_factory(reader, writer, capability=self.capability, shm_size=self.shm_size,
+                                         sessions=self.sessions)
+
+    async def connect_stripes(self, primary: MachineConnection):
+        """
+        Open the other stripes of primary connection, they join its agent
+        during handshake, see AgentMCPHandler.
+        """
+        client = self._client()
+        for index in range(1, self.stripes):
+            result = await client.connect()
+            if result is None or primary.state == MC_DISCONNECT:
+                return
+
+            reader, writer = result
+            hub.app_hub.spawn(machine_connection_factory, reader, writer, self.capability, primary, index,
+                              self.shm_size)
 
 
 class AgentConnection(MachineConnection):
-    def __init__(self, reader, writer, mcp_brick_name='mcp_agent_handler'):
+    def __init__(self, reader, writer, mcp_brick_name='mcp_agent_handler', capability=None):
         super(AgentConnection, self).__init__(
-            reader, writer, mcp_brick_name=mcp_brick_name)
+            reader, writer, mcp_brick_name=mcp_brick_name, capability=capability)
 
 
-async def machine_connection_factory(reader: StreamReader, writer: StreamWriter):
-    socket = writer.get_extra_info('socket')
-    address = socket.getpeername()
+async def machine_connection_factory(reader: StreamReader, writer: StreamWriter, capability=None,
+                                     primary=None, stripe_index=0, shm_size=DEFAULT_SHM_SIZE, sessions=None):
+    address = peer_address(writer)
     LOG.info('connected socket: address:%s port:%s',
              *address)
 
-    with contextlib.closing(AgentConnection(reader, writer)) as machine_connection:
+    with contextlib.closing(AgentConnection(reader, writer, capability=capability)) as machine_connection:
+        machine_connection.shm_size = shm_size
+        machine_connection.sessions = sessions
+        if primary is not None:
+            # joins the agent of primary when master says hello.
+            machine_connection.primary = primary
+            machine_connection.stripe_index = stripe_index
+
         try:
             serve_task = machine_connection.serve()
             await serve_task
@@ -87,4 +157,5 @@ async def machine_connection_factory(reader: StreamReader, writer: StreamWriter)
             serve_task.cancel()
             await serve_task
             LOG.info(f'Disconnect to {address}')
-            machine_connection.set_state(MC_DISCONNECT)
+            if not machine_connection.suspend():
+                machine_connection.set_state(MC_DISCONNECT)
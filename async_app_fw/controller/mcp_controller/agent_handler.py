@@ -5,7 +5,11 @@ from async_app_fw.event import event
 from async_app_fw.event.mcp_event import mcp_event
 from async_app_fw.controller.handler import observe_event, observe_event_from_self
 from async_app_fw.controller.mcp_controller.mcp_state import MC_DISCONNECT, MC_HANDSHAK, MC_STABLE
-from async_app_fw.controller.mcp_controller.agent_controller import MachineControlAgentController
+from async_app_fw.controller.mcp_controller.agent_controller import MachineControlAgentController, DEFAULT_STRIPES
+from async_app_fw.controller.mcp_controller.mcp_session import DEFAULT_RESUME_TIMEOUT
+from async_app_fw.controller.mcp_controller.mcp_shm import DEFAULT_SHM_SIZE
+from async_app_fw.controller.mcp_controller.mcp_transport import DEFAULT_UNIX_PATH, TRANSPORT_STREAM
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
 
 LOG = logging.getLogger(
     'eventlent_framework.controller.mcp_controller.agent_controller')
@@ -19,10 +23,22 @@ class AgentMCPHandler(BaseApp):
         super().__init__(*_args, **_kwargs)
         self.name = 'mcp_agent_handler'
         self.controller = None
+        self.stripes = DEFAULT_STRIPES
+        # TRANSPORT_UNIX with unix_path and shm_size for a master on this host.
+        self.transport = TRANSPORT_STREAM
+        self.unix_path = DEFAULT_UNIX_PATH
+        self.shm_size = DEFAULT_SHM_SIZE
+        # TLS when set, e.g. certfile, keyfile and ca_certs, see lib.tls.
+        self.ssl_args = None
+        # seconds to reconnect and resume the session after the connection
+        # is lost, 0 disconnects services at once.
+        self.resume_timeout = DEFAULT_RESUME_TIMEOUT
 
     def start(self):
         task = super().start()
-        self.controller = MachineControlAgentController()
+        self.controller = MachineControlAgentController(
+            transport=self.transport, stripes=self.stripes, path=self.unix_path, shm_size=self.shm_size,
+            ssl_args=self.ssl_args, resume_timeout=self.resume_timeout)
         return [app_hub.spawn(self.controller.attempt_connecting_loop, interval=2), task]
 
     @observe_event(mcp_event.EventMCPStateChange, MC_DISCONNECT)
@@ -35,6 +51,39 @@ class AgentMCPHandler(BaseApp):
         # machine id sync
         conn = ev.msg.connection
         conn.id = ev.msg.connection_id
-        msg = conn.mcproto_parser.MCPHello(conn, conn.id)
-        conn.send_msg(msg)
+        # capability is None if master doesn't negotiate it.
+        conn.set_peer_capability(ev.msg.get_capability())
+
+        primary = conn.primary
+        if primary is not None:
+            if not conn.supports(mcproto.MCP_CAP_STRIPE) or primary.state != MC_STABLE:
+                conn.set_state(MC_DISCONNECT)
+                conn.close()
+                return
+            # stripe of this agent, joined before the hello reply.
+            msg = conn.mcproto_parser.MCPStripeJoin(conn, primary.id, conn.stripe_index, self.controller.stripes)
+            conn.send_msg_nowait(msg)
+            resuming = False
+        else:
+            # session of a lost connection, resumed before the hello reply.
+            resuming = conn.resume_session()
+
+        msg = conn.mcproto_parser.MCPHello(conn, conn.id, conn.local_capability)
+        conn.send_msg_nowait(msg)
+        if not resuming:
+            self._stable(conn)
+
+    @observe_event_from_self(mcp_event.EventMCPSessionResumed, MC_HANDSHAK)
+    def session_resumed_handler(self, ev):
+        conn = ev.msg.connection
+        LOG.info('session %s', 'resumed' if conn.session is not None else 'not resumed')
+        self._stable(conn)
+
+    def _stable(self, conn):
         conn.set_state(MC_STABLE)
+
+        primary = conn.primary
+        if primary is not None:
+            primary.add_stripe(conn, conn.stripe_index, self.controller.stripes)
+        elif self.controller.stripes > 1 and conn.supports(mcproto.MCP_CAP_STRIPE):
+            app_hub.spawn(self.controller.connect_stripes, conn)
@@ -1,4 +1,29 @@
 class AgentIsNotExist(Exception):
     def __init__(self, agent, *args, **kwargs) -> None:
         message = f"Agent <{agent}> is not existed."
-        super().__init__(message, *args, **kwargs)
\ No newline at end of file
+        super().__init__(message, *args, **kwargs)
+        self.agent = agent
+
+    def __reduce__(self):
+        # replies forwarded between master workers are pickled.
+        return self.__class__, (self.agent,)
+
+
+class AgentOnOtherWorker(AgentIsNotExist):
+    """The agent is connected to another worker of the master, see master_worker."""
+
+    def __init__(self, agent, worker, *args, **kwargs) -> None:
+        Exception.__init__(self, f"Agent <{agent}> is connected to worker {worker}.", *args, **kwargs)
+        self.agent = agent
+        self.worker = worker
+
+    def __reduce__(self):
+        return self.__class__, (self.agent, self.worker)
+
+
+class MachineConnectionLost(Exception):
+    """Request failed because the connection it was sent by is lost."""
+
+    def __init__(self, address, reason, *args, **kwargs) -> None:
+        message = f"Connection of <{address}> is lost, {reason}."
+        super().__init__(message, *args, **kwargs)
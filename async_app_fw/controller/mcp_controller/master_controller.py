@@ -1,25 +1,64 @@
+import asyncio
 import traceback
 import logging
 import contextlib
+import threading
 from asyncio import CancelledError, StreamWriter, StreamReader
 
 from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
 from async_app_fw.controller.mcp_controller.mcp_state import MC_DISCONNECT, MC_HANDSHAK
+from async_app_fw.controller.mcp_controller.mcp_session import DEFAULT_RESUME_TIMEOUT, SessionTable
+from async_app_fw.controller.mcp_controller.mcp_shm import DEFAULT_SHM_SIZE
+from async_app_fw.controller.mcp_controller.mcp_transport import DEFAULT_UNIX_PATH, TRANSPORT_STREAM, UNIX_TRANSPORTS, \
+    get_accept_factory, get_server_factory, peer_address, tcp_transport
 from async_app_fw.lib import hub
 from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
+from async_app_fw.protocol.mcp.mcp_capability import DEFAULT_FEATURES, Capability
 
 LOG = logging.getLogger(
     'eventlent_framework.controller.mcp_controller.master_controller')
 
+# event loops serving agent connections, more than 1 runs them in threads
+# besides the loop of the apps, see hub.Hub.start_shards.
+DEFAULT_SHARDS = 1
+# pending connections of the listening socket, agents connect at once
+# when master restarts.
+DEFAULT_LISTEN_BACKLOG = 1024
+
 
 class MachineControlMasterController(object):
-    def __init__(self, listen_host='127.0.0.1', listen_port=7930):
+    def __init__(self, listen_host='127.0.0.1', listen_port=7930, transport=TRANSPORT_STREAM,
+                 capability: Capability = None, listen_path=DEFAULT_UNIX_PATH, shm_size=DEFAULT_SHM_SIZE,
+                 ssl_args=None, resume_timeout=DEFAULT_RESUME_TIMEOUT, shards=DEFAULT_SHARDS, reuse_port=False,
+                 listen_backlog=DEFAULT_LISTEN_BACKLOG):
         self.listen_host = listen_host
         self.listen_port = listen_port
+        self.transport = transport
+        self.capability = capability
+        # unix domain socket of unix transports, listened to besides host and port.
+        self.listen_path = listen_path
+        # shared memory ring offered to agents on a unix domain socket, see mcp_shm.
+        self.shm_size = shm_size
+        # certfile, keyfile and ca_certs of TLS, see lib.tls. None is cleartext.
+        self.ssl_args = ssl_args or {}
+        # sessions of agents resumed within resume_timeout sec after their
+        # connection is lost, see mcp_session. None if 0.
+        self.sessions = None
+        if resume_timeout > 0:
+            self.sessions = SessionTable(resume_timeout)
+        elif capability is None:
+            self.capability = Capability(DEFAULT_FEATURES & ~mcproto.MCP_CAP_RESUME)
+        self.shards = shards
+        # listen with SO_REUSEPORT, for workers sharing the port, see master_worker.
+        self.reuse_port = reuse_port
+        self.listen_backlog = listen_backlog
         self._clients = {}
         self._server_loop_task = None
 
     def start(self):
+        if self.shards > 1:
+            app_hub.start_shards(self.shards + 1)
         self._server_loop_task = app_hub.spawn(self.server_loop)
 
     async def stop(self):
@@ -28,43 +67,72 @@ class MachineControlMasterController(object):
             self._server_loop_task.cancel()
             await self._server_loop_task
 
+    def _stream_server(self, listen_info, transport, reuse_port=False):
+        return hub.StreamServer(
+            listen_info, self._connection_factory, backlog=self.listen_backlog,
+            server_factory=get_server_factory(transport),
+            accept_factory=get_accept_factory(transport), reuse_port=reuse_port, **self.ssl_args)
+
     async def server_loop(self):
-        self._server = hub.StreamServer(
-            (self.listen_host, self.listen_port), machine_connection_factory)
+        # agents on other hosts connect by TCP, those on this host may use
+        # the unix domain socket of a unix transport.
+        servers = [self._stream_server((self.listen_host, self.listen_port), tcp_transport(self.transport),
+                                       self.reuse_port)]
+        if self.transport in UNIX_TRANSPORTS:
+            servers.append(self._stream_server((self.listen_path,), self.transport))
+
+        try:
+            await asyncio.gather(*(server.serve_forever() for server in servers))
+        except CancelledError:
+            # the servers are closed by then, as a single one is when cancelled.
+            pass
 
-        await self._server.serve_forever()
+    async def _connection_factory(self, reader: StreamReader, writer: StreamWriter):
+        await machine_connection_factory(reader, writer, capability=self.capability, shm_size=self.shm_size,
+                                         sessions=self.sessions)
 
 
 class MasterConnection(MachineConnection):
-    # serial number
+    # serial number, stepped by MACHINE_ID_STEP so that workers of a
+    # master, each starting at its own index, don't share ids.
     MACHINE_ID = 0
+    MACHINE_ID_STEP = 1
+    # connections are accepted by several threads when app_hub is sharded.
+    _MACHINE_ID_LOCK = threading.Lock()
 
-    def __init__(self, socket, address, mcp_brick_name='mcp_master_handler'):
+    def __init__(self, socket, address, mcp_brick_name='mcp_master_handler', capability=None):
         super(MasterConnection, self).__init__(
-            socket, address, mcp_brick_name=mcp_brick_name)
+            socket, address, mcp_brick_name=mcp_brick_name, capability=capability)
 
     @classmethod
     def _get_new_machine_id(cls):
-        m_id = cls.MACHINE_ID
-        cls.MACHINE_ID = cls.MACHINE_ID + 1
+        with cls._MACHINE_ID_LOCK:
+            m_id = cls.MACHINE_ID
+            cls.MACHINE_ID = cls.MACHINE_ID + cls.MACHINE_ID_STEP
         return m_id
 
     async def serve(self):
         if self.id == 0:
             self.id = self._get_new_machine_id()
 
-        msg_hello = self.mcproto_parser.MCPHello(self, self.id)
+        # announce local capability, agent replies with its own.
+        msg_hello = self.mcproto_parser.MCPHello(self, self.id, self.local_capability)
 
-        await self.send_msg(msg_hello)
+        self.send_msg_nowait(msg_hello)
         await super().serve()
 
 
-async def machine_connection_factory(reader: StreamReader, writer: StreamWriter):
-    socket = writer.get_extra_info('socket')
-    address = socket.getpeername()
+async def machine_connection_factory(reader: StreamReader, writer: StreamWriter, capability=None,
+                                     shm_size=DEFAULT_SHM_SIZE, sessions=None):
+    address = peer_address(writer)
     LOG.info('connected socket: address:%s port:%s',
              *address)
-    with contextlib.closing(MasterConnection(reader, writer)) as machine_connection:
+    with contextlib.closing(MasterConnection(reader, writer, capability=capability)) as machine_connection:
+        machine_connection.shm_size = shm_size
+        machine_connection.sessions = sessions
+        ssl_object = machine_connection.ssl_object
+        if ssl_object is not None:
+            LOG.info('connected with %s, session resumed: %s', ssl_object.version(), ssl_object.session_reused)
         try:
             connection_serve = app_hub.spawn(machine_connection.serve)
             await connection_serve
@@ -85,4 +153,5 @@ async def machine_connection_factory(reader: StreamReader, writer: StreamWriter)
         finally:
             LOG.info(f"Connection from {address[0]}:{address[1]} disconnect.")
             connection_serve.cancel()
-            machine_connection.set_state(MC_DISCONNECT)
+            if not machine_connection.suspend():
+                machine_connection.set_state(MC_DISCONNECT)
@@ -8,12 +8,18 @@ from async_app_fw.lib.hub import app_hub
 from async_app_fw.event import event
 from async_app_fw.controller.mcp_controller.mcp_state import \
     MC_DISCONNECT, MC_FEATURE, MC_HANDSHAK, MC_STABLE
-from async_app_fw.controller.mcp_controller.master_controller import MachineControlMasterController
+from async_app_fw.controller.mcp_controller.master_controller import DEFAULT_SHARDS, MachineControlMasterController
+from async_app_fw.controller.mcp_controller.mcp_controller import MAX_STRIPES
+from async_app_fw.controller.mcp_controller.mcp_session import DEFAULT_RESUME_TIMEOUT
+from async_app_fw.controller.mcp_controller.mcp_shm import DEFAULT_SHM_SIZE
+from async_app_fw.controller.mcp_controller.mcp_transport import DEFAULT_UNIX_PATH, TRANSPORT_STREAM, UNIX_TRANSPORTS
+from async_app_fw.controller.mcp_controller.master_worker import CoordinatorClient, current_worker
 from async_app_fw.event.mcp_event import mcp_event
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
 
 from .master_lib.constant import APP_NAME
-from .master_lib.event import ReqGetAgentConnection, ReqWaitAgentsConnect
-from .exception import AgentIsNotExist
+from .master_lib.event import ReqForwardRequest, ReqGetAgentConnection, ReqGetAgentsByRTT, ReqWaitAgentsConnect
+from .exception import AgentIsNotExist, AgentOnOtherWorker
 
 spawn = app_hub.spawn
 
@@ -25,6 +31,8 @@ class MCPMasterHandler(BaseApp):
         mcp_event)
 
     _EVENTS.append(ReqGetAgentConnection)
+    _EVENTS.append(ReqGetAgentsByRTT)
+    _EVENTS.append(ReqForwardRequest)
 
     def __init__(self, *_args, **_kwargs):
         super(MCPMasterHandler, self).__init__(*_args, **_kwargs)
@@ -33,11 +41,39 @@ class MCPMasterHandler(BaseApp):
         self.connection_dict = {}
         self.ip_to_connection = {}
         self.connection_event: Dict[str, asyncio.Event] = defaultdict(lambda: asyncio.Event())
+        # set when agent connects to any worker, see ReqWaitAgentsConnect.any_worker.
+        self.any_worker_event: Dict[str, asyncio.Event] = defaultdict(lambda: asyncio.Event())
         self.connection_check_task: Set[asyncio.Task] = set()
+        # TRANSPORT_UNIX adds unix_path, with shm_size, for agents on this host.
+        self.transport = TRANSPORT_STREAM
+        self.unix_path = DEFAULT_UNIX_PATH
+        self.shm_size = DEFAULT_SHM_SIZE
+        # TLS when set, e.g. certfile, keyfile and ca_certs, see lib.tls.
+        self.ssl_args = None
+        # seconds a lost agent has to resume its session, 0 disconnects it at once.
+        self.resume_timeout = DEFAULT_RESUME_TIMEOUT
+        # event loop threads serving agent connections, apps stay in the
+        # loop of app_hub. 1 serves them in that loop too.
+        self.shards = DEFAULT_SHARDS
+        # Worker of this process when the master runs several, see
+        # master_worker, and its connection to the coordinator.
+        self.worker = current_worker()
+        self.coordinator = None
 
     def start(self):
         task = super(MCPMasterHandler, self).start()
-        self.controller = MachineControlMasterController()
+        worker = self.worker
+        if worker is not None:
+            if self.transport in UNIX_TRANSPORTS:
+                raise ValueError(f'Workers of master share a TCP port, the unix path of transport '
+                                 f'{self.transport} can not be shared.')
+            self.coordinator = CoordinatorClient(worker, on_agent_up=self._remote_agent_up)
+            spawn(self.coordinator.connect)
+
+        self.controller = MachineControlMasterController(
+            transport=self.transport, listen_path=self.unix_path, shm_size=self.shm_size,
+            ssl_args=self.ssl_args, resume_timeout=self.resume_timeout, shards=self.shards,
+            reuse_port=worker is not None)
         self.controller.start()
         return task
 
@@ -73,6 +109,12 @@ class MCPMasterHandler(BaseApp):
 
         await asyncio.gather(*coros)
 
+        if self.shards > 1:
+            app_hub.stop_shards()
+
+        if self.coordinator is not None:
+            await self.coordinator.close()
+
     @observe_event(mcp_event.EventMCPStateChange, MC_DISCONNECT)
     def disconnecting_handler(self, ev: event.EventSocketConnecting):
         conn = ev.connection
@@ -80,7 +122,10 @@ class MCPMasterHandler(BaseApp):
 
         if conn.id in self.connection_dict:
             self.connection_dict.pop(conn.id)
-            self.ip_to_connection[ip]
+            if self.ip_to_connection.get(ip) is conn:
+                del self.ip_to_connection[ip]
+                if self.coordinator is not None:
+                    self.coordinator.unregister(ip)
 
             del conn
 
@@ -92,36 +137,120 @@ class MCPMasterHandler(BaseApp):
         # check return connection_id
         # assert conn.id == ev.msg.connection_id
         LOG.info('get hello back')
+        # capability is None if agent doesn't negotiate it.
+        conn.set_peer_capability(ev.msg.get_capability())
 
         conn.set_state(MC_STABLE)
+        if conn.primary is not None:
+            # stripe of an agent, services reach it by its primary connection.
+            return
+
+        # a resumed connection keeps the id of the one it replaces.
         self.connection_dict[conn.id] = conn
         self.ip_to_connection[conn.address[0]] = conn
+        if self.coordinator is not None:
+            self.coordinator.register(conn.address[0])
+        conn.open_session()
+
+        for events in (self.connection_event, self.any_worker_event):
+            if conn.address[0] in events:
+                events[conn.address[0]].set()
+
+    @observe_event_from_self(mcp_event.EventMCPStripeJoin, MC_HANDSHAK)
+    def stripe_join_handler(self, ev):
+        msg = ev.msg
+        conn = msg.connection
+        primary = self.connection_dict.get(msg.agent_id, None)
+
+        if primary is None or primary.address[0] != conn.address[0] \
+                or not primary.supports(mcproto.MCP_CAP_STRIPE) \
+                or not 0 < msg.stripe_index < msg.stripe_count <= MAX_STRIPES \
+                or (primary.stripes is not None and len(primary.stripes) != msg.stripe_count):
+            LOG.warning('Invalid stripe %s of %s of agent %s from %s, close it.',
+                        msg.stripe_index, msg.stripe_count, msg.agent_id, conn.address)
+            conn.set_state(MC_DISCONNECT)
+            conn.close()
+            return
 
-        if conn.address[0] in self.connection_event:
-            self.connection_event[conn.address[0]].set()
+        primary.add_stripe(conn, msg.stripe_index, msg.stripe_count)
+
+    def _remote_agent_up(self, agent):
+        if agent in self.any_worker_event:
+            self.any_worker_event[agent].set()
+
+    def is_agent_connected(self, agent, any_worker=False):
+        """
+        agent is connected to this worker, the ones ReqGetAgentConnection
+        returns. any_worker also counts the ones of other workers, which
+        are reached by ReqForwardRequest.
+        """
+        return agent in self.ip_to_connection or \
+            any_worker and self.coordinator is not None and self.coordinator.worker_of(agent) is not None
 
     @observe_event(ReqGetAgentConnection)
     def get_agent_connection_handler(self, ev: ReqGetAgentConnection):
-        result = self.ip_to_connection.get(ev.agent, None) or AgentIsNotExist(ev.agent)
+        # a connection can't be handed to another process, services which
+        # use it only reach agents of their worker.
+        result = self.ip_to_connection.get(ev.agent, None)
+        if result is None:
+            worker = self.coordinator.worker_of(ev.agent) if self.coordinator is not None else None
+            result = AgentIsNotExist(ev.agent) if worker is None else AgentOnOtherWorker(ev.agent, worker)
+        ev.push_reply(result)
+
+    async def forward_request(self, ev: ReqForwardRequest):
+        try:
+            if self.coordinator is None or ev.agent in self.ip_to_connection:
+                result = await ev.req_cls.send_request(*ev.args, timeout=ev.timeout, **ev.kwargs)
+            else:
+                result = await self.coordinator.forward(
+                    ev.agent, (ev.req_cls, ev.args, ev.kwargs, ev.timeout), timeout=ev.timeout)
+        except Exception as e:
+            result = e
         ev.push_reply(result)
 
+    @observe_event(ReqForwardRequest)
+    def forward_request_handler(self, ev: ReqForwardRequest):
+        spawn(self.forward_request, ev)
+
+    def agents_by_rtt(self, agents=None):
+        """
+        Connected agents ordered by the mean heartbeat round trip time of
+        their connection, the ones without one yet last. Only agents of
+        this worker when the master runs several.
+        """
+        ip_to_connection = self.ip_to_connection
+        if agents is None:
+            agents = list(ip_to_connection)
+
+        connected = {}
+        for agent in agents:
+            conn = ip_to_connection.get(agent, None)
+            if conn is not None and conn.latest().state != MC_DISCONNECT:
+                connected[agent] = conn.latest().rtt
+
+        return sorted(connected, key=lambda agent: (connected[agent].count == 0, connected[agent].mean))
+
+    @observe_event(ReqGetAgentsByRTT)
+    def get_agents_by_rtt_handler(self, ev: ReqGetAgentsByRTT):
+        ev.push_reply(self.agents_by_rtt(ev.agents))
+
     async def check_connection(self, ev: ReqWaitAgentsConnect):
         agents:list = ev.agents
-        ip_to_connection = self.ip_to_connection
 
         remaining_agents = []
 
         event_dict = {}
         wait_coros = []
+        events = self.any_worker_event if ev.any_worker else self.connection_event
 
         for agent in agents:
             # check the target agent exist or not.
-            if agent in ip_to_connection:
+            if self.is_agent_connected(agent, ev.any_worker):
                 continue
 
             # create task to wait conenction event been set.
             remaining_agents.append(agent)
-            conn_event: asyncio.Event = self.connection_event[agent]
+            conn_event: asyncio.Event = events[agent]
             if conn_event.is_set():
                 conn_event.clear()
             event_dict[agent] = conn_event
@@ -1,6 +1,7 @@
 from async_app_fw.event.async_event import EventAsyncRequestBase
 from .constant import APP_NAME
 
+
 class ReqGetAgentConnection(EventAsyncRequestBase):
     REQUEST_NAME = 'Requet, Check Agent Exist.'
     DST_NAME = APP_NAME
@@ -9,11 +10,39 @@ class ReqGetAgentConnection(EventAsyncRequestBase):
         super().__init__(timeout)
         self.agent = agent
 
+
 class ReqWaitAgentsConnect(EventAsyncRequestBase):
     REQUEST_NAME = 'Requet, Check Agent Connect.'
     DST_NAME = APP_NAME
 
-    def __init__(self, agents, wait_connection_timeout=10, timeout=None):
+    def __init__(self, agents, wait_connection_timeout=10, timeout=None, any_worker=False):
         super().__init__(timeout=None)
         self.wait_connection_timeout = wait_connection_timeout
-        self.agents = agents
\ No newline at end of file
+        self.agents = agents
+        # agents connected to another worker of the master count too, they
+        # are reached by ReqForwardRequest, not ReqGetAgentConnection.
+        self.any_worker = any_worker
+
+
+class ReqGetAgentsByRTT(EventAsyncRequestBase):
+    REQUEST_NAME = 'Requet, Agents By Heartbeat RTT.'
+    DST_NAME = APP_NAME
+
+    def __init__(self, agents=None, timeout=5):
+        super().__init__(timeout)
+        # only these agents when set, agents not connected are left out.
+        self.agents = agents
+
+
+class ReqForwardRequest(EventAsyncRequestBase):
+    REQUEST_NAME = 'Requet, Forward To Worker Of Agent.'
+    DST_NAME = APP_NAME
+
+    def __init__(self, agent, req_cls, args=(), kwargs=None, timeout=5):
+        super().__init__(timeout)
+        self.agent = agent
+        # req_cls(*args, **kwargs) is sent by the worker of master agent is
+        # connected to, see master_worker. They are pickled to get there.
+        self.req_cls = req_cls
+        self.args = args
+        self.kwargs = kwargs or {}
@@ -24,6 +24,11 @@ The main component of Wiresahrk controller.
 import logging
 import random
 import asyncio
+import functools
+import struct
+import threading
+import time
+from collections import deque
 from asyncio import CancelledError, StreamWriter, StreamReader, Task
 from socket import IPPROTO_TCP, socket
 from socket import TCP_NODELAY
@@ -33,7 +38,13 @@ import ssl
 
 from async_app_fw.base.app_manager import BaseApp, lookup_service_brick
 from async_app_fw.lib import hub
-from async_app_fw.controller.mcp_controller.mcp_state import MC_DISCONNECT, MC_HANDSHAK
+from async_app_fw.lib.histogram import Histogram
+from async_app_fw.controller.mcp_controller.mcp_state import MC_DISCONNECT, MC_HANDSHAK, MC_SUSPENDED
+from async_app_fw.controller.mcp_controller.mcp_send_lane import SendLanes
+from async_app_fw.controller.mcp_controller.mcp_transport import MCPBufferedProtocol, is_unix, peer_address
+from async_app_fw.controller.mcp_controller import mcp_session, mcp_shm
+from async_app_fw.controller.mcp_controller.exception import MachineConnectionLost
+from async_app_fw.event.async_event import REQ_WAIT_REPLY
 from async_app_fw.event.mcp_event import mcp_event
 from async_app_fw.event import event
 
@@ -41,10 +52,64 @@ from async_app_fw.event import event
 from async_app_fw.lib import ip
 # from async_app_fw.base.app_manager import BaseApp, lookup_service_brick
 from async_app_fw.protocol.mcp import mcp_common, mcp_parser, mcp_v_1_0 as mcproto, mcp_parser_v_1_0 as mcproto_parser
+from async_app_fw.protocol.mcp import mcp_compression, mcp_fragment
+from async_app_fw.protocol.mcp.mcp_capability import Capability
 
 LOG = logging.getLogger(
     'eventlent_framework.controller.controller.mcp_controller')
 
+# send-side coalescing of queued messages into MCPBatch.
+# no more messages are added to a batch once it reaches this size.
+DEFAULT_BATCH_MAX_BYTES = 64 * 1024
+# seconds to wait for more messages when only one is queued, 0 to send at once.
+DEFAULT_BATCH_DELAY = 0
+
+# frames smaller than this are never compressed.
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+# outgoing frames are serialized into a reused buffer of this size,
+# larger than a full flush. A buffer grown above it is not reused.
+DEFAULT_WRITE_BUFFER_SIZE = 256 * 1024
+# queued frames are written with one call until this many bytes.
+DEFAULT_FLUSH_MAX_BYTES = 128 * 1024
+# write buffer limits of transport, drain() is awaited only above high.
+DEFAULT_WRITE_HIGH_WATERMARK = 64 * 1024
+DEFAULT_WRITE_LOW_WATERMARK = 16 * 1024
+
+# what send_nowait does when the send lane of a frame is full.
+# wait: keep the frame in order in a backlog, queued by one task as room frees up.
+SEND_OVERFLOW_WAIT = 'wait'
+# drop: discard the frame and return False, frames closing the socket are kept.
+SEND_OVERFLOW_DROP = 'drop'
+# raise: raise SendQueueFull.
+SEND_OVERFLOW_RAISE = 'raise'
+DEFAULT_SEND_OVERFLOW_POLICY = SEND_OVERFLOW_WAIT
+
+# seconds between two MCPHeartbeat when MCP_CAP_HEARTBEAT is negotiated, 0
+# disables them. The peer is dead once this many are not replied in a row.
+DEFAULT_HEARTBEAT_INTERVAL = 5
+DEFAULT_HEARTBEAT_MAX_MISSED = 3
+
+_BATCH_HEADER_SIZE = mcproto.MCP_HEADER_SIZE + mcproto.MCP_BATCH_SIZE
+_MSG_TYPE = struct.Struct('!H')
+
+# connections of one agent, the primary one included.
+MAX_STRIPES = 16
+# fields of service messages, a service is pinned to a stripe by the
+# first of them its messages have.
+STRIPE_KEY_FIELDS = ('capture_id', 'cmd_id', 'api_action_id', 'job_id')
+# message class: its stripe key field or None
+_STRIPE_KEY_FIELD = {}
+
+
+def _stripe_key_field(msg_cls):
+    try:
+        return _STRIPE_KEY_FIELD[msg_cls]
+    except KeyError:
+        field = next((name for name in STRIPE_KEY_FIELDS if name in msg_cls._field_names), None)
+        _STRIPE_KEY_FIELD[msg_cls] = field
+        return field
+
 
 def _split_addr(addr):
     """
@@ -92,21 +157,123 @@ def _deactivate(method):
 
     return deactivate
 
+
+def _in_shard(handed_off=None):
+    """
+    Run the method in the thread of the hub shard serving the connection.
+    Called by another thread, e.g. an app when connections are sharded, the
+    call is handed off to that shard and handed_off is returned.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def in_shard(self, *args, **kwargs):
+            shard = self.shard
+            if shard.in_thread():
+                return method(self, *args, **kwargs)
+            shard.call_soon(functools.partial(method, self, *args, **kwargs))
+            return handed_off
+
+        return in_shard
+
+    return decorator
+
+
+def _fail_request(req, exception):
+    if getattr(req, 'req_state', None) == REQ_WAIT_REPLY:
+        req.push_reply(exception)
+
+
 class MachineConnectionIsServing(Exception):
     pass
 
+class SendQueueFull(Exception):
+    pass
+
 class MachineConnection(object):
-    def __init__(self, reader: StreamReader, writer: StreamWriter, mcp_brick_name):
+    def __init__(self, reader: StreamReader, writer: StreamWriter, mcp_brick_name, capability: Capability = None):
         self.socket: socket = writer.get_extra_info('socket')
-        self.address = writer.get_extra_info('peername')
-        self.socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        self.address = peer_address(writer)
+        # peer is on this host, connected by a unix domain socket.
+        self.is_local = is_unix(self.socket)
+        if not self.is_local:
+            self.socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
         self.reader = reader
         self.writer = writer
+        # ssl.SSLObject of a TLS connection, None if it's cleartext.
+        self.ssl_object = writer.get_extra_info('ssl_object')
         self.is_active = True
+        # shard of app_hub whose loop serves the connection, see hub.StreamServer.
+        self.shard: hub.HubShard = hub.app_hub.current_shard() or hub.app_hub.main_shard
 
         # The limit is arbitrary. We need to limit queue size to
-        # prevent it from eating memory up.
-        self.send_q = hub.Queue(1000)
+        # prevent it from eating memory up. Control messages don't wait
+        # behind bulk data of services, see mcp_send_lane.
+        self.send_q = SendLanes()
+        self.send_overflow_policy = DEFAULT_SEND_OVERFLOW_POLICY
+        self.send_overflows = 0
+        self.write_buffer_size = DEFAULT_WRITE_BUFFER_SIZE
+        self._write_buf = bytearray(self.write_buffer_size)
+        self.flush_max_bytes = DEFAULT_FLUSH_MAX_BYTES
+        self.write_high_watermark = DEFAULT_WRITE_HIGH_WATERMARK
+        self.write_low_watermark = DEFAULT_WRITE_LOW_WATERMARK
+        # frames and bytes written by each flush of send loop.
+        self.flush_frames = Histogram()
+        self.flush_bytes = Histogram()
+        self.set_write_watermarks()
+        self.batch_max_bytes = DEFAULT_BATCH_MAX_BYTES
+        self.batch_delay = DEFAULT_BATCH_DELAY
+        self.compression_threshold = DEFAULT_COMPRESSION_THRESHOLD
+        # negotiated algorithm, None if frames are sent uncompressed.
+        self.compression_algorithm = None
+        self.compression_stats = mcp_compression.CompressionStats()
+        # frames larger than this are fragmented when MCP_CAP_FRAGMENT is negotiated.
+        self.fragment_size = mcp_fragment.DEFAULT_FRAGMENT_SIZE
+        # (iterator of fragments not sent yet, messages of the session in
+        # the frame or None), one for each frame.
+        self._fragment_streams = deque()
+        self._fragment_stream_id = 0
+        self.reassembler = mcp_fragment.FragmentReassembler()
+        # size of the shared memory ring offered to a local peer when
+        # MCP_CAP_SHM is negotiated, 0 to send every frame by the socket.
+        self.shm_size = mcp_shm.DEFAULT_SHM_SIZE
+        self.shm_threshold = mcp_shm.DEFAULT_SHM_THRESHOLD
+        # frames sent through the ring, and ones sent by the socket because it was full.
+        self.shm_frames = 0
+        self.shm_fallbacks = 0
+        # ring of sent frames offered to the peer, used once it's attached.
+        self._shm_offered: mcp_shm.ShmRing = None
+        self._shm_tx: mcp_shm.ShmRing = None
+        # ring of the peer.
+        self._shm_rx: mcp_shm.ShmRing = None
+        # sessions of this end, None if it doesn't resume sessions.
+        self.sessions: mcp_session.SessionTable = None
+        # session of the agent carried by this primary connection.
+        self.session: mcp_session.Session = None
+        # serialized messages of the frame being flushed, numbered once it is sent.
+        self._session_unit = []
+        # connection which resumed the session of this one, sends are
+        # forwarded to it.
+        self.successor: MachineConnection = None
+        # suspended connection whose session this one asked to resume, agent only.
+        self._resuming: MachineConnection = None
+        self._resume_timer: asyncio.TimerHandle = None
+        # resume asked by the agent is run by the shard of its lost
+        # connection, no session is opened meanwhile, master only.
+        self._resume_pending = False
+        self.heartbeat_interval = DEFAULT_HEARTBEAT_INTERVAL
+        self.heartbeat_max_missed = DEFAULT_HEARTBEAT_MAX_MISSED
+        # heartbeats sent and not replied yet.
+        self.heartbeat_missed = 0
+        self._heartbeat_seq = 0
+        # seconds of heartbeat round trips, in microsecond buckets.
+        self.rtt = Histogram(scale=1e6)
+        # requests of services waiting for a reply of the agent by xid,
+        # failed with MachineConnectionLost once it's disconnected.
+        self.pending_requests = {}
+        # apps in other threads than the shard of the connection register
+        # requests and allocate xids, see _in_shard.
+        self._requests_lock = threading.Lock()
+        self._xid_lock = threading.Lock()
 
         self.mcproto_parser = mcproto_parser
         self.mcproto = mcproto
@@ -114,6 +281,16 @@ class MachineConnection(object):
         self.xid = random.randint(0, self.mcproto.MAX_XID)
         # self.mcp_proto.MAX_XID)
         self.id = 0  # machine_id is unknown yet
+        # what this end supports, announced in hello.
+        self.local_capability = capability or Capability()
+        # what both ends support, set when hello of peer is received.
+        self.capability = None
+        # primary connection of the agent, when this one is a stripe of it.
+        self.primary: MachineConnection = None
+        self.stripe_index = 0
+        # stripes of a primary connection by index, itself at 0. None
+        # if the agent has one connection.
+        self.stripes = None
         self.state = None
         self.mcp_brick: BaseApp = lookup_service_brick(
             mcp_brick_name)
@@ -121,16 +298,35 @@ class MachineConnection(object):
         self._serve_task = None
 
     def _close_write(self):
+        if self.ssl_object is not None:
+            # TLS can't close one direction, close_notify is sent after
+            # the frames written so far.
+            self.writer.close()
+            return
+
         # Note: Close only further sends in order to wait for the switch to
         # disconnect this connection.
         try:
             self.socket.shutdown(SHUT_WR)
         except (EOFError, IOError):
             pass
+        except TypeError:
+            # socket of uvloop can't shutdown, its transport does once the
+            # frames written so far are sent.
+            transport = self.writer.transport
+            if not transport.is_closing() and transport.can_write_eof():
+                transport.write_eof()
 
+    @_in_shard()
     def close(self):
         self._close_write()
 
+    def _run_brick_handlers(self, ev, state):
+        # handlers of mcp_brick run in the thread of its loop.
+        for handler in self.mcp_brick.get_handlers(ev, state):
+            self.mcp_brick.shard.call(handler, ev)
+
+    @_in_shard()
     def set_state(self, state):
         if self.state == state:
             return
@@ -139,15 +335,533 @@ class MachineConnection(object):
         # change state before send.
         self.state = state
 
+        if state == MC_DISCONNECT:
+            self._leave_stripes()
+            self._end_session()
+            self.fail_pending_requests(MachineConnectionLost(self.address, 'disconnected'))
+
         if self.mcp_brick != None:
-            self.mcp_brick.send_event_to_observers(ev, state)
-            handlers = self.mcp_brick.get_handlers(ev, state)
+            # a stripe is part of the agent of its primary connection,
+            # services only see state changes of the primary one.
+            if self.primary is None:
+                self.mcp_brick.send_event_to_observers(ev, state)
+            self._run_brick_handlers(ev, state)
+
+    def add_stripe(self, conn, index, count):
+        """
+        conn joins the agent of this primary connection as stripe index of
+        count stripes, the same count for every stripe of the agent.
+        """
+        assert 0 < index < count <= MAX_STRIPES, f'Invalid stripe {index} of {count}.'
+        stripes = self.stripes
+        if stripes is None:
+            # stripes not joined yet are served by the primary connection.
+            self.stripes = stripes = [self] * count
+        assert len(stripes) == count, f'Stripe count {count} of agent {self.id} was {len(stripes)}.'
+        stripes[index] = conn
+        conn.primary = self
+        conn.stripe_index = index
+        LOG.debug('Stripe %d of agent %s joined from %s.', index, self.id, conn.address)
+
+    def _leave_stripes(self):
+        primary = self.primary
+        if primary is not None:
+            # services pinned to the stripe fall back to the primary connection.
+            stripes = primary.stripes
+            if stripes is not None and self.stripe_index < len(stripes) \
+                    and stripes[self.stripe_index] is self:
+                stripes[self.stripe_index] = primary
+        elif self.stripes is not None:
+            stripes = self.stripes
+            self.stripes = None
+            for conn in stripes:
+                if conn is not self:
+                    conn.close()
+
+    def _stripe(self, buf):
+        """
+        Connection of the stripe buf is pinned to. Keys map onto the stripe
+        count of the agent, which doesn't change as stripes join or leave.
+        """
+        if isinstance(buf, mcproto_parser.MCPMsgBase):
+            field = _stripe_key_field(buf.__class__)
+            if field is not None:
+                key = getattr(buf, field)
+                if key is not None:
+                    stripes = self.stripes
+                    return stripes[key % len(stripes)]
+        return self
+
+    def set_peer_capability(self, peer_capability):
+        """
+        Record the negotiated capability of connection.
+        peer_capability is None if the peer doesn't negotiate capability.
+        """
+        self.capability = self.local_capability.negotiate(peer_capability)
+        if self.capability.supports(mcproto.MCP_CAP_COMPRESSION):
+            self.compression_algorithm = mcp_compression.choose_algorithm(self.capability.compression)
+        LOG.debug('Negotiated capability with %s: %s', self.address, self.capability)
+        if self.is_local and self.shm_size > 0 and self.supports(mcproto.MCP_CAP_SHM):
+            self._offer_shm()
+
+    def supports(self, feature):
+        """Both ends support feature, mcp_v_1_0.MCP_CAP_*."""
+        return self.capability is not None and self.capability.supports(feature)
+
+    def _offer_shm(self):
+        try:
+            ring = mcp_shm.ShmRing.create(self.shm_size)
+        except OSError as e:
+            LOG.warning('Failed to create shared memory ring for %s: %s', self.address, e)
+            return
+
+        self._shm_offered = ring
+        self.send_msg_nowait(self.mcproto_parser.MCPShmAttach(self, ring.name, ring.size))
+
+    def _shm_attach(self, msg):
+        """Attach the ring offered by the peer and tell whether it is used."""
+        ring = None
+        try:
+            ring = mcp_shm.ShmRing.attach(msg.name)
+            if ring.size != msg.size:
+                raise ValueError(f'size {ring.size} is not the offered {msg.size}.')
+        except (OSError, ValueError) as e:
+            LOG.warning('Failed to attach shared memory ring %s of %s: %s', msg.name, self.address, e)
+            if ring is not None:
+                ring.close()
+            ring = None
+
+        if self._shm_rx is not None:
+            self._shm_rx.close()
+        self._shm_rx = ring
+        self.send_msg_nowait(self.mcproto_parser.MCPShmAttached(self, int(ring is not None)))
+
+    def _shm_attached(self, msg):
+        ring = self._shm_offered
+        self._shm_offered = None
+        if ring is None:
+            return
+        if msg.attached:
+            self._shm_tx = ring
+        else:
+            ring.close()
+
+    def _recv_shm_frame(self, frame):
+        (frame_offset, frame_len, end) = struct.unpack_from(
+            mcproto.MCP_SHM_FRAME_STR, frame, mcproto.MCP_HEADER_SIZE)
+        ring = self._shm_rx
+        if ring is None:
+            raise mcp_parser.WrongMcpMsgHeader('Shared memory frame received without a ring attached.')
+
+        with ring.frame(frame_offset, frame_len) as shm_frame:
+            self._recv_frame(shm_frame)
+        # messages copied what they kept, see release_buf.
+        ring.release(end)
+
+    def _put_shm(self, start, end):
+        """
+        Move the frame between start and end of the write buffer into the
+        shared memory ring and put a reference to it at start. Return the
+        end of the frame sent by the socket.
+        """
+        with memoryview(self._write_buf) as view:
+            with view[start:end] as frame:
+                ref = self._shm_tx.put(frame)
+
+        if ref is None:
+            self.shm_fallbacks += 1
+            return end
+
+        self.shm_frames += 1
+        frame_offset, ring_end = ref
+        return start + self.mcproto_parser.MCPShmFrame.pack_into(
+            self._write_buf, start, frame_offset, end - start, ring_end)
+
+    def _close_shm(self):
+        for name in ('_shm_offered', '_shm_tx', '_shm_rx'):
+            ring = getattr(self, name)
+            if ring is not None:
+                setattr(self, name, None)
+                ring.close()
+
+    def latest(self):
+        """Connection which carries the session of this one now, itself unless it was resumed."""
+        conn = self
+        while conn.successor is not None:
+            conn = conn.successor
+        return conn
+
+    def _attach_session(self, session):
+        self.session = session
+        session.connection = self
+
+    @_in_shard()
+    def open_session(self):
+        """Open a session on this primary connection after hello, master only."""
+        if self.sessions is None or self.session is not None or self._resume_pending \
+                or not self.supports(mcproto.MCP_CAP_RESUME):
+            return
+        session = self.sessions.new_session()
+        self._attach_session(session)
+        self.send_msg_nowait(self.mcproto_parser.MCPSessionOpen(self, session.session_id))
+
+    def _session_open(self, msg):
+        session = self.session
+        if session is not None:
+            # echo of the agent, its messages are numbered from here on.
+            if msg.session_id == session.session_id:
+                session.counting = True
+            return
+
+        if self.sessions is None or not self.supports(mcproto.MCP_CAP_RESUME):
+            return
+        session = self.sessions.new_session(msg.session_id)
+        session.counting = True
+        self._attach_session(session)
+        self.send_msg_nowait(self.mcproto_parser.MCPSessionOpen(self, session.session_id))
+
+    def resume_session(self):
+        """
+        Ask master to resume the session of a suspended connection, sent
+        before the hello reply, agent only. Return False if there is none,
+        else the connection is stable once MCPSessionResumed is received.
+        """
+        if self.sessions is None or not self.supports(mcproto.MCP_CAP_RESUME):
+            return False
+        old = self.sessions.suspended()
+        if old is None:
+            return False
+
+        self._resuming = old
+        session = old.session
+        self.send_msg_nowait(self.mcproto_parser.MCPSessionResume(self, session.session_id, session.received))
+        return True
+
+    def _session_resume(self, msg):
+        parser = self.mcproto_parser
+        session = self.sessions.get(msg.session_id) if self.sessions is not None else None
+        old = session.connection if session is not None else None
+        if old is not None and old is not self and not old.shard.in_thread():
+            # the session is kept by the thread of the lost connection.
+            self._resume_pending = True
+            old.shard.call_soon(self._session_resume, msg)
+            return
+
+        frames = None
+        if old is not None and old is not self and old.supports(mcproto.MCP_CAP_RESUME):
+            frames = session.replay(msg.received)
+
+        resume_pending = self._resume_pending
+        self._resume_pending = False
+        if frames is None:
+            LOG.info('Session 0x%x of %s can not be resumed.', msg.session_id, self.address)
+            if old is not None and old.state == MC_SUSPENDED:
+                old._resume_expired()
+            self.send_msg_nowait(parser.MCPSessionResumed(self, 0, 0))
+            if resume_pending:
+                # skipped after hello while the resume was pending.
+                self.open_session()
+            return
+
+        # before the frames sent again, so the agent numbers them.
+        self.send_msg_nowait(parser.MCPSessionResumed(self, 1, session.received))
+        old._hand_over(self, frames)
+
+    def _session_resumed(self, msg):
+        old = self._resuming
+        self._resuming = None
+        if old is None or old.session is None:
+            if msg.resumed:
+                # master goes on with a session this end doesn't have.
+                self.set_state(MC_DISCONNECT)
+                self.close()
+            return
+
+        frames = old.session.replay(msg.received) if msg.resumed else None
+        if frames is not None:
+            old._hand_over(self, frames)
+            return
+
+        old._resume_expired()
+        if msg.resumed:
+            self.set_state(MC_DISCONNECT)
+            self.close()
+
+    def _hand_over(self, conn, frames):
+        """
+        conn resumed the session of this connection. frames are sent again
+        before the held ones, sends to this connection go to conn from now on.
+        """
+        session = self.session
+        if self.send_q is not None or self._fragment_streams:
+            # lost on this side, the peer reconnected before it was noticed.
+            self._hold_unsent()
+        if isinstance(self.reader, MCPBufferedProtocol):
+            self.reader.set_frame_handler(None)
+        self._leave_stripes()
+        self._cancel_resume_timer()
+        self.session = None
+        self.successor = conn
+
+        conn.id = self.id
+        conn._attach_session(session)
+        with self._requests_lock:
+            requests = self.pending_requests
+            self.pending_requests = {}
+        with conn._requests_lock:
+            conn.pending_requests.update(requests)
+        held = session.take_held()
+        for frame in frames:
+            conn.send_nowait(frame)
+        for buf, close_socket in held:
+            conn.send_nowait(buf, close_socket)
+        LOG.info('Session 0x%x of agent %s resumed from %s, %d messages sent again, %d held.',
+                 session.session_id, self.id, conn.address, len(frames), len(held))
+
+        if self._serve_task is not None and not self._serve_task.done():
+            self._serve_task.cancel()
+
+    def suspend(self):
+        """
+        The connection is lost. Keep it suspended while its session waits
+        to be resumed and return True, return False if it's disconnected.
+        """
+        if self.successor is not None:
+            return True
+        session = self.session
+        if session is None or not session.resumable or self.state == MC_DISCONNECT:
+            return False
+
+        self.set_state(MC_SUSPENDED)
+        self._resume_timer = asyncio.get_event_loop().call_later(session.resume_timeout, self._resume_expired)
+        LOG.info('Connection of agent %s from %s is lost, session 0x%x waits %s sec to be resumed.',
+                 self.id, self.address, session.session_id, session.resume_timeout)
+        return True
+
+    def _resume_expired(self):
+        self._resume_timer = None
+        if self.successor is not None or self.state == MC_DISCONNECT:
+            return
+        LOG.info('Session of agent %s from %s is not resumed.', self.id, self.address)
+        self.set_state(MC_DISCONNECT)
+
+    def _cancel_resume_timer(self):
+        if self._resume_timer is not None:
+            self._resume_timer.cancel()
+            self._resume_timer = None
+
+    def _end_session(self):
+        self._cancel_resume_timer()
+        session = self.session
+        if session is None:
+            return
+        self.session = None
+        session.held.clear()
+        if self.sessions is not None:
+            self.sessions.remove(session)
+
+    def _hold_unsent(self):
+        """Hold what is queued but not sent yet, it's sent once the session is resumed."""
+        q = self.send_q
+        self.send_q = None
+        session = self.session
+        # the peer drops the fragments of a frame not sent completely.
+        for _, unit in self._fragment_streams:
+            for frame in unit or ():
+                session.hold((frame, False))
+        self._fragment_streams.clear()
+        if q is not None:
+            for item in q.drain():
+                session.hold(item)
+
+    def _hold(self, buf, close_socket):
+        if self.session.hold((buf, close_socket)):
+            return True
+        # not called back from a send of a service.
+        asyncio.get_event_loop().call_soon(self._resume_expired)
+        return False
+
+    def _record(self, item, offset, end):
+        """Keep a sequenced frame written between offset and end of the write buffer."""
+        (msg_type, ) = _MSG_TYPE.unpack_from(item)
+        msg_type &= ~mcproto.MCP_FLAG_COMPRESSED
+
+        session = self.session
+        if msg_type in mcp_session.UNSEQUENCED_MSG_TYPES:
+            if msg_type == mcproto.MCP_SESSION_OPEN:
+                # messages after it are numbered by the peer.
+                session.recording = True
+        elif session.recording:
+            self._session_unit.append(self._write_buf[offset:end])
+
+    def _take_session_unit(self):
+        unit = self._session_unit
+        if not unit:
+            return None
+        self._session_unit = []
+        return unit
+
+    def _commit_session_unit(self, unit):
+        session = self.session
+        if session is None or unit is None:
+            return
+        for frame in unit:
+            session.record(frame)
+
+    def _session_ack(self, msg):
+        session = self.session
+        if session is not None:
+            session.ack(msg.received)
+
+    def _requests_owner(self):
+        # replies of a request may come by any stripe, requests are kept by
+        # the primary connection which carries the session now.
+        conn = self.primary or self
+        return conn.latest()
+
+    def add_pending_request(self, xid, req):
+        """req waits for the reply of xid, see fail_pending_requests."""
+        owner = self._requests_owner()
+        with owner._requests_lock:
+            owner.pending_requests[xid] = req
+
+    def pop_pending_request(self, xid):
+        """Request waiting for the reply of xid, None if there is none."""
+        owner = self._requests_owner()
+        with owner._requests_lock:
+            return owner.pending_requests.pop(xid, None)
 
-            for handler in handlers:
-                handler(ev)
+    def fail_pending_requests(self, exception):
+        """Reply exception to every request waiting for a reply by this connection."""
+        with self._requests_lock:
+            requests = self.pending_requests
+            if not requests:
+                return
+            self.pending_requests = {}
+        for req in requests.values():
+            # requests are sent by apps, replied in their loop.
+            hub.app_hub.main_shard.call(_fail_request, req, exception)
+        LOG.info('%d requests to agent %s failed: %s', len(requests), self.id, exception)
+
+    async def _heartbeat_loop(self):
+        parser = self.mcproto_parser
+        try:
+            while self.heartbeat_interval > 0:
+                await asyncio.sleep(self.heartbeat_interval)
+                if not self.supports(mcproto.MCP_CAP_HEARTBEAT) or self.state == MC_DISCONNECT:
+                    continue
+                if self.heartbeat_missed >= self.heartbeat_max_missed:
+                    self._peer_dead()
+                    return
+                self.heartbeat_missed += 1
+                self._heartbeat_seq = (self._heartbeat_seq + 1) & 0xffffffff
+                self.send_msg_nowait(parser.MCPHeartbeat(self, self._heartbeat_seq, time.monotonic_ns()))
+        except CancelledError:
+            LOG.debug("Stop _heartbeat_loop at address %s", self.address)
+
+    def _heartbeat(self, msg):
+        self.send_msg_nowait(self.mcproto_parser.MCPHeartbeatReply(self, msg.seq, msg.timestamp))
+
+    def _heartbeat_reply(self, msg):
+        self.heartbeat_missed = 0
+        self.rtt.record((time.monotonic_ns() - msg.timestamp) / 1e9)
+
+    def _peer_dead(self):
+        """
+        The peer missed heartbeat_max_missed heartbeats. Fail its requests
+        and abort the connection, which is then suspended or disconnected.
+        """
+        LOG.warning('%s missed %d heartbeats, connection is aborted.', self.address, self.heartbeat_missed)
+        self._requests_owner().fail_pending_requests(
+            MachineConnectionLost(self.address, f'{self.heartbeat_missed} heartbeats missed'))
+        transport = self.writer.transport
+        if transport is not None:
+            transport.abort()
+
+    def _dispatch_msg(self, msg):
+        # decode event and create event
+        ev = mcp_event.mcp_msg_to_ev(msg)
+        if self.mcp_brick is not None:
+            # send event to observers and self event handlers
+            self.mcp_brick.send_event_to_observers(
+                ev, self.state)
+            self.mcp_brick.send_event_to_self(ev, self.state)
+
+    def _recv_frame(self, frame: memoryview):
+        (msg_type, msg_len, version_id, xid) = mcp_parser.header(frame)
+        if msg_type & mcproto.MCP_FLAG_COMPRESSED:
+            self._recv_frame(mcp_compression.decompress_frame(
+                frame, self.local_capability.max_frame_size, self.compression_stats))
+            return
+
+        if msg_type == self.mcproto.MCP_BATCH:
+            for sub_frame in self.mcproto_parser.iter_batch_frames(frame):
+                self._recv_frame(sub_frame)
+            return
+
+        if msg_type == self.mcproto.MCP_FRAGMENT:
+            frame = self.reassembler.push(frame)
+            if frame is not None:
+                self._recv_frame(frame)
+            return
+
+        if msg_type == self.mcproto.MCP_SHM_FRAME:
+            self._recv_shm_frame(frame)
+            return
+
+        session = self.session
+        if session is not None and session.counting and msg_type not in mcp_session.UNSEQUENCED_MSG_TYPES:
+            if session.count_received():
+                self.send_msg_nowait(self.mcproto_parser.MCPSessionAck(self, session.received))
+
+        msg = mcp_parser.msg(
+            self, msg_type, msg_len, version_id, xid, frame)
+
+        if msg_type == self.mcproto.MCP_SHM_ATTACH:
+            self._shm_attach(msg)
+        elif msg_type == self.mcproto.MCP_SHM_ATTACHED:
+            self._shm_attached(msg)
+        elif msg_type == self.mcproto.MCP_HEARTBEAT:
+            self._heartbeat(msg)
+        elif msg_type == self.mcproto.MCP_HEARTBEAT_REPLY:
+            self._heartbeat_reply(msg)
+        elif msg_type == self.mcproto.MCP_SESSION_ACK:
+            self._session_ack(msg)
+        elif msg_type == self.mcproto.MCP_SESSION_OPEN:
+            self._session_open(msg)
+        elif msg_type == self.mcproto.MCP_SESSION_RESUME:
+            self._session_resume(msg)
+        elif msg_type == self.mcproto.MCP_SESSION_RESUMED:
+            # the handler of the agent makes the connection stable.
+            self._session_resumed(msg)
+            self._dispatch_msg(msg)
+            msg.release_buf()
+        elif msg:
+            self._dispatch_msg(msg)
+            # frame memory will be reused after return.
+            msg.release_buf()
+
+    async def _buffered_recv_loop(self):
+        protocol: MCPBufferedProtocol = self.reader
+        protocol.set_frame_handler(self._recv_frame)
+
+        try:
+            await protocol.wait_closed()
+        except CancelledError:
+            return
+        finally:
+            protocol.set_frame_handler(None)
+
+        exception = protocol.exception()
+        if exception is not None and not isinstance(exception, (EOFError, IOError)):
+            raise exception
 
     @_deactivate
     def _recv_loop(self):
+        if isinstance(self.reader, MCPBufferedProtocol):
+            # frames are pushed by protocol, see _recv_frame.
+            return hub.app_hub.spawn(self._buffered_recv_loop)
+
         async def _async_recv_loop():
             buf = bytearray()
             min_read_len = remaining_read_len = mcp_common.MCP_HEADER_SIZE
@@ -156,18 +870,16 @@ class MachineConnection(object):
 
             while self.state != MC_DISCONNECT:
                 try:
-                    read_len = min_read_len
-                    if read_len > remaining_read_len:
-                        read_len = remaining_read_len
-
-                    ret = await self.reader.readexactly(read_len)
+                    # rest of the frame at once, not a header size at a time.
+                    ret = await self.reader.readexactly(remaining_read_len)
                 except SocketTimeout:
                     LOG.warning('Socket timeout.')
                     continue
-                except ssl.SSLError:
-                    # eventlet throws SSLError (which is a subclass of IOError)
-                    # on SSL socket read timeout; re-try the loop in this case.
-                    continue
+                except ssl.SSLError as e:
+                    # an error of the TLS stream is fatal, the reader
+                    # raises it again on every read.
+                    LOG.debug('TLS error from %s: %s', self.address, e)
+                    break
                 except (EOFError, IOError):
                     break
                 except CancelledError as e:
@@ -190,17 +902,7 @@ class MachineConnection(object):
                         remaining_read_len = (msg_len - buf_len)
                         break
 
-                    msg = mcp_parser.msg(
-                        self, msg_type, msg_len, version_id, xid, buf[:msg_len])
-
-                    if msg:
-                        # decode event and create event
-                        ev = mcp_event.mcp_msg_to_ev(msg)
-                        if self.mcp_brick is not None:
-                            # send event to observers and self event handlers
-                            self.mcp_brick.send_event_to_observers(
-                                ev, self.state)
-                            self.mcp_brick.send_event_to_self(ev, self.state)
+                    self._recv_frame(buf[:msg_len])
 
                     buf = buf[msg_len:]
                     buf_len = len(buf)
@@ -213,12 +915,236 @@ class MachineConnection(object):
 
         return hub.app_hub.spawn(_async_recv_loop)
 
+    def _put_frame(self, item, offset):
+        """Write a queued frame into the write buffer at offset, return the end offset."""
+        end = offset + len(item)
+        # offset never exceeds the buffer, the slice grows it as needed.
+        self._write_buf[offset:end] = item
+
+        if self.session is not None:
+            self._record(item, offset, end)
+        return end
+
+    async def _coalesce(self, item, offset):
+        """
+        Write item and messages queued behind it into the write buffer at
+        offset as one MCPBatch. Return (start, end, close_socket) of the
+        frame written.
+        """
+        q = self.send_q
+        if q.empty():
+            if self.batch_delay <= 0:
+                return offset, self._put_frame(item, offset), False
+
+            await asyncio.sleep(self.batch_delay)
+            if q.empty():
+                return offset, self._put_frame(item, offset), False
+
+        batch_max = self.capability.batch_max
+        max_bytes = offset + min(self.batch_max_bytes, self.capability.max_frame_size)
+        # frames follow the batch header, which is packed last.
+        start = offset + _BATCH_HEADER_SIZE
+        end = self._put_frame(item, start)
+        count = 1
+        close_socket = False
+
+        while count < batch_max and end < max_bytes and not q.empty():
+            item, close_socket = q.get_nowait()
+            end = self._put_frame(item, end)
+            count += 1
+            if close_socket:
+                break
+
+        if count == 1:
+            # no batch, the frame is moved over the room left for its header.
+            self._write_buf[offset:offset + end - start] = self._write_buf[start:end]
+            return offset, offset + end - start, close_socket
+
+        self.mcproto_parser.MCPBatch.pack_header_into(self._write_buf, offset, count, end - start)
+        return offset, end, close_socket
+
+    def _fragment(self, buf):
+        """
+        Start a fragment stream of buf if it is too large to be sent in
+        one piece, return False if buf should be sent as it is. Messages
+        of a session in buf are numbered once its last fragment is sent.
+        """
+        fragment_size = min(self.fragment_size,
+                            self.capability.max_frame_size - mcp_fragment.FRAGMENT_OVERHEAD)
+        if len(buf) <= fragment_size + mcp_fragment.FRAGMENT_OVERHEAD:
+            return False
+
+        self._fragment_stream_id = (self._fragment_stream_id + 1) & 0xffffffff
+        self._fragment_streams.append(
+            (mcp_fragment.iter_fragments(buf, self._fragment_stream_id, fragment_size), self._take_session_unit()))
+        return True
+
+    def _next_fragment(self):
+        # streams are sent one after another, so the peer reassembles
+        # one frame at a time.
+        streams = self._fragment_streams
+        while streams:
+            frame = next(streams[0][0], None)
+            if frame is not None:
+                return frame
+            self._commit_session_unit(streams.popleft()[1])
+        return None
+
+    def set_write_watermarks(self, high=None, low=None):
+        """
+        Write buffer limits of the transport, drain() waits when more
+        than high bytes are not sent yet, until it drops below low.
+        """
+        if high is not None:
+            self.write_high_watermark = high
+        if low is not None:
+            self.write_low_watermark = low
+        self.writer.transport.set_write_buffer_limits(self.write_high_watermark, self.write_low_watermark)
+
+    async def _flush(self, item, close_socket):
+        """
+        Copy item and everything queued behind it back to back into the
+        write buffer and write them with one call.
+        Return close_socket of the last message written.
+        """
+        q = self.send_q
+        batch = self.supports(mcproto.MCP_CAP_BATCH)
+        compress = self.compression_algorithm is not None
+        # (start, end) of write buffer or a frame of its own, in order.
+        pieces = []
+        segment_start = offset = 0
+        frames = 0
+        handover = False
+
+        while True:
+            if batch and not close_socket:
+                start, end, close_socket = await self._coalesce(item, offset)
+            else:
+                start, end = offset, self._put_frame(item, offset)
+
+            if end > start:
+                frames += 1
+                frame = None
+                if self._shm_tx is not None and end - start >= self.shm_threshold:
+                    end = self._put_shm(start, end)
+                if compress and end - start >= self.compression_threshold:
+                    with memoryview(self._write_buf) as view:
+                        with view[start:end] as original:
+                            frame = mcp_compression.compress_frame(
+                                original, self.compression_algorithm, self.compression_stats)
+                            if frame is original:
+                                frame = None
+
+                if not close_socket and self.supports(mcproto.MCP_CAP_FRAGMENT):
+                    if frame is not None:
+                        fragmented = self._fragment(frame)
+                    else:
+                        fragmented = self._fragment(memoryview(self._write_buf)[start:end])
+                        # fragments are cut from the write buffer later,
+                        # nothing more can be written into it.
+                        handover = fragmented
+                    if fragmented:
+                        if segment_start < start:
+                            pieces.append((segment_start, start))
+                        segment_start = end
+                        offset = end
+                        break
+
+                if frame is not None:
+                    if segment_start < start:
+                        pieces.append((segment_start, start))
+                    pieces.append(frame)
+                    segment_start = end
+                if self._session_unit:
+                    self._commit_session_unit(self._take_session_unit())
+            offset = end
+
+            if close_socket or offset >= self.flush_max_bytes or q.empty():
+                break
+            item, close_socket = q.get_nowait()
+
+        if segment_start < offset:
+            pieces.append((segment_start, offset))
+
+        if close_socket:
+            # frames queued before the last one are sent first.
+            fragments = []
+            while self._fragment_streams:
+                fragment = self._next_fragment()
+                if fragment is not None:
+                    fragments.append(fragment)
+            pieces[:0] = fragments
+            frames += len(fragments)
+
+        self._write_pieces(pieces, frames, handover)
+        return close_socket
+
+    def _write_pieces(self, pieces, frames, handover=False):
+        if not pieces:
+            if handover:
+                self._write_buf = bytearray(self.write_buffer_size)
+            return
+
+        buf = self._write_buf
+        size = 0
+        with memoryview(buf) as view:
+            data = []
+            for piece in pieces:
+                if piece.__class__ is tuple:
+                    piece = view[piece[0]:piece[1]]
+                data.append(piece)
+                size += len(piece)
+
+            if len(data) == 1:
+                self.writer.write(data[0])
+            else:
+                # one contiguous piece in the common case, writelines
+                # only when compressed frames or fragments are mixed in.
+                self.writer.writelines(data)
+
+            kept = self.writer.transport.get_write_buffer_size() > 0
+            if not kept:
+                for piece in data:
+                    if piece.__class__ is memoryview and piece.obj is buf:
+                        piece.release()
+
+        if kept or handover or len(buf) > self.write_buffer_size:
+            # the transport may keep a view of the unsent part, and a
+            # buffer grown by a large frame is not kept.
+            self._write_buf = bytearray(self.write_buffer_size)
+
+        self.flush_frames.record(frames)
+        self.flush_bytes.record(size)
+
+    def _above_watermark(self):
+        transport = self.writer.transport
+        # drain also raises the error of a lost connection.
+        return transport.get_write_buffer_size() > self.write_high_watermark or transport.is_closing()
+
     async def _send_loop(self):
         try:
             while self.state != MC_DISCONNECT:
-                buf, close_socket = await self.send_q.get()
-                self.writer.write(buf)
-                await self.writer.drain()
+                if self._fragment_streams and self.send_q.empty():
+                    # queued frames go between fragments of large frames.
+                    fragment = self._next_fragment()
+                    if fragment is not None:
+                        self._write_pieces([fragment], 1)
+                    if self._above_watermark():
+                        await self.writer.drain()
+                    else:
+                        # let other tasks queue frames.
+                        await asyncio.sleep(0)
+                    continue
+
+                item, close_socket = await self.send_q.get()
+                close_socket = await self._flush(item, close_socket)
+                # a round trip through the event loop only above the watermark.
+                if close_socket or self._above_watermark():
+                    await self.writer.drain()
+                elif self._shm_tx is not None and self._shm_tx.free() < self._shm_tx.size // 2:
+                    # frames in the ring bypass the watermark, let the peer
+                    # read before the next ones fall back to the socket.
+                    await asyncio.sleep(0)
                 if close_socket:
                     break
         except CancelledError:
@@ -231,53 +1157,154 @@ class MachineConnection(object):
             errno = "%s" % ioe.errno
             LOG.debug("Socket error while sending data to switch at address %s: [%s] %s",
                       self.address, errno, ioe.strerror)
+        except Exception:
+            # don't leave the connection up with nobody sending its frames.
+            LOG.exception("Stop _send_loop at address %s", self.address)
+            self.writer.close()
         finally:
-            q = self.send_q
-            self.send_q = None
-            # First, clear self.send_q to prevent new references.
-            # Now, drain the send_q, releasing the associated semaphore for each entry.
-            # This should release all threads waiting to acquire the semaphore.
-            try:
-                # clean queue
-                while q.get_nowait():
+            if self.session is not None and self.session.resumable:
+                # sent once the session is resumed.
+                self._hold_unsent()
+            elif self.send_q is not None:
+                q = self.send_q
+                self.send_q = None
+                # First, clear self.send_q to prevent new references.
+                # Now, drain the send_q, releasing the associated semaphore for each entry.
+                # This should release all threads waiting to acquire the semaphore.
+                try:
+                    # clean queue
+                    while q.get_nowait():
+                        pass
+                except asyncio.QueueEmpty:
                     pass
-            except asyncio.QueueEmpty:
-                pass
+            self._fragment_streams.clear()
             # Finally, disallow further sends.
             self._close_write()
 
-    def send(self, buf, close_socket=False) -> Task:
+    def send(self, buf, close_socket=False, lane=None) -> Task:
+        # buf is a serialized frame, lane is chosen by message type unless
+        # it is given.
+        if self.stripes is not None and not close_socket:
+            conn = self._stripe(buf)
+            if conn is not self:
+                return conn.send(buf, close_socket, lane)
+
         async def _send(buf, close_socket):
-            msg_enqueued = False
             if self.send_q:
-                await self.send_q.put((buf, close_socket))
-                msg_enqueued = True
+                await self.send_q.put((buf, close_socket), lane)
+                return True
+
+            return self._send_closed(buf, close_socket, lane)
+
+        # a concurrent future when called by the thread of another shard.
+        return self.shard.spawn(_send, buf, close_socket)
+
+    @_in_shard(handed_off=True)
+    def send_nowait(self, buf, close_socket=False, lane=None) -> bool:
+        """
+        Queue buf without a task, see send_overflow_policy for a full
+        send_q. Called by the thread of another shard, buf is handed off
+        to the one of the connection and True is returned.
+        Return False if buf is discarded.
+        """
+        if self.stripes is not None and not close_socket:
+            conn = self._stripe(buf)
+            if conn is not self:
+                return conn.send_nowait(buf, close_socket, lane)
+
+        q = self.send_q
+        if q is None:
+            return self._send_closed(buf, close_socket, lane)
+
+        item = (buf, close_socket)
+        lane = q.lane(item, lane)
+        if not lane.backlog:
+            try:
+                q.put_lane_nowait(lane, item)
+                return True
+            except asyncio.QueueFull:
+                pass
+
+        return self._send_overflow(lane, item)
 
-            if not msg_enqueued:
-                LOG.debug('Machine Connection in process of terminating; send() to %s discarded.',
-                          self.address)
+    def _send_closed(self, buf, close_socket, lane):
+        if self.successor is not None:
+            return self.successor.send_nowait(buf, close_socket, lane)
+        if self.session is not None:
+            return self._hold(buf, close_socket)
 
-            return msg_enqueued
+        LOG.debug('Machine Connection in process of terminating; send() to %s discarded.',
+                  self.address)
+        return False
 
-        return hub.app_hub.spawn(_send, buf, close_socket)
+    def _send_overflow(self, lane, item):
+        close_socket = item[1]
+        self.send_overflows += 1
+        policy = self.send_overflow_policy
+        if policy == SEND_OVERFLOW_RAISE:
+            raise SendQueueFull(f'Send lane {lane.name} to {self.address} is full.')
+        if policy == SEND_OVERFLOW_DROP and not close_socket:
+            LOG.debug('Send lane %s to %s is full, frame is dropped.', lane.name, self.address)
+            return False
+
+        backlog = lane.backlog
+        backlog.append(item)
+        if len(backlog) == 1:
+            hub.app_hub.spawn(self._queue_send_backlog, lane)
+        return True
+
+    async def _queue_send_backlog(self, lane):
+        backlog = lane.backlog
+        while backlog:
+            q = self.send_q
+            if q is None:
+                backlog.clear()
+                return
+            await q.put_lane(lane, backlog[0])
+            backlog.popleft()
+
+    def send_lane_stats(self):
+        """Depth, frames sent and wait time of each send lane, see SendLanes.stats."""
+        q = self.send_q
+        return q.stats() if q is not None else {}
 
     def set_xid(self, msg: mcproto_parser.MCPMsgBase):
-        self.xid += 1
-        self.xid &= self.mcproto.MAX_XID
-        msg.set_xid(self.xid)
-        return self.xid
-
-    def send_msg(self, msg, close_socket=False) -> Task:
-        async def _send_msg(msg, close_socket):
-            assert isinstance(msg, self.mcproto_parser.MCPMsgBase)
-            if msg.xid is None:
-                self.set_xid(msg)
-            msg.serialize()
-            LOG.debug('send_msg %s', msg)
-            return await self.send(msg.buf, close_socket=close_socket)
-        return hub.app_hub.spawn(_send_msg, msg, close_socket)
+        with self._xid_lock:
+            self.xid = xid = (self.xid + 1) & self.mcproto.MAX_XID
+        msg.set_xid(xid)
+        return xid
+
+    def _serialize_msg(self, msg, close_socket):
+        """
+        Serialize msg by the caller, so errors are raised to it and later
+        changes of msg are not sent. Return the connection to queue it by.
+        """
+        assert isinstance(msg, self.mcproto_parser.MCPMsgBase)
+        # the stripe is chosen by the fields of the message, not its frame.
+        conn = self._stripe(msg) if self.stripes is not None and not close_socket else self
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        LOG.debug('send_msg %s', msg)
+        return conn
+
+    def send_msg(self, msg, close_socket=False, lane=None) -> Task:
+        conn = self._serialize_msg(msg, close_socket)
+        return conn.send(msg.buf, close_socket=close_socket, lane=lane)
+
+    def send_msg_nowait(self, msg, close_socket=False, lane=None) -> bool:
+        """
+        send_msg without creating tasks, msg is serialized when it is
+        queued. See send_nowait.
+        """
+        conn = self._serialize_msg(msg, close_socket)
+        return conn.send_nowait(msg.buf, close_socket, lane)
 
     async def stop_serve(self):
+        if not self.shard.in_thread():
+            await asyncio.wrap_future(self.shard.spawn(self.stop_serve))
+            return
+
         if isinstance(self._serve_task, asyncio.Task) and not self._serve_task.done():
             self._serve_task.cancel()
             await self._serve_task
@@ -287,17 +1314,14 @@ class MachineConnection(object):
     def serve(self):
         async def serve():
             send_loop_task = hub.app_hub.spawn(self._send_loop)
+            heartbeat_task = hub.app_hub.spawn(self._heartbeat_loop)
     
             # send connection event
             connect_ev = event.EventSocketConnecting(self)
     
             if self.mcp_brick is not None:
                 self.mcp_brick.send_event_to_observers(connect_ev)
-                handlers = self.mcp_brick.get_handlers(
-                    connect_ev, MC_HANDSHAK)
-    
-                for handler in handlers:
-                    handler(connect_ev)
+                self._run_brick_handlers(connect_ev, MC_HANDSHAK)
     
             # send socket connecting event
             exception = None
@@ -308,7 +1332,9 @@ class MachineConnection(object):
                 exception = e
             finally:
                 hub.app_hub.kill(send_loop_task)
+                hub.app_hub.kill(heartbeat_task)
                 hub.app_hub.kill(recv_loop_task)
+                self._close_shm()
                 self.is_active = False
                 if exception is not None:
                     raise exception
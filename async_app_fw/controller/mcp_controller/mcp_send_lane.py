@@ -0,0 +1,210 @@
+"""
+Send lanes of a MachineConnection.
+
+Frames waiting to be sent are kept in one lane per kind of traffic. The
+control lane is always served first, bulk lanes of the services share the
+rest round robin, each lane sends up to its weight in frames per turn.
+Frames closing the socket are served after every lane is empty.
+
+Service messages which end a stream, like CaptureServiceSetEvent and
+CmdServiceSetEvent, stay in the lane of their service, so they never
+overtake data queued before them.
+"""
+
+import asyncio
+import struct
+import time
+from collections import deque
+
+from async_app_fw.lib import hub
+from async_app_fw.lib.histogram import Histogram
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
+from async_app_fw.protocol.mcp.mcp_parser import MCPMsgBase
+
+LANE_CONTROL = 'control'
+LANE_COMMAND = 'command'
+LANE_CAPTURE = 'capture'
+LANE_API = 'api'
+# frames with close_socket, not selectable.
+LANE_CLOSING = 'closing'
+
+# (lane, weight), weight None is strict priority.
+DEFAULT_LANES = (
+    (LANE_CONTROL, None),
+    (LANE_COMMAND, 8),
+    (LANE_CAPTURE, 8),
+    (LANE_API, 8),
+)
+DEFAULT_LANE_SIZE = 1000
+
+# message type: lane, other message types are sent by LANE_CONTROL.
+MSG_TYPE_LANES = {
+    mcproto.CMD_SERVICE_READ_STD: LANE_COMMAND,
+    mcproto.CMD_SERVICE_WRITE_STD: LANE_COMMAND,
+    mcproto.CMD_SERVICE_READ_STD_RES: LANE_COMMAND,
+    mcproto.CMD_SERVICE_WRITE_STD_RES: LANE_COMMAND,
+    mcproto.CMD_SERVICE_READ_STD_EXCPTION: LANE_COMMAND,
+    mcproto.CMD_SERVICE_WRITE_STD_EXCPTION: LANE_COMMAND,
+    mcproto.CMD_SERVICE_SET_EVENT: LANE_COMMAND,
+    mcproto.CMD_SERVICE_SET_EXCEPTION: LANE_COMMAND,
+    mcproto.CAPTURE_SERVICE_SEND_PKT: LANE_CAPTURE,
+    mcproto.CAPTURE_SERVICE_SET_EVENT: LANE_CAPTURE,
+    mcproto.CAPTURE_SERVICE_SET_EXCEPTION: LANE_CAPTURE,
+    mcproto.CAPTURE_SERVICE_DROP_REPORT: LANE_CAPTURE,
+    mcproto.API_ACTION_RESPONSE: LANE_API,
+    mcproto.API_ACTION_EXCEPTION: LANE_API,
+}
+
+_MSG_TYPE = struct.Struct('!H')
+
+
+def lane_of(buf):
+    """Lane of a message or a serialized frame."""
+    if isinstance(buf, MCPMsgBase):
+        msg_type = buf.cls_msg_type
+    else:
+        (msg_type,) = _MSG_TYPE.unpack_from(buf)
+        msg_type &= ~mcproto.MCP_FLAG_COMPRESSED
+    return MSG_TYPE_LANES.get(msg_type, LANE_CONTROL)
+
+
+class SendLane(object):
+    def __init__(self, name, weight=None, maxsize=DEFAULT_LANE_SIZE):
+        self.name = name
+        self.weight = weight
+        # (time queued, item)
+        self.queue = hub.Queue(maxsize)
+        # items waiting for room in queue, see MachineConnection.send_nowait.
+        self.backlog = deque()
+        self.sent = 0
+        self.max_depth = 0
+        # seconds spent in the lane, in microsecond buckets.
+        self.wait = Histogram(scale=1e6)
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {'depth': self.depth, 'max_depth': self.max_depth, 'backlog': len(self.backlog), 'sent': self.sent,
+                'wait_mean': self.wait.mean, 'wait_p99': self.wait.percentile(99),
+                'wait_max': self.wait.max}
+
+
+class SendLanes(object):
+    """
+    Send queue of a MachineConnection made of lanes, with the interface of
+    asyncio.Queue used by the send loop. put and put_nowait pick the lane
+    of item, QueueFull is raised when that lane is full.
+    """
+
+    def __init__(self, lanes=DEFAULT_LANES, maxsize=DEFAULT_LANE_SIZE):
+        self.lanes = {}
+        self._bulk = []
+        for name, weight in lanes:
+            lane = SendLane(name, weight, maxsize)
+            self.lanes[name] = lane
+            if weight is not None:
+                self._bulk.append(lane)
+        self._first = next(iter(self.lanes.values()))
+        self._priority = [lane for lane in self.lanes.values() if lane.weight is None]
+        self._closing = SendLane(LANE_CLOSING, None, maxsize)
+        self.lanes[LANE_CLOSING] = self._closing
+
+        self._turn = 0
+        self._credit = self._bulk[0].weight if self._bulk else 0
+        self._not_empty = asyncio.Event()
+        self._size = 0
+
+    def lane(self, item, lane=None):
+        """
+        Lane item is queued in, lane names it explicitly. Items of a lane
+        not configured are queued in the first lane.
+        """
+        buf, close_socket = item
+        if close_socket:
+            return self._closing
+        return self.lanes.get(lane or lane_of(buf)) or self._first
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return self._size == 0
+
+    def set_weight(self, name, weight):
+        lane = self.lanes[name]
+        assert lane.weight is not None and weight > 0, 'Weight of a bulk lane is a positive number of frames.'
+        lane.weight = weight
+
+    def _queued(self, lane):
+        self._size += 1
+        depth = lane.queue.qsize()
+        if depth > lane.max_depth:
+            lane.max_depth = depth
+        self._not_empty.set()
+
+    def put_lane_nowait(self, lane: SendLane, item):
+        lane.queue.put_nowait((time.monotonic(), item))
+        self._queued(lane)
+
+    async def put_lane(self, lane: SendLane, item):
+        await lane.queue.put((time.monotonic(), item))
+        self._queued(lane)
+
+    def put_nowait(self, item, lane=None):
+        self.put_lane_nowait(self.lane(item, lane), item)
+
+    async def put(self, item, lane=None):
+        await self.put_lane(self.lane(item, lane), item)
+
+    def _select(self):
+        for lane in self._priority:
+            if not lane.queue.empty():
+                return lane
+
+        bulk = self._bulk
+        for _ in range(len(bulk) + 1 if bulk else 0):
+            lane = bulk[self._turn]
+            if self._credit > 0 and not lane.queue.empty():
+                self._credit -= 1
+                return lane
+            self._turn = (self._turn + 1) % len(bulk)
+            self._credit = bulk[self._turn].weight
+
+        return self._closing
+
+    def get_nowait(self):
+        if not self._size:
+            raise asyncio.QueueEmpty
+
+        lane = self._select()
+        queued, item = lane.queue.get_nowait()
+        self._size -= 1
+        lane.sent += 1
+        lane.wait.record(time.monotonic() - queued)
+        return item
+
+    async def get(self):
+        while not self._size:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+    def drain(self):
+        """
+        Remove and return every queued item, lane by lane, each followed by
+        its backlog. Backlogs are left to the task queueing them.
+        """
+        items = []
+        for lane in self.lanes.values():
+            queue = lane.queue
+            while not queue.empty():
+                items.append(queue.get_nowait()[1])
+            items.extend(lane.backlog)
+        self._size = 0
+        return items
+
+    def stats(self):
+        """{lane: depth, max depth, backlog, frames sent and wait time in seconds}"""
+        return {name: lane.stats() for name, lane in self.lanes.items()}
@@ -0,0 +1,222 @@
+"""
+Sessions of agents which outlive their connection.
+
+When MCP_CAP_RESUME is negotiated, master opens a session on the primary
+connection of an agent after hello and the agent echoes MCPSessionOpen.
+Each end numbers the messages it sends after its own MCPSessionOpen, keeps
+them in a bounded RetransmitBuffer until the peer acknowledges them by
+MCPSessionAck, and counts the messages it receives after the one of the
+peer.
+
+A lost connection whose session can be resumed is suspended
+(MC_SUSPENDED) for resume_timeout instead of disconnected, messages sent
+to it meanwhile are held. The agent reconnects and sends MCPSessionResume
+with the number of messages it has received, master replies
+MCPSessionResumed with its own number, then each end sends again what the
+other has missed followed by what was held. Services see the new
+connection become stable but no disconnection, so captures and commands
+of the agent keep running.
+
+A session which can't be resumed, because it timed out, the peer missed
+messages already dropped from the buffer or more were held than it keeps,
+ends with MC_DISCONNECT the way a lost connection did without a session.
+
+Messages of the handshake, of the shared memory ring and of the session
+itself belong to one connection and are not numbered.
+"""
+
+import random
+from collections import deque
+
+from async_app_fw.controller.mcp_controller.mcp_state import MC_SUSPENDED
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
+
+# seconds a suspended connection waits to be resumed, 0 disables sessions.
+DEFAULT_RESUME_TIMEOUT = 10
+# unacknowledged or held messages, and bytes of them, kept for a resume.
+DEFAULT_RETRANSMIT_FRAMES = 4096
+DEFAULT_RETRANSMIT_BYTES = 16 * 1024 * 1024
+# received messages between two MCPSessionAck.
+DEFAULT_ACK_INTERVAL = 64
+
+UNSEQUENCED_MSG_TYPES = frozenset((
+    mcproto.MCP_HELLO,
+    mcproto.MCP_STRIPE_JOIN,
+    mcproto.MCP_SHM_ATTACH,
+    mcproto.MCP_SHM_ATTACHED,
+    mcproto.MCP_SESSION_OPEN,
+    mcproto.MCP_SESSION_RESUME,
+    mcproto.MCP_SESSION_RESUMED,
+    mcproto.MCP_SESSION_ACK,
+    mcproto.MCP_HEARTBEAT,
+    mcproto.MCP_HEARTBEAT_REPLY,
+))
+
+
+class RetransmitBuffer(object):
+    """
+    Serialized messages sent but not acknowledged yet by their number.
+    Above max_frames or max_bytes the oldest are dropped, the peer can
+    only resume after it received them.
+    """
+
+    def __init__(self, max_frames=DEFAULT_RETRANSMIT_FRAMES, max_bytes=DEFAULT_RETRANSMIT_BYTES):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        # (seq, frame), seq increases by one.
+        self._frames = deque()
+        self.bytes = 0
+        # highest number dropped before it was acknowledged.
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def append(self, seq, frame):
+        """Keep frame sent as seq, return False if older ones were dropped for it."""
+        frames = self._frames
+        frames.append((seq, frame))
+        self.bytes += len(frame)
+        if len(frames) <= self.max_frames and self.bytes <= self.max_bytes:
+            return True
+
+        while len(frames) > 1 and (len(frames) > self.max_frames or self.bytes > self.max_bytes):
+            dropped_seq, dropped = frames.popleft()
+            self.bytes -= len(dropped)
+            self.dropped = dropped_seq
+        return False
+
+    def ack(self, seq):
+        """Drop frames up to seq, the peer has received them."""
+        frames = self._frames
+        while frames and frames[0][0] <= seq:
+            self.bytes -= len(frames.popleft()[1])
+
+    def since(self, seq):
+        """Frames after seq, None if some of them are not kept."""
+        frames = self._frames
+        if seq < self.dropped or frames and frames[0][0] > seq + 1:
+            return None
+        return [frame for frame_seq, frame in frames if frame_seq > seq]
+
+    def clear(self):
+        self._frames.clear()
+        self.bytes = 0
+
+
+class Session(object):
+    def __init__(self, session_id, resume_timeout=DEFAULT_RESUME_TIMEOUT, max_frames=DEFAULT_RETRANSMIT_FRAMES,
+                 max_bytes=DEFAULT_RETRANSMIT_BYTES, ack_interval=DEFAULT_ACK_INTERVAL):
+        self.session_id = session_id
+        self.resume_timeout = resume_timeout
+        self.ack_interval = ack_interval
+        # MachineConnection which carries the session now.
+        self.connection = None
+        # messages sent after MCPSessionOpen of this end, and received
+        # after the one of the peer.
+        self.sent = 0
+        self.received = 0
+        # received count last acknowledged to the peer.
+        self.acked = 0
+        # MCPSessionOpen of this end is sent, and the one of the peer received.
+        self.recording = False
+        self.counting = False
+        self.retransmit = RetransmitBuffer(max_frames, max_bytes)
+        # (buf, close_socket) not sent when the connection was lost, and
+        # sent to the suspended connection, in order.
+        self.held = []
+        # more was held than max_frames.
+        self.lost = False
+
+    def __repr__(self):
+        return f'<Session 0x{self.session_id:x} sent={self.sent} received={self.received}>'
+
+    @property
+    def resumable(self):
+        return not self.lost
+
+    def record(self, frame):
+        """frame is sent, keep it until the peer acknowledges it. False if older ones were dropped."""
+        self.sent += 1
+        return self.retransmit.append(self.sent, frame)
+
+    def ack(self, received):
+        self.retransmit.ack(received)
+
+    def count_received(self):
+        """A message is received, return True if it's time to acknowledge."""
+        self.received += 1
+        if self.received - self.acked >= self.ack_interval:
+            self.acked = self.received
+            return True
+        return False
+
+    def hold(self, item):
+        """Hold (buf, close_socket) until the session is resumed, False if it can't be anymore."""
+        if not self.resumable:
+            return False
+        held = self.held
+        held.append(item)
+        if len(held) > self.retransmit.max_frames:
+            self.lost = True
+            self.retransmit.clear()
+            held.clear()
+            return False
+        return True
+
+    def replay(self, peer_received):
+        """
+        Frames the peer has not received of the ones sent, numbering goes
+        on after peer_received. None if the session can't be resumed.
+        """
+        if not self.resumable or peer_received > self.sent:
+            return None
+        frames = self.retransmit.since(peer_received)
+        if frames is None:
+            return None
+        self.retransmit.clear()
+        self.sent = peer_received
+        return frames
+
+    def take_held(self):
+        held = self.held
+        self.held = []
+        return held
+
+
+class SessionTable(object):
+    """Sessions of one end by session_id, and their limits."""
+
+    def __init__(self, resume_timeout=DEFAULT_RESUME_TIMEOUT, max_frames=DEFAULT_RETRANSMIT_FRAMES,
+                 max_bytes=DEFAULT_RETRANSMIT_BYTES, ack_interval=DEFAULT_ACK_INTERVAL):
+        self.resume_timeout = resume_timeout
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.ack_interval = ack_interval
+        self.sessions = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def new_session(self, session_id=None):
+        """Session of session_id opened by the peer, or a new one."""
+        while session_id is None or session_id in self.sessions:
+            session_id = random.getrandbits(64)
+        session = Session(session_id, self.resume_timeout, self.max_frames, self.max_bytes, self.ack_interval)
+        self.sessions[session_id] = session
+        return session
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def remove(self, session):
+        if self.sessions.get(session.session_id) is session:
+            del self.sessions[session.session_id]
+
+    def suspended(self):
+        """A suspended connection of the sessions, None if there is none."""
+        for session in self.sessions.values():
+            conn = session.connection
+            if conn is not None and conn.state == MC_SUSPENDED:
+                return conn
+        return None
@@ -0,0 +1,111 @@
+"""
+Shared memory ring of bulk frames between co-located master and agent.
+
+On a unix domain socket connection each end may own a ring for the
+frames it sends. Frames of at least the threshold size are copied into
+the ring and only an MCPShmFrame reference is written to the socket. The
+receiver reads the frame from the ring and stores how far it has read in
+the header of the ring, which frees the space for the sender.
+
+The ring is announced by MCPShmAttach and used once the peer replies
+MCPShmAttached, a frame which doesn't fit in free space of the ring is
+written to the socket as usual.
+"""
+
+import logging
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+LOG = logging.getLogger(
+    'async_app_fw.controller.mcp_controller.mcp_shm')
+
+# 0 disables the ring.
+DEFAULT_SHM_SIZE = 0
+# smaller frames are cheaper to write to the socket than to reference.
+DEFAULT_SHM_THRESHOLD = 64 * 1024
+
+# read position of the receiver, the rest of the header is padding.
+HEADER_SIZE = 64
+_READ_POS = struct.Struct('=Q')
+
+
+class ShmRing(object):
+    """
+    Single producer, single consumer ring in a SharedMemory block.
+    Positions count bytes written since the ring was created, the offset
+    in the data area is the position modulo size.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner):
+        self._shm = shm
+        self.owner = owner
+        self.name = shm.name
+        self.size = shm.size - HEADER_SIZE
+        self._view = shm.buf
+        self._data = shm.buf[HEADER_SIZE:]
+        # writer side only.
+        self._write_pos = 0
+
+    @classmethod
+    def create(cls, size):
+        shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + size)
+        # unlinked by close, not by the resource tracker at exit.
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        _READ_POS.pack_into(shm.buf, 0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name=name)
+        # the owner unlinks the block.
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    def put(self, frame):
+        """
+        Copy frame into the ring, return (offset, end) of it or None if it
+        doesn't fit. end is the read position after the frame.
+        """
+        length = len(frame)
+        size = self.size
+        write_pos = self._write_pos
+        (read_pos,) = _READ_POS.unpack_from(self._view, 0)
+
+        offset = write_pos % size
+        # frames are contiguous, the tail of the data area is skipped.
+        skip = size - offset if offset + length > size else 0
+        if write_pos + skip + length - read_pos > size:
+            return None
+
+        if skip:
+            offset = 0
+        self._data[offset:offset + length] = frame
+        self._write_pos = end = write_pos + skip + length
+        return offset, end
+
+    def free(self):
+        """Bytes the receiver has not released yet subtracted from size."""
+        (read_pos,) = _READ_POS.unpack_from(self._view, 0)
+        return self.size - (self._write_pos - read_pos)
+
+    def frame(self, offset, length):
+        if offset + length > self.size:
+            raise ValueError(f'Frame at {offset} of {length} bytes exceeds shared memory ring.')
+        return self._data[offset:offset + length]
+
+    def release(self, end):
+        """Reader has consumed every frame before read position end."""
+        _READ_POS.pack_into(self._view, 0, end)
+
+    def close(self):
+        self._data.release()
+        self._view = self._data = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # a frame is still referenced, the mapping goes with it.
+            LOG.debug('Shared memory %s is still referenced.', self.name)
+        if self.owner:
+            # unlink unregisters the block from the tracker.
+            resource_tracker.register(self._shm._name, 'shared_memory')
+            self._shm.unlink()
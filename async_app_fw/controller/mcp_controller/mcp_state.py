@@ -3,3 +3,5 @@ MC_FEATURE = 1
 MC_CONFIG = 2
 MC_STABLE = 3
 MC_DISCONNECT = 4
+# connection is lost, its session waits for the agent to resume it.
+MC_SUSPENDED = 5
@@ -0,0 +1,357 @@
+"""
+Transports of Machine Control Protocol.
+
+- stream: asyncio StreamReader/StreamWriter (default)
+- buffered: asyncio.BufferedProtocol, socket data is read into a
+  preallocated ring buffer and every frame is handed to the connection as
+  a memoryview of that buffer.
+- unix, unix_buffered: the same over a unix domain socket, for master and
+  agent on one host. The address is (path,) instead of (host, port), bulk
+  frames may go through shared memory, see mcp_shm. Master listens to the
+  path besides TCP, with the stream or buffered transport of tcp_transport.
+
+"""
+
+import asyncio
+import logging
+import socket
+import struct
+from asyncio import StreamWriter
+from asyncio.streams import FlowControlMixin
+
+from async_app_fw.protocol.mcp.mcp_common import MCP_HEADER_PACK_STR, MCP_HEADER_SIZE
+
+LOG = logging.getLogger(
+    'async_app_fw.controller.mcp_controller.mcp_transport')
+
+TRANSPORT_STREAM = 'stream'
+TRANSPORT_BUFFERED = 'buffered'
+TRANSPORT_UNIX = 'unix'
+TRANSPORT_UNIX_BUFFERED = 'unix_buffered'
+UNIX_TRANSPORTS = (TRANSPORT_UNIX, TRANSPORT_UNIX_BUFFERED)
+# transport over TCP of the same kind as a unix one.
+_TCP_TRANSPORT = {
+    TRANSPORT_UNIX: TRANSPORT_STREAM,
+    TRANSPORT_UNIX_BUFFERED: TRANSPORT_BUFFERED,
+}
+
+DEFAULT_UNIX_PATH = '/tmp/async_app_fw_mcp.sock'
+# peer address of a unix domain socket connection, it's on this host.
+UNIX_PEER_ADDRESS = ('127.0.0.1', 0)
+
+DEFAULT_RING_BUFFER_SIZE = 256 * 1024
+# get_buffer never returns less free space than this.
+MIN_READ_SIZE = 4096
+
+_HEADER = struct.Struct(MCP_HEADER_PACK_STR)
+
+
+class FrameRingBuffer(object):
+    """
+    Preallocated receive buffer of MCP frames.
+
+    Data is appended at the write position and complete frames are
+    consumed from the read position. Remaining bytes of a partial frame are
+    moved back to the head of the buffer when the tail runs out of space,
+    the buffer is only reallocated when a single frame doesn't fit in it.
+    """
+
+    def __init__(self, size=DEFAULT_RING_BUFFER_SIZE):
+        assert size >= MIN_READ_SIZE
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def capacity(self):
+        return len(self._buf)
+
+    def _compact(self):
+        start, end = self._start, self._end
+        if start == 0:
+            return
+
+        # same size slice assignment, allowed while views are exported.
+        self._buf[:end - start] = self._view[start:end]
+        self._start = 0
+        self._end = end - start
+
+    def _grow(self, size):
+        LOG.debug('Grow ring buffer from %d to %d bytes.', self.capacity, size)
+        buf = bytearray(size)
+        buf[:len(self)] = self._view[self._start:self._end]
+        self._end = len(self)
+        self._start = 0
+        self._buf = buf
+        self._view = memoryview(buf)
+
+    def reserve(self, size):
+        """Make sure there is space for a frame of size bytes at the read position."""
+        if self._start + size <= self.capacity:
+            return
+
+        if size <= self.capacity:
+            self._compact()
+        else:
+            self._grow(max(size, self.capacity * 2))
+
+    def get_writable(self, sizehint=-1):
+        if self._start == self._end:
+            self._start = self._end = 0
+
+        if self.capacity - self._end < MIN_READ_SIZE:
+            if self._start > 0:
+                self._compact()
+            if self.capacity - self._end < MIN_READ_SIZE:
+                self._grow(self.capacity * 2)
+
+        return self._view[self._end:]
+
+    def advance(self, nbytes):
+        assert self._end + nbytes <= self.capacity
+        self._end += nbytes
+
+    def is_full(self):
+        # next get_writable would have to grow the buffer.
+        return self.capacity - len(self) < MIN_READ_SIZE
+
+    def frames(self):
+        """
+        Yield complete frames as memoryview.
+        A yielded view is only valid until the next call of get_writable.
+        """
+        view = self._view
+        while self._end - self._start >= MCP_HEADER_SIZE:
+            start = self._start
+            (_, msg_len, _, _) = _HEADER.unpack_from(view, start)
+            if msg_len < MCP_HEADER_SIZE:
+                # Someone isn't playing nicely; log it, and try something sane.
+                LOG.debug('Message with invalid length %s received.', msg_len)
+                msg_len = MCP_HEADER_SIZE
+
+            if self._end - start < msg_len:
+                self.reserve(msg_len)
+                return
+
+            self._start = start + msg_len
+            yield view[start:start + msg_len]
+
+
+class MCPBufferedProtocol(FlowControlMixin, asyncio.BufferedProtocol):
+    """
+    Buffered protocol of MCP connection.
+
+    The protocol works as the reader of MachineConnection, frames are
+    passed to the callback set by set_frame_handler. Frames received before
+    a handler is set are kept in the ring buffer.
+    """
+
+    def __init__(self, client_connected_cb=None, buffer_size=DEFAULT_RING_BUFFER_SIZE, loop=None):
+        super().__init__(loop=loop)
+        self._client_connected_cb = client_connected_cb
+        self._ring = FrameRingBuffer(buffer_size)
+        self._frame_handler = None
+        self._transport = None
+        self._reading_paused = False
+        self._exception = None
+        self._closed = self._loop.create_future()
+        self.writer = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self.writer = StreamWriter(transport, self, None, self._loop)
+
+        if self._client_connected_cb is not None:
+            res = self._client_connected_cb(self, self.writer)
+            if asyncio.iscoroutine(res):
+                self._loop.create_task(res)
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        if exc is not None and self._exception is None:
+            self._exception = exc
+
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+        self._transport = None
+        self._frame_handler = None
+
+    def _get_close_waiter(self, stream):
+        return self._closed
+
+    def get_buffer(self, sizehint):
+        return self._ring.get_writable(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self._ring.advance(nbytes)
+
+        if self._frame_handler is not None:
+            self._process_frames()
+        elif self._ring.is_full() and not self._reading_paused:
+            # nobody consumes frames yet, stop reading until a handler is set.
+            self._reading_paused = True
+            self._transport.pause_reading()
+
+    def data_received(self, data):
+        # loops which call data_received of a class which is a Protocol too,
+        # like uvloop, get the data copied into the ring buffer.
+        data = memoryview(data)
+        while data:
+            buf = self.get_buffer(len(data))
+            nbytes = min(len(buf), len(data))
+            buf[:nbytes] = data[:nbytes]
+            data = data[nbytes:]
+            self.buffer_updated(nbytes)
+
+    def eof_received(self):
+        # close the transport.
+        return False
+
+    def _process_frames(self):
+        try:
+            for frame in self._ring.frames():
+                self._frame_handler(frame)
+        except Exception as e:
+            LOG.exception('Error occur when processing MCP frame.')
+            self._exception = e
+            if self._transport is not None:
+                self._transport.abort()
+
+    def set_frame_handler(self, handler):
+        self._frame_handler = handler
+        if handler is None or self._transport is None:
+            return
+
+        if self._reading_paused:
+            self._reading_paused = False
+            self._transport.resume_reading()
+
+        # frames which are received before handler set.
+        self._process_frames()
+
+    def exception(self):
+        return self._exception
+
+    async def wait_closed(self):
+        await asyncio.shield(self._closed)
+
+
+async def start_buffered_server(client_connected_cb, host=None, port=None,
+                                buffer_size=DEFAULT_RING_BUFFER_SIZE, **kwds):
+    """
+    Same as asyncio.start_server, client_connected_cb is called with
+    (MCPBufferedProtocol, StreamWriter) instead of (StreamReader, StreamWriter).
+    """
+    loop = asyncio.get_running_loop()
+
+    def factory():
+        return MCPBufferedProtocol(client_connected_cb, buffer_size=buffer_size, loop=loop)
+
+    return await loop.create_server(factory, host, port, **kwds)
+
+
+async def open_buffered_connection(host=None, port=None, buffer_size=DEFAULT_RING_BUFFER_SIZE, **kwds):
+    """
+    Same as asyncio.open_connection, return (MCPBufferedProtocol, StreamWriter).
+    """
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_connection(
+        lambda: MCPBufferedProtocol(buffer_size=buffer_size, loop=loop), host, port, **kwds)
+
+    return protocol, protocol.writer
+
+
+async def start_buffered_unix_server(client_connected_cb, path=None,
+                                     buffer_size=DEFAULT_RING_BUFFER_SIZE, **kwds):
+    """start_buffered_server on a unix domain socket."""
+    loop = asyncio.get_running_loop()
+
+    def factory():
+        return MCPBufferedProtocol(client_connected_cb, buffer_size=buffer_size, loop=loop)
+
+    return await loop.create_unix_server(factory, path, **kwds)
+
+
+async def open_buffered_unix_connection(path=None, buffer_size=DEFAULT_RING_BUFFER_SIZE, **kwds):
+    """open_buffered_connection to a unix domain socket."""
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_unix_connection(
+        lambda: MCPBufferedProtocol(buffer_size=buffer_size, loop=loop), path, **kwds)
+
+    return protocol, protocol.writer
+
+
+async def accept_stream_connection(client_connected_cb, sock, **kwds):
+    """
+    Serve a socket accepted by another loop in the running one, like
+    asyncio.start_server does with the sockets it accepts.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(loop=loop)
+    protocol = asyncio.StreamReaderProtocol(reader, client_connected_cb, loop=loop)
+    await loop.connect_accepted_socket(lambda: protocol, sock, **kwds)
+
+
+async def accept_buffered_connection(client_connected_cb, sock, buffer_size=DEFAULT_RING_BUFFER_SIZE, **kwds):
+    """accept_stream_connection with MCPBufferedProtocol, see start_buffered_server."""
+    loop = asyncio.get_running_loop()
+    await loop.connect_accepted_socket(
+        lambda: MCPBufferedProtocol(client_connected_cb, buffer_size=buffer_size, loop=loop), sock, **kwds)
+
+
+_SERVER_FACTORY = {
+    TRANSPORT_STREAM: asyncio.start_server,
+    TRANSPORT_BUFFERED: start_buffered_server,
+    TRANSPORT_UNIX: asyncio.start_unix_server,
+    TRANSPORT_UNIX_BUFFERED: start_buffered_unix_server,
+}
+
+_CONNECTION_FACTORY = {
+    TRANSPORT_STREAM: asyncio.open_connection,
+    TRANSPORT_BUFFERED: open_buffered_connection,
+    TRANSPORT_UNIX: asyncio.open_unix_connection,
+    TRANSPORT_UNIX_BUFFERED: open_buffered_unix_connection,
+}
+
+
+# sockets accepted for a shard of app_hub, see hub.StreamServer.
+_ACCEPT_FACTORY = {
+    TRANSPORT_STREAM: accept_stream_connection,
+    TRANSPORT_BUFFERED: accept_buffered_connection,
+    TRANSPORT_UNIX: accept_stream_connection,
+    TRANSPORT_UNIX_BUFFERED: accept_buffered_connection,
+}
+
+
+def get_server_factory(transport):
+    return _SERVER_FACTORY[transport]
+
+
+def get_accept_factory(transport):
+    return _ACCEPT_FACTORY[transport]
+
+
+def get_connection_factory(transport):
+    return _CONNECTION_FACTORY[transport]
+
+
+def tcp_transport(transport):
+    """transport itself, or the TCP one of the same kind for a unix transport."""
+    return _TCP_TRANSPORT.get(transport, transport)
+
+
+def is_unix(sock):
+    return sock.family == socket.AF_UNIX
+
+
+def peer_address(writer):
+    """(host, port) of the peer, UNIX_PEER_ADDRESS on a unix domain socket."""
+    sock = writer.get_extra_info('socket')
+    if is_unix(sock):
+        return UNIX_PEER_ADDRESS
+    return sock.getpeername()
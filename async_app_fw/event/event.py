@@ -31,7 +31,9 @@ class EventBase(object):
     The base of all event classes.
 
     A Ryu application can define its own event type by creating a subclass.
+    Subclasses without __slots__ keep a __dict__ as usual.
     """
+    __slots__ = ()
 
     FILTER_TYPE = FILTER_TYPE
 
@@ -63,6 +65,8 @@ class EventReplyBase(EventBase):
 
 
 class EventSocketConnecting(EventBase):
+    __slots__ = ('connection', 'address')
+
     def __init__(self, connection):
         super(EventSocketConnecting, self).__init__()
         self.connection = connection
@@ -6,9 +6,11 @@ from async_app_fw.protocol.mcp import mcp_parser_v_1_0
 
 
 class EventMCPMsgBase(event.EventBase):
+    __slots__ = ('timestamp', 'msg')
+
     def __init__(self, msg):
+        # one event for each received message, EventBase.__init__ does nothing.
         self.timestamp = time.time()
-        super().__init__()
         self.msg = msg
 
 
@@ -38,9 +40,8 @@ def _create_mcp_msg_ev_class(msg_cls):
         return
 
     # Create Classes Dynamically in Python.
-    cls = type(name, (EventMCPMsgBase,),
-               dict(__init__=lambda self, msg:
-                    super(self.__class__, self).__init__(msg)))
+    # __init__ of EventMCPMsgBase is used as it is.
+    cls = type(name, (EventMCPMsgBase,), dict(__slots__=()))
     globals()[name] = cls
     _MCP_MSG_EVENTS[name] = cls
 
@@ -64,6 +65,8 @@ for mcp_mods in mcproto.get_ofp_modules().values():
 
 
 class EventMCPStateChange(event.EventBase):
+    __slots__ = ('connection', 'state', 'previous_state')
+
     def __init__(self, connection, state, previous_state=None):
         super(EventMCPStateChange, self).__init__()
         self.connection = connection
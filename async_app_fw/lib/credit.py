@@ -0,0 +1,118 @@
+"""
+Credit based flow control of a stream of service data.
+
+The receiver grants credits as it consumes items, the sender sends one
+item for each credit. Items produced while the sender has no credit are
+held back at the source by policy, instead of being sent and thrown away
+by a full queue of the receiver.
+
+- buffer: keep the newest buffer_size items, older ones are dropped.
+- drop: drop new items.
+- sample: keep buffer_size items spread over the stall, every time the
+  buffer fills up every other item in it is dropped and only every
+  other new item is kept.
+"""
+from collections import deque
+
+CREDIT_BUFFER = 'buffer'
+CREDIT_DROP = 'drop'
+CREDIT_SAMPLE = 'sample'
+
+DEFAULT_CREDIT_POLICY = CREDIT_BUFFER
+DEFAULT_CREDIT_BUFFER_SIZE = 1000
+
+
+class CreditWindow(object):
+    """
+    Sender side of a stream.
+    send: callable sending one item.
+    """
+
+    def __init__(self, send, policy=DEFAULT_CREDIT_POLICY, buffer_size=DEFAULT_CREDIT_BUFFER_SIZE):
+        assert policy in (CREDIT_BUFFER, CREDIT_DROP, CREDIT_SAMPLE), f'Unknown credit policy {policy}.'
+        self.send = send
+        self.policy = policy
+        self.buffer_size = buffer_size
+        self.buffer = deque()
+        self.credits = 0
+        self.sent = 0
+        self.dropped = 0
+        # sample, one of stride items is kept.
+        self._stride = 1
+        self._skipped = 0
+
+    def push(self, item):
+        """Send item or hold it back, return False if item is dropped."""
+        buffer = self.buffer
+        if self.credits and not buffer:
+            self.credits -= 1
+            self.sent += 1
+            self.send(item)
+            return True
+
+        if self.policy == CREDIT_DROP or self.buffer_size <= 0:
+            self.dropped += 1
+            return False
+
+        if self.policy == CREDIT_SAMPLE:
+            self._skipped += 1
+            if self._skipped < self._stride:
+                self.dropped += 1
+                return False
+            self._skipped = 0
+
+            if len(buffer) >= self.buffer_size:
+                kept = list(buffer)[1::2]
+                self.dropped += len(buffer) - len(kept)
+                self.buffer = buffer = deque(kept)
+                self._stride *= 2
+        elif len(buffer) >= self.buffer_size:
+            buffer.popleft()
+            self.dropped += 1
+
+        buffer.append(item)
+        return True
+
+    def grant(self, credits):
+        """Add credits and send held back items with them."""
+        self.credits += credits
+        buffer = self.buffer
+        while self.credits and buffer:
+            self.credits -= 1
+            self.sent += 1
+            self.send(buffer.popleft())
+
+        if not buffer:
+            self._stride = 1
+            self._skipped = 0
+
+    def close(self):
+        """Drop items still held back, the stream is over."""
+        self.dropped += len(self.buffer)
+        self.buffer.clear()
+
+
+class CreditGranter(object):
+    """
+    Receiver side of a stream.
+    grant: callable sending a number of credits to the sender.
+    window: items the sender may have in flight, e.g. size of the queue
+            the receiver puts them in.
+    """
+
+    def __init__(self, grant, window):
+        assert window > 0
+        self.grant = grant
+        self.window = window
+        # credits are returned in chunks of half of the window.
+        self._threshold = max(window // 2, 1)
+        self._consumed = 0
+
+    def open(self):
+        self.grant(self.window)
+
+    def consumed(self, count=1):
+        self._consumed += count
+        if self._consumed >= self._threshold:
+            self.grant(self._consumed)
+            self._consumed = 0
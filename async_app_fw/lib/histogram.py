@@ -0,0 +1,63 @@
+"""
+Cheap histogram for runtime metrics.
+
+Values are counted in power of two buckets, bucket n holds values in
+[2 ** (n - 1), 2 ** n), bucket 0 holds values below 1. Recording is one
+int.bit_length() and a list index, percentiles are approximated by the
+upper bound of the bucket.
+"""
+
+
+class Histogram(object):
+    """
+    scale: recorded values are multiplied by it before bucketing, e.g.
+           1e6 to count seconds in microsecond buckets.
+    """
+
+    def __init__(self, scale=1, buckets=48):
+        self.scale = scale
+        self.buckets = [0] * buckets
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+        index = int(value * self.scale).bit_length()
+        buckets = self.buckets
+        buckets[index if index < len(buckets) else -1] += 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the percentile, in recorded unit."""
+        if not self.count:
+            return 0
+
+        rank = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min((1 << index) / self.scale, self.max)
+        return self.max
+
+    def reset(self):
+        self.buckets = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def as_dict(self):
+        """Non empty buckets as {upper bound: count}."""
+        return {(1 << index) / self.scale: count for index, count in enumerate(self.buckets) if count}
+
+    def __repr__(self):
+        return (f'<Histogram count={self.count} mean={self.mean:.6g} p50={self.percentile(50):.6g} '
+                f'p99={self.percentile(99):.6g} max={self.max:.6g}>')
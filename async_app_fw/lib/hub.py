@@ -3,11 +3,20 @@ import logging
 import os
 import inspect
 import socket
+import stat
 import threading
+import time
 import traceback
-from async_app_fw.lib import ip
+from collections import deque
+from async_app_fw.lib import ip, tls
+from async_app_fw.lib.histogram import Histogram
 from async_app_fw.utils import _listify
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 class SpawnFailed(Exception):
     pass
@@ -23,6 +32,38 @@ class ServerInitFailed(Exception):
 
 Queue = asyncio.Queue
 
+# event loop of a Hub, asyncio unless another one is chosen, auto is
+# uvloop when it's installed. uvloop doesn't pass the buffer of
+# BufferedProtocol to the socket, see mcp_transport.
+LOOP_AUTO = 'auto'
+LOOP_ASYNCIO = 'asyncio'
+LOOP_UVLOOP = 'uvloop'
+# environment variable naming the loop of app_hub, which is created on import.
+LOOP_ENV = 'ASYNC_APP_FW_LOOP'
+
+
+class EventLoopNotAvailable(Exception):
+    pass
+
+
+def get_loop_factory(name=None):
+    """
+    Function creating a new event loop of name, LOOP_*. name is taken
+    from LOOP_ENV when None, LOOP_ASYNCIO if it's not set either.
+    """
+    if name is None:
+        name = os.environ.get(LOOP_ENV) or LOOP_ASYNCIO
+    if name == LOOP_AUTO:
+        name = LOOP_UVLOOP if uvloop is not None else LOOP_ASYNCIO
+
+    if name == LOOP_ASYNCIO:
+        return asyncio.new_event_loop
+    if name == LOOP_UVLOOP:
+        if uvloop is None:
+            raise EventLoopNotAvailable('uvloop is not installed.')
+        return uvloop.new_event_loop
+    raise EventLoopNotAvailable(f'Unknown event loop <{name}>.')
+
 # logging.basicConfig(level=logging.WARNING)
 
 
@@ -85,13 +126,107 @@ class EventLoopAlreadyRunning(Exception):
     pass
 
 
+class HubShard(object):
+    """
+    One event loop of a Hub and the thread running it. Shard 0 is the loop
+    of the hub itself, the others are started by Hub.start_shards.
+
+    Other threads hand calls off to the shard by call_soon, calls queued
+    before the loop wakes up are run by one callback of the loop.
+    """
+
+    def __init__(self, hub, index, loop, thread=None):
+        self.hub = hub
+        self.index = index
+        self.loop = loop
+        self.thread = thread
+        # (func, args) handed off by other threads, in order.
+        self._handoff = deque()
+        self._handoff_lock = threading.Lock()
+        self._wakeup_pending = False
+        # calls handed off, and wake ups of the loop which ran them.
+        self.handoffs = 0
+        self.wakeups = 0
+        # connections served by the shard, see Hub.assign_shard.
+        self.connections = 0
+
+    def __repr__(self):
+        return f'<HubShard {self.index} connections={self.connections}>'
+
+    def in_thread(self):
+        return threading.current_thread() is self.thread
+
+    def call_soon(self, func, *args):
+        """Call func(*args) in the thread of the shard, may be called by any thread."""
+        with self._handoff_lock:
+            self._handoff.append((func, args))
+            self.handoffs += 1
+            if self._wakeup_pending:
+                return
+            self._wakeup_pending = True
+        try:
+            self.loop.call_soon_threadsafe(self._run_handoff)
+        except RuntimeError:
+            # the shard is stopped.
+            self.hub.LOG.debug('Call handed off to stopped shard %d is dropped.', self.index)
+
+    def call(self, func, *args):
+        """Call func(*args) at once when called by the thread of the shard, else call_soon."""
+        if self.in_thread():
+            return func(*args)
+        self.call_soon(func, *args)
+
+    def _run_handoff(self):
+        with self._handoff_lock:
+            calls = self._handoff
+            self._handoff = deque()
+            self._wakeup_pending = False
+        self.wakeups += 1
+        for func, args in calls:
+            try:
+                func(*args)
+            except Exception:
+                self.hub.LOG.exception('Error in call handed off to shard %d.', self.index)
+
+    def spawn(self, func, *args, **kwargs):
+        """Hub.spawn in the loop of the shard, a concurrent future when called by another thread."""
+        coro = self.hub._spawn_coro(func, *args, **kwargs)
+        if self.in_thread():
+            task = self.loop.create_task(coro)
+            task.set_name(f'Task Spawn: <{func.__name__}>')
+            return task
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _shutdown(self):
+        tasks = [task for task in asyncio.all_tasks(self.loop) if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def _run(self, started):
+        self.thread = threading.current_thread()
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+
 class Hub():
     LOG = logging.getLogger('async_hub')
     LOG.setLevel(logging.WARNING)
 
-    def __init__(self):
+    def __init__(self, loop_factory=None):
+        # function returning a new event loop, see get_loop_factory.
+        self.loop_factory = loop_factory or get_loop_factory()
         # make sure every singal Hub have different event loop instance.
-        self.loop = asyncio.new_event_loop()
+        self.loop = self.loop_factory()
+        # shard 0 is this loop, more are added by start_shards.
+        self.main_shard = HubShard(self, 0, self.loop)
+        self.shards = [self.main_shard]
+        self._thread_shards = {}
         self.update_thread()
         self.setup_eventloop()
         # self.loop.add_signal_handler(
@@ -112,12 +247,60 @@ class Hub():
 
     def update_thread(self):
         self.thread = threading.current_thread()
+        self.main_shard.thread = self.thread
+
+    @property
+    def sharded(self):
+        return len(self.shards) > 1
+
+    def start_shards(self, count):
+        """
+        Run count - 1 more event loops, each in its own thread. Connections
+        accepted by a StreamServer are served by them, see assign_shard.
+        """
+        while len(self.shards) < count:
+            shard = HubShard(self, len(self.shards), self.loop_factory())
+            started = threading.Event()
+            thread = threading.Thread(target=shard._run, args=(started,),
+                                      name=f'hub-shard-{shard.index}', daemon=True)
+            thread.start()
+            started.wait()
+            self._thread_shards[thread] = shard
+            self.shards.append(shard)
+        return self.shards
+
+    def stop_shards(self):
+        """Cancel the tasks of the loops started by start_shards and stop them."""
+        shards = self.shards[1:]
+        self.shards = [self.main_shard]
+        for shard in shards:
+            asyncio.run_coroutine_threadsafe(shard._shutdown(), shard.loop)
+        for shard in shards:
+            shard.thread.join()
+            self._thread_shards.pop(shard.thread, None)
+
+    def current_shard(self):
+        """Shard of the calling thread, None if it runs no loop of this hub."""
+        thread = threading.current_thread()
+        if thread is self.thread:
+            return self.main_shard
+        return self._thread_shards.get(thread)
+
+    def assign_shard(self):
+        """Shard serving the least connections, the loop of the hub only when it's not sharded."""
+        shards = self.shards[1:] or self.shards
+        shard = min(shards, key=lambda shard: shard.connections)
+        shard.connections += 1
+        return shard
+
+    def release_shard(self, shard):
+        shard.connections -= 1
 
     def setup_eventloop(self):
         if os.name == "posix" and isinstance(threading.current_thread(), threading._MainThread):
             asyncio.get_child_watcher().attach_loop(self.loop)
 
-    def spawn(self, func, *args, **kwargs):
+    def _spawn_coro(self, func, *args, **kwargs):
         async def _spawn(func, *args, **kwargs):
             name = func.__name__
 
@@ -130,7 +313,7 @@ class Hub():
                     return res
                 elif inspect.isfunction(func) or inspect.ismethod(func):
                     self.LOG.info('Spawn callback')
-                    self.loop.call_soon(func, *args)
+                    asyncio.get_running_loop().call_soon(func, *args)
                 else:
                     raise SpawnFailed(f"Can't Spawn <{name}> failed.")
             except StopIteration as e:
@@ -142,10 +325,16 @@ class Hub():
             finally:
                 self.LOG.info(f'Spawn end: {name}')
 
-        coro = _spawn(func, *args, **kwargs)
+        return _spawn(func, *args, **kwargs)
 
-        if threading.current_thread() == self.thread:
-            task = self.loop.create_task(coro)
+    def spawn(self, func, *args, **kwargs):
+        # a task of the loop of the calling thread, the hub's loop for
+        # other threads.
+        coro = self._spawn_coro(func, *args, **kwargs)
+        shard = self.current_shard()
+
+        if shard is not None:
+            task = shard.loop.create_task(coro)
             task.set_name(f'Task Spawn: <{func.__name__}>')
             return task
         else:
@@ -191,27 +380,108 @@ class Hub():
 app_hub = Hub()
 
 
+def _valid_address(addr):
+    # (path,) of a unix domain socket or (host, port).
+    return len(addr) == 1 or ip.valid_ipv4(addr[0]) or ip.valid_ipv6(addr[0])
+
+
 class StreamServer(object):
     def __init__(self, listen_info, handle=None, backlog=None,
-                 spawn='default', **ssl_args):
+                 spawn='default', server_factory=None, accept_factory=None, reuse_port=False, **ssl_args):
 
-        assert ip.valid_ipv4(listen_info[0]) or ip.valid_ipv6(listen_info[0])
+        assert _valid_address(listen_info)
 
         self.LOG = logging.getLogger(
             f'Stream Server, Listen on : {listen_info} ----')
         self.listen_info = listen_info
         self.handle = handle
         self.server = None
+        # coroutine function which has the same signature as asyncio.start_server
+        self.server_factory = server_factory or asyncio.start_server
+        # coroutine function (handle, sock, **kwds) serving an accepted
+        # socket in the running loop. When given and app_hub is sharded,
+        # connections are accepted here and served by the shards.
+        self.accept_factory = accept_factory
+        self.backlog = backlog or 100
+        # SO_REUSEPORT, processes listening to the same port share its
+        # connections. Not for a unix domain socket.
+        self.reuse_port = reuse_port
+        self._listen_sock = None
+        # TLS when ssl_args are given, see lib.tls. Sessions are resumed
+        # as long as this context is kept.
+        self.ssl_ctx = tls.server_context(**ssl_args) if ssl_args else None
 
     async def _init_server(self):
+        kwds = {}
+        if self.ssl_ctx is not None:
+            kwds['ssl'] = self.ssl_ctx
+        if self.reuse_port:
+            kwds['reuse_port'] = True
+        kwds['backlog'] = self.backlog
         try:
-            self.server: asyncio.base_events.Server = await asyncio.start_server(
-                self.handle, *self.listen_info)
+            self.server: asyncio.base_events.Server = await self.server_factory(
+                self.handle, *self.listen_info, **kwds)
         except socket.gaierror:
             self.LOG.warning("Socket's ip or port number is wrong.")
             raise ServerInitFailed()
 
+    def _listen(self):
+        if len(self.listen_info) == 1:
+            (path,) = self.listen_info
+            try:
+                if stat.S_ISSOCK(os.stat(path).st_mode):
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(path)
+            sock.listen(self.backlog)
+        else:
+            family = socket.AF_INET6 if ip.valid_ipv6(self.listen_info[0]) else socket.AF_INET
+            sock = socket.create_server(self.listen_info, family=family, backlog=self.backlog,
+                                        reuse_port=self.reuse_port)
+        sock.setblocking(False)
+        return sock
+
+    async def _serve_accepted(self, sock, shard):
+        async def handle(reader, writer):
+            try:
+                await self.handle(reader, writer)
+            finally:
+                app_hub.release_shard(shard)
+
+        kwds = {}
+        if self.ssl_ctx is not None:
+            kwds['ssl'] = self.ssl_ctx
+        try:
+            await self.accept_factory(handle, sock, **kwds)
+        except Exception:
+            app_hub.release_shard(shard)
+            sock.close()
+            raise
+
+    async def _serve_sharded(self):
+        """Accept connections and hand each one to the shard with the least connections."""
+        loop = asyncio.get_running_loop()
+        self._listen_sock = listen_sock = self._listen()
+        self.LOG.info(f'Stream Sever start to serve by {len(app_hub.shards) - 1} shards.')
+        try:
+            while True:
+                sock, _ = await loop.sock_accept(listen_sock)
+                shard = app_hub.assign_shard()
+                shard.call_soon(shard.spawn, self._serve_accepted, sock, shard)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._listen_sock = None
+            listen_sock.close()
+            self.LOG.info('Stop Stream server')
+
     async def serve_forever(self):
+        if self.accept_factory is not None and app_hub.sharded:
+            await self._serve_sharded()
+            return
+
         if self.server is None:
             await self._init_server()
 
@@ -228,8 +498,8 @@ class StreamServer(object):
 
 
 class StreamClient(object):
-    def __init__(self, addr, timeout=None, **ssl_args):
-        assert ip.valid_ipv4(addr[0]) or ip.valid_ipv6(addr[0])
+    def __init__(self, addr, timeout=None, connection_factory=None, **ssl_args):
+        assert _valid_address(addr)
 
         self.LOG = logging.getLogger(
             f'Stream Client, Connect to: {addr} ----')
@@ -237,14 +507,46 @@ class StreamClient(object):
         self.timeout = timeout
         self.ssl_args = ssl_args
         self._is_active = True
+        # coroutine function which has the same signature as asyncio.open_connection
+        self.connection_factory = connection_factory or asyncio.open_connection
+
+        # TLS when ssl_args are given, see lib.tls. The context resumes the
+        # session of the previous connection, pass the same ssl_ctx to
+        # clients which should share sessions.
+        ssl_args = dict(ssl_args)
+        server_hostname = ssl_args.pop('server_hostname', None)
+        self.ssl_ctx = tls.client_context(**ssl_args) if ssl_args else None
+        if server_hostname is None and self.ssl_ctx is not None:
+            # no SNI for an ip address or a unix domain socket.
+            server_hostname = addr[0] if len(addr) > 1 else ''
+        self.server_hostname = server_hostname
+        # seconds to connect, TCP and TLS handshake, of each connection.
+        self.connect_time = Histogram(scale=1e6)
+        # TLS connections which resumed a session.
+        self.resumed = 0
 
     async def connect(self):
+        kwds = {}
+        if self.ssl_ctx is not None:
+            kwds.update(ssl=self.ssl_ctx, server_hostname=self.server_hostname)
+
+        start = time.perf_counter()
         try:
-            reader, writer = await asyncio.wait_for(asyncio.open_connection(*self.addr), timeout=self.timeout)
+            reader, writer = await asyncio.wait_for(self.connection_factory(*self.addr, **kwds),
+                                                    timeout=self.timeout)
         except socket.error as e:
             self.LOG.warning(f'Connection Faield. {e}')
             return None
 
+        elapsed = time.perf_counter() - start
+        self.connect_time.record(elapsed)
+        ssl_object = writer.get_extra_info('ssl_object')
+        if ssl_object is not None:
+            if ssl_object.session_reused:
+                self.resumed += 1
+            self.LOG.info(f'Connected with {ssl_object.version()} in {elapsed * 1000:.2f} ms, '
+                          f'session resumed: {ssl_object.session_reused}.')
+
         return (reader, writer)
 
     def connect_loop(self, handle, interval=0) -> asyncio.Task:
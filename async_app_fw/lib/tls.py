@@ -0,0 +1,87 @@
+"""
+TLS contexts of StreamServer and StreamClient.
+
+ssl_args of both are turned into an ssl.SSLContext by server_context and
+client_context, a prebuilt context is passed as ssl_args['ssl_ctx'].
+
+- certfile, keyfile: certificate chain of this end.
+- ca_certs: certificates the peer is verified against. A server with
+  ca_certs requires a client certificate, a client without ca_certs
+  verifies the server against the default certificates of the system, as
+  ssl.create_default_context does.
+- check_hostname: client checks the server certificate matches
+  server_hostname, see StreamClient. A unix domain socket has no host
+  name, server_hostname is given then.
+- insecure: client doesn't verify the server at all, only given
+  explicitly, e.g. for tests with a self-signed certificate.
+
+A client context resumes the session of its previous connection, so the
+reconnects of an agent skip the full handshake as long as the server
+keeps its context. With TLS 1.3 the session ticket comes after the
+handshake, so the session is taken from the previous connection when the
+next one is made, not when the previous one is made.
+"""
+
+import ssl
+
+
+class ResumableSSLContext(ssl.SSLContext):
+    """Client context, new connections resume the last resumable session."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.session = None
+        self._last_sslobj = None
+
+    def _resumable_session(self):
+        sslobj = self._last_sslobj
+        if sslobj is not None:
+            session = sslobj.session
+            # a TLS 1.3 session is only resumable once its ticket arrived.
+            if session is not None and (session.has_ticket or session.id):
+                self.session = session
+        return self.session
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        # asyncio doesn't pass a session, see sslproto.SSLProtocol.
+        if server_side:
+            return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+        if session is None:
+            session = self._resumable_session()
+        sslobj = super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+        self._last_sslobj = sslobj
+        return sslobj
+
+
+def server_context(certfile=None, keyfile=None, ca_certs=None, ssl_ctx=None):
+    if ssl_ctx is not None:
+        return ssl_ctx
+
+    assert certfile is not None, 'TLS server needs a certificate.'
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(certfile, keyfile)
+    if ca_certs is not None:
+        ctx.load_verify_locations(ca_certs)
+        ctx.verify_mode = ssl.CERT_REQUIRED
+    return ctx
+
+
+def client_context(certfile=None, keyfile=None, ca_certs=None, check_hostname=True, insecure=False, ssl_ctx=None):
+    if ssl_ctx is not None:
+        return ssl_ctx
+
+    # PROTOCOL_TLS_CLIENT requires a verified certificate and host name.
+    ctx = ResumableSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    if insecure:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    else:
+        ctx.check_hostname = check_hostname
+        if ca_certs is not None:
+            ctx.load_verify_locations(ca_certs)
+        else:
+            ctx.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    if certfile is not None:
+        ctx.load_cert_chain(certfile, keyfile)
+    return ctx
@@ -0,0 +1,90 @@
+"""
+Capability negotiation of MCP connection.
+
+Master and agent announce what they support in MCPHello, the connection
+records what both ends support as its negotiated capability. Optional
+wire features must only be used when the negotiated capability has them.
+
+A peer which sends MCPHello without capability (an agent before
+negotiation was added) is treated as LEGACY_CAPABILITY.
+"""
+from async_app_fw.protocol.mcp import mcp_compression, mcp_payload, mcp_v_1_0 as mcproto
+
+# largest frame accepted, frames above fragment size are fragmented
+# when MCP_CAP_FRAGMENT is negotiated.
+DEFAULT_MAX_FRAME_SIZE = 0xffffffff
+
+DEFAULT_FEATURES = (mcproto.MCP_CAP_BATCH | mcproto.MCP_CAP_COMPRESSION | mcproto.MCP_CAP_FRAGMENT
+                    | mcproto.MCP_CAP_CREDIT | mcproto.MCP_CAP_STRIPE | mcproto.MCP_CAP_SHM
+                    | mcproto.MCP_CAP_RESUME | mcproto.MCP_CAP_HEARTBEAT)
+DEFAULT_COMPRESSION = mcp_compression.supported_algorithms()
+DEFAULT_BATCH_MAX = 64
+
+
+def codec_bitmap(codec_ids):
+    bitmap = 0
+    for codec_id in codec_ids:
+        bitmap |= 1 << codec_id
+    return bitmap
+
+
+def _registered_codec_bitmap():
+    return codec_bitmap(codec.codec_id for codec in mcp_payload.registered_codecs())
+
+
+class Capability(object):
+    """
+    features: bitmap of mcp_v_1_0.MCP_CAP_*
+    max_frame_size: largest frame the receiver accepts.
+    compression: bitmap of mcp_v_1_0.MCP_COMPRESSION_*
+    batch_max: largest number of messages in one batch, 0 is no batching.
+    codecs: bitmap of payload codec ids, bit n is codec_id n.
+    """
+
+    def __init__(self, features=DEFAULT_FEATURES, max_frame_size=DEFAULT_MAX_FRAME_SIZE,
+                 compression=DEFAULT_COMPRESSION, batch_max=DEFAULT_BATCH_MAX, codecs=None):
+        self.features = features
+        self.max_frame_size = max_frame_size
+        self.compression = compression
+        self.batch_max = batch_max
+        self.codecs = _registered_codec_bitmap() if codecs is None else codecs
+
+    def __repr__(self):
+        return (f'<Capability features=0x{self.features:x} max_frame_size={self.max_frame_size} '
+                f'compression=0x{self.compression:x} batch_max={self.batch_max} codecs=0x{self.codecs:x}>')
+
+    def __eq__(self, other):
+        return isinstance(other, Capability) and self.as_tuple() == other.as_tuple()
+
+    def as_tuple(self):
+        return (self.features, self.max_frame_size, self.compression, self.batch_max, self.codecs)
+
+    def supports(self, feature):
+        return self.features & feature == feature
+
+    def supports_compression(self, algorithm):
+        return self.compression & algorithm == algorithm
+
+    def supports_codec(self, codec_id):
+        return bool(self.codecs >> codec_id & 1)
+
+    def negotiate(self, peer):
+        """
+        Return what both ends support.
+        peer is None when the peer doesn't send capability.
+        """
+        if peer is None:
+            peer = LEGACY_CAPABILITY
+
+        return Capability(
+            features=self.features & peer.features,
+            max_frame_size=min(self.max_frame_size, peer.max_frame_size),
+            compression=self.compression & peer.compression,
+            batch_max=min(self.batch_max, peer.batch_max),
+            codecs=self.codecs & peer.codecs)
+
+
+# what an agent without capability negotiation handles.
+LEGACY_CAPABILITY = Capability(
+    features=0, max_frame_size=DEFAULT_MAX_FRAME_SIZE, compression=0, batch_max=0,
+    codecs=codec_bitmap([mcp_payload.JSON.codec_id, mcp_payload.PICKLE.codec_id, mcp_payload.UTF8.codec_id]))
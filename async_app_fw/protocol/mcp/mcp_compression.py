@@ -0,0 +1,145 @@
+"""
+Per-frame compression of MCP.
+
+A compressed frame has the header of the original frame with
+MCP_FLAG_COMPRESSED set in msg_type, its body is one byte of algorithm
+(mcp_v_1_0.MCP_COMPRESSION_*) followed by the compressed original frame.
+
+Only standard library compressors are used, lzma is skipped when python
+is built without it.
+"""
+import struct
+import time
+import zlib
+
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
+from async_app_fw.protocol.mcp.mcp_parser import WrongMcpMsgHeader
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+_HEADER = struct.Struct(mcproto.MCP_HEADER_PACK_STR)
+_COMPRESSED_HEADER = struct.Struct(mcproto.MCP_HEADER_PACK_STR + 'B')
+
+DEFAULT_ZLIB_LEVEL = 1
+DEFAULT_LZMA_PRESET = 0
+
+
+def _zlib_decompress(data, max_size):
+    decompressor = zlib.decompressobj()
+    out = decompressor.decompress(data, max_size)
+    if decompressor.unconsumed_tail:
+        raise WrongMcpMsgHeader(f'Decompressed frame is larger than {max_size} bytes.')
+    return out
+
+
+def _lzma_decompress(data, max_size):
+    decompressor = lzma.LZMADecompressor()
+    out = decompressor.decompress(data, max_size)
+    if not decompressor.eof:
+        raise WrongMcpMsgHeader(f'Decompressed frame is larger than {max_size} bytes.')
+    return out
+
+
+# algorithm: (compress, decompress)
+_COMPRESSORS = {
+    mcproto.MCP_COMPRESSION_ZLIB: (
+        lambda data: zlib.compress(data, DEFAULT_ZLIB_LEVEL), _zlib_decompress),
+}
+
+if lzma is not None:
+    _COMPRESSORS[mcproto.MCP_COMPRESSION_LZMA] = (
+        lambda data: lzma.compress(data, preset=DEFAULT_LZMA_PRESET), _lzma_decompress)
+
+# from the most preferred, zlib is much cheaper on CPU.
+ALGORITHM_PREFERENCE = (mcproto.MCP_COMPRESSION_ZLIB, mcproto.MCP_COMPRESSION_LZMA)
+
+
+def supported_algorithms():
+    """Bitmap of algorithms available in this python."""
+    bitmap = 0
+    for algorithm in _COMPRESSORS:
+        bitmap |= algorithm
+    return bitmap
+
+
+def choose_algorithm(bitmap):
+    """The preferred algorithm in bitmap, None if there is none."""
+    for algorithm in ALGORITHM_PREFERENCE:
+        if bitmap & algorithm and algorithm in _COMPRESSORS:
+            return algorithm
+    return None
+
+
+class CompressionStats(object):
+    """Counters of a connection, used to tune the compression threshold."""
+
+    def __init__(self):
+        self.frames_compressed = 0
+        # large enough but the compressed frame was not smaller.
+        self.frames_incompressible = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.compress_cpu_time = 0.0
+        self.frames_decompressed = 0
+        self.decompress_cpu_time = 0.0
+
+    @property
+    def ratio(self):
+        """Compressed / original size of compressed frames."""
+        if self.bytes_before == 0:
+            return 1.0
+        return self.bytes_after / self.bytes_before
+
+    def __repr__(self):
+        return (f'<CompressionStats compressed={self.frames_compressed} '
+                f'incompressible={self.frames_incompressible} ratio={self.ratio:.3f} '
+                f'compress_cpu={self.compress_cpu_time:.6f}s '
+                f'decompressed={self.frames_decompressed} '
+                f'decompress_cpu={self.decompress_cpu_time:.6f}s>')
+
+
+def compress_frame(buf, algorithm, stats: CompressionStats):
+    """
+    Return compressed frame of buf, or buf itself if compression
+    doesn't make it smaller.
+    """
+    compress, _ = _COMPRESSORS[algorithm]
+
+    start = time.thread_time()
+    data = compress(buf)
+    stats.compress_cpu_time += time.thread_time() - start
+
+    frame_len = _COMPRESSED_HEADER.size + len(data)
+    if frame_len >= len(buf):
+        stats.frames_incompressible += 1
+        return buf
+
+    (msg_type, _, version, xid) = _HEADER.unpack_from(buf)
+    frame = bytearray(frame_len)
+    _COMPRESSED_HEADER.pack_into(
+        frame, 0, msg_type | mcproto.MCP_FLAG_COMPRESSED, frame_len, version, xid, algorithm)
+    frame[_COMPRESSED_HEADER.size:] = data
+
+    stats.frames_compressed += 1
+    stats.bytes_before += len(buf)
+    stats.bytes_after += frame_len
+    return frame
+
+
+def decompress_frame(frame, max_size, stats: CompressionStats):
+    """Return the original frame of a compressed frame."""
+    (_, _, _, _, algorithm) = _COMPRESSED_HEADER.unpack_from(frame)
+    if algorithm not in _COMPRESSORS:
+        raise WrongMcpMsgHeader(f'Unknown compression algorithm {algorithm}.')
+
+    _, decompress = _COMPRESSORS[algorithm]
+
+    start = time.thread_time()
+    buf = decompress(frame[_COMPRESSED_HEADER.size:], max_size)
+    stats.decompress_cpu_time += time.thread_time() - start
+    stats.frames_decompressed += 1
+
+    return buf
@@ -0,0 +1,102 @@
+"""
+Fragmentation of large MCP frames.
+
+A frame larger than the fragment size is sent as MCPFragment frames of
+one stream, the data of fragments are consecutive parts of the original
+frame. Fragments of different streams and other frames may be
+interleaved on the wire, fragments of one stream are always in order.
+MachineConnection sends streams one after another.
+
+Only used when MCP_CAP_FRAGMENT is negotiated.
+"""
+import struct
+
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
+from async_app_fw.protocol.mcp.mcp_parser import WrongMcpMsgHeader
+
+_HEADER = struct.Struct(mcproto.MCP_HEADER_PACK_STR)
+_FRAGMENT = struct.Struct(mcproto.MCP_HEADER_PACK_STR + mcproto.MCP_FRAGMENT_STR[1:])
+
+FRAGMENT_OVERHEAD = _FRAGMENT.size
+
+# data bytes in one fragment.
+DEFAULT_FRAGMENT_SIZE = 32 * 1024
+# bytes of partially received frames a connection keeps.
+DEFAULT_MAX_REASSEMBLY_BYTES = 256 * 1024 * 1024
+
+
+class FragmentReassemblyOverflow(WrongMcpMsgHeader):
+    pass
+
+
+def iter_fragments(buf, stream_id, fragment_size=DEFAULT_FRAGMENT_SIZE):
+    """Yield MCPFragment frames of buf."""
+    total_len = len(buf)
+    (_, _, version, _) = _HEADER.unpack_from(buf)
+    view = memoryview(buf)
+    for offset in range(0, total_len, fragment_size):
+        data = view[offset:offset + fragment_size]
+        frame_len = FRAGMENT_OVERHEAD + len(data)
+        frame = bytearray(frame_len)
+        _FRAGMENT.pack_into(frame, 0, mcproto.MCP_FRAGMENT, frame_len, version, 0,
+                            stream_id, total_len, offset, len(data))
+        frame[FRAGMENT_OVERHEAD:] = data
+        yield frame
+
+
+class FragmentReassembler(object):
+    """
+    Reassemble frames from MCPFragment frames of a connection.
+    Partially received frames are limited to max_bytes in total.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_REASSEMBLY_BYTES):
+        self.max_bytes = max_bytes
+        # stream_id: [frame, received bytes]
+        self._streams = {}
+        self._reserved = 0
+        self.frames_reassembled = 0
+
+    @property
+    def pending_bytes(self):
+        return self._reserved
+
+    def push(self, fragment):
+        """
+        Add a MCPFragment frame, return the original frame when it is
+        complete, otherwise None.
+        """
+        (_, frame_len, _, _, stream_id, total_len, offset, data_len) = _FRAGMENT.unpack_from(fragment)
+        if frame_len != FRAGMENT_OVERHEAD + data_len:
+            raise WrongMcpMsgHeader(f'Fragment of stream {stream_id} has wrong length {frame_len}.')
+
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            if total_len < mcproto.MCP_HEADER_SIZE:
+                raise WrongMcpMsgHeader(f'Stream {stream_id} has wrong total length {total_len}.')
+            if offset != 0:
+                raise WrongMcpMsgHeader(f'Stream {stream_id} starts at offset {offset}.')
+            if self._reserved + total_len > self.max_bytes:
+                raise FragmentReassemblyOverflow(
+                    f'Stream {stream_id} of {total_len} bytes exceeds reassembly limit {self.max_bytes}.')
+            stream = self._streams[stream_id] = [bytearray(total_len), 0]
+            self._reserved += total_len
+
+        frame, received = stream
+        if offset != received or offset + data_len > len(frame):
+            raise WrongMcpMsgHeader(f'Fragment of stream {stream_id} at offset {offset} is out of order.')
+
+        frame[offset:offset + data_len] = fragment[FRAGMENT_OVERHEAD:frame_len]
+        received += data_len
+        if received < len(frame):
+            stream[1] = received
+            return None
+
+        del self._streams[stream_id]
+        self._reserved -= len(frame)
+        self.frames_reassembled += 1
+        return frame
+
+    def clear(self):
+        self._streams.clear()
+        self._reserved = 0
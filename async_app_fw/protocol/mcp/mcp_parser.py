@@ -70,7 +70,206 @@ class StringifyMixin(stringify.StringifyMixin):
         return obj_cls
 
 
-class MCPMsgBase(object):
+_PARSER_TEMPLATE = """
+def parser(cls, connection, msg_type, msg_len, version, xid, buf):
+    msg_ = _new(cls)
+    msg_.connection = connection
+    msg_.msg_type = msg_type
+    msg_.msg_len = msg_len
+    msg_.version = version
+    msg_.xid = xid
+    if buf.__class__ is not _memoryview:
+        buf = _bytes(buf)
+    msg_.buf = buf
+{body}
+    return msg_
+"""
+
+_SERIALIZE_TEMPLATE = """
+def serialize(self):
+    self.version = self.connection.mcproto_parser.VERSION_ID
+    self.msg_type = self.cls_msg_type
+    if self.xid is None:
+        self.xid = 0
+{body}
+    buf = _bytearray(msg_len)
+{pack}
+    self.buf = buf
+"""
+
+def _overridden(cls, name):
+    base = globals().get('MCPMsgBase')
+    return base is not None and getattr(cls, name) is not getattr(base, name)
+
+
+def compile_schema(cls):
+    """
+    Compile _FIELDS and _PAYLOAD of a message class into parser and
+    serialize.
+
+    _FIELDS: ((attr_name, struct format character), ...), fixed size fields
+             which follow the header.
+    _PAYLOAD: (attr_name or tuple of attr_names, PayloadCodec) or None.
+              The last field of _FIELDS carries the payload length.
+              A tuple of names is encoded as a dict of those attributes.
+              Every peer decodes the payload with this codec.
+    _PAYLOAD_CODECS: codecs preferred to the one of _PAYLOAD, the first
+                     of them the negotiated capability of the connection
+                     has is used instead, see payload_codec.
+    _OPTIONAL_FIELDS: fields appended to a message without payload by a
+                      later revision. Peers of earlier revisions send the
+                      message without them, they are parsed as None then.
+
+    parser only unpacks fixed fields, payload attributes are decoded on
+    first access, see MCPMsgBase.__getattr__.
+
+    serialize packs the message into a new msg.buf.
+    """
+    fields = cls._FIELDS
+    optional_fields = cls._OPTIONAL_FIELDS
+    assert not (optional_fields and cls._PAYLOAD is not None), \
+        f'{cls.__name__}: optional fields can not follow a payload.'
+
+    field_names = tuple(name for name, _ in fields)
+    optional_names = tuple(name for name, _ in optional_fields)
+    field_fmt = ''.join(fmt for _, fmt in fields)
+    optional_fmt = ''.join(fmt for _, fmt in optional_fields)
+    msg_struct = struct.Struct(MCP_HEADER_PACK_STR + field_fmt + optional_fmt)
+    body_struct = struct.Struct('!' + field_fmt)
+    optional_struct = struct.Struct('!' + optional_fmt)
+
+    cls._field_names = field_names + optional_names
+    cls._msg_struct = msg_struct
+    cls._body_struct = body_struct
+
+    namespace = {
+        '_new': object.__new__,
+        '_memoryview': memoryview,
+        '_bytes': bytes,
+        '_bytearray': bytearray,
+        '_body_unpack_from': body_struct.unpack_from,
+        '_msg_pack_into': msg_struct.pack_into,
+        '_optional_unpack_from': optional_struct.unpack_from,
+    }
+    parse_lines = []
+    serialize_lines = []
+
+    if _overridden(cls, '_serialize_pre'):
+        serialize_lines.append('self._serialize_pre()')
+
+    if fields:
+        targets = ''.join(f'msg_.{name}, ' for name in field_names)
+        parse_lines.append(f'({targets}) = _body_unpack_from(buf, {MCP_HEADER_SIZE})')
+
+    if optional_fields:
+        targets = ''.join(f'msg_.{name}, ' for name in optional_names)
+        parse_lines.extend([
+            f'if msg_len >= {msg_struct.size}:',
+            f'    ({targets}) = _optional_unpack_from(buf, {MCP_HEADER_SIZE + body_struct.size})',
+            'else:',
+            f'    {" = ".join(f"msg_.{name}" for name in optional_names)} = None',
+        ])
+
+    if cls._PAYLOAD is None:
+        cls._payload_codec = None
+        cls._payload_attrs = None
+        cls._lazy_attrs = frozenset()
+        serialize_lines.append(f'msg_len = {msg_struct.size}')
+        pack_lines = []
+    else:
+        assert len(fields) > 0, f'{cls.__name__}: payload needs a length field.'
+        attrs, codec = cls._PAYLOAD
+        cls._payload_codec = codec
+        cls._payload_attrs = attrs
+        namespace['_encode'] = codec.encode
+        assert all(c.codec_id is not None for c in cls._PAYLOAD_CODECS), \
+            f'{cls.__name__}: negotiated codecs need a codec_id.'
+        length_field = field_names[-1]
+        offset = msg_struct.size
+        cls._payload_len_field = length_field
+        cls._payload_offset = offset
+
+        cls._lazy_attrs = frozenset((attrs,) if isinstance(attrs, str) else attrs)
+
+        if cls._PAYLOAD_CODECS:
+            # chosen by the capability of the connection.
+            serialize_lines.append('_encode = self.payload_codec(self.connection).encode')
+
+        if isinstance(attrs, str) and not _overridden(cls, '_get_payload'):
+            serialize_lines.append(f'payload = _encode(self.{attrs})')
+        else:
+            serialize_lines.append('payload = _encode(self._get_payload())')
+
+        serialize_lines.extend([
+            f'self.{length_field} = len(payload)',
+            f'msg_len = {offset} + len(payload)',
+        ])
+        pack_lines = [f'buf[offset + {offset}:offset + msg_len] = payload']
+
+    if _overridden(cls, '_post_parse'):
+        parse_lines.append('msg_._post_parse()')
+
+    # header and fields are packed in one call.
+    values = ''.join(f', self.{name}' for name in cls._field_names)
+    pack_lines.extend([
+        'self.msg_len = msg_len',
+        f'_msg_pack_into(buf, offset, self.msg_type, msg_len, self.version, self.xid{values})',
+    ])
+
+    def indent(lines):
+        return '\n'.join('    ' + line for line in lines)
+
+    exec(_PARSER_TEMPLATE.format(body=indent(parse_lines)), namespace)
+    # serialize packs into a new buffer at offset 0.
+    exec(_SERIALIZE_TEMPLATE.format(
+        body=indent(serialize_lines + ['offset = 0']), pack=indent(pack_lines)), namespace)
+    cls.parser = classmethod(namespace['parser'])
+    cls.serialize = namespace['serialize']
+
+
+def _base_slots(bases):
+    slots = set()
+    for base in bases:
+        for cls in base.__mro__:
+            cls_slots = cls.__dict__.get('__slots__', ())
+            slots.update((cls_slots,) if isinstance(cls_slots, str) else cls_slots)
+    return slots
+
+
+class _MsgMeta(type):
+    """
+    Give message classes __slots__ for their _FIELDS, _OPTIONAL_FIELDS and
+    _PAYLOAD. A class which keeps other attributes declares them in its
+    own __slots__.
+    """
+
+    def __new__(mcs, name, bases, namespace, **kwargs):
+        slots = namespace.get('__slots__', ())
+        slots = [slots] if isinstance(slots, str) else list(slots)
+        slots.extend(field for field, _ in namespace.get('_FIELDS', ()))
+        slots.extend(field for field, _ in namespace.get('_OPTIONAL_FIELDS', ()))
+        payload = namespace.get('_PAYLOAD')
+        if payload is not None:
+            attrs, _ = payload
+            slots.extend((attrs,) if isinstance(attrs, str) else attrs)
+
+        inherited = _base_slots(bases)
+        namespace['__slots__'] = tuple(dict.fromkeys(slot for slot in slots if slot not in inherited))
+        return super().__new__(mcs, name, bases, namespace, **kwargs)
+
+
+class MCPMsgBase(object, metaclass=_MsgMeta):
+    __slots__ = ('connection', 'msg_type', 'msg_len', 'version', 'xid', 'buf')
+
+    _FIELDS = ()
+    _OPTIONAL_FIELDS = ()
+    _PAYLOAD = None
+    _PAYLOAD_CODECS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        compile_schema(cls)
+
     def __init__(self, connection):
         self.connection = connection
         self.msg_type = None
@@ -79,6 +278,16 @@ class MCPMsgBase(object):
         self.xid = None
         self.buf = None
 
+    def __getattr__(self, name):
+        # only reached when the slot is empty. Payload attributes of a
+        # parsed message are decoded from buf on first access, messages
+        # created by __init__ assign them and never decode.
+        if name in self._lazy_attrs and self.buf is not None:
+            self._decode_payload()
+            return object.__getattribute__(self, name)
+
+        raise AttributeError(f'{self.__class__.__name__!r} object has no attribute {name!r}')
+
     def set_headers(self, msg_type, msg_len, version, xid):
         assert msg_type == self.cls_msg_type
 
@@ -91,65 +300,72 @@ class MCPMsgBase(object):
         self.xid = xid
 
     def set_buf(self, buf):
-        self.buf = bytes(buf)
+        # memoryview comes from the receive buffer of buffered transport,
+        # keep it as is and copy it only when release_buf is called.
+        if isinstance(buf, memoryview):
+            self.buf = buf
+        else:
+            self.buf = bytes(buf)
+
+    def release_buf(self):
+        """
+        Detach the message from the receive buffer it was parsed from.
+        The buffered transport calls it before the frame memory is reused.
+        """
+        if isinstance(self.buf, memoryview):
+            self.buf = self.buf.tobytes()
 
     @classmethod
-    def parser(cls, connection, msg_type, msg_len, version, xid, buf):
-        msg_ = cls(connection)
-        msg_.set_headers(msg_type, msg_len,
-                         version, xid)
-        msg_.set_buf(buf)
-        return msg_
-
-    def _serialize_pre(self):
-        self.version = self.connection.mcproto_parser.VERSION_ID
-        self.msg_type = self.cls_msg_type
-        self.buf = bytearray(MCP_HEADER_SIZE)
-
-    def _serialize_header(self):
-        # buffer length is determined after trailing data is formated.
-        assert self.msg_type is not None
-        assert self.buf is not None
-        assert len(self.buf) >= MCP_HEADER_SIZE
-
-        self.msg_len = len(self.buf)
-        if self.xid is None:
-            self.xid = 0
-
-        struct.pack_into(MCP_HEADER_PACK_STR,
-                         self.buf, 0,
-                         self.msg_type, self.msg_len, self.version, self.xid)
-
-    def _serialize_body(self):
+    def payload_codec(cls, connection):
+        """
+        Codec of the payload on connection, the first of _PAYLOAD_CODECS
+        both ends negotiated, else the codec of _PAYLOAD.
+        """
+        capability = getattr(connection, 'capability', None)
+        if capability is not None:
+            for codec in cls._PAYLOAD_CODECS:
+                if capability.supports_codec(codec.codec_id):
+                    return codec
+
+        return cls._payload_codec
+
+    def _get_payload(self):
+        attrs = self._payload_attrs
+        if isinstance(attrs, str):
+            return getattr(self, attrs)
+
+        return {attr: getattr(self, attr) for attr in attrs}
+
+    def _decode_payload(self):
+        payload_len = getattr(self, self._payload_len_field)
+        if payload_len:
+            offset = self._payload_offset
+            # memoryview slice, no intermediate bytes object.
+            codec = self.payload_codec(self.connection) if self._PAYLOAD_CODECS else self._payload_codec
+            payload = codec.decode(memoryview(self.buf)[offset:offset + payload_len])
+        else:
+            payload = None
+
+        self._set_payload(payload)
+
+    def _set_payload(self, value):
+        attrs = self._payload_attrs
+        if isinstance(attrs, str):
+            setattr(self, attrs, value)
+            return
+
+        for attr in attrs:
+            setattr(self, attr, None if value is None else value[attr])
+
+    def _post_parse(self):
+        """Hook for deriving attributes after fields and payload are decoded."""
         pass
 
-    def serialize(self):
-        self._serialize_pre()
-        self._serialize_body()
-        self._serialize_header()
-
-
-class MsgInMsgBase(MCPMsgBase):
-    @classmethod
-    def _decode_value(cls, k, json_value, decode_string=base64.b64decode,
-                      **additional_args):
-        return cls._get_decoder(k, decode_string)(json_value,
-                                                  **additional_args)
-
-
-def namedtuple(typename, fields, **kwargs):
-    class _namedtuple(StringifyMixin,
-                      collections.namedtuple(typename, fields, **kwargs)):
+    def _serialize_pre(self):
+        """Hook for deriving wire fields before the message is packed."""
         pass
-    return _namedtuple
 
+    # parser and serialize are generated by compile_schema.
 
-def msg_str_attr(msg_, buf, attr_list=None):
-    if attr_list is None:
-        attr_list = stringify.obj_attrs(msg_)
-    for attr in attr_list:
-        val = getattr(msg_, attr, None)
-        if val is not None:
-            buf += ' %s %s' % (attr, val)
 
-    return buf
+compile_schema(MCPMsgBase)
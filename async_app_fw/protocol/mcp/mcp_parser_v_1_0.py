@@ -2,10 +2,10 @@ import dataclasses
 import aiohttp
 import json
 import struct
-import pickle
 from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
-from async_app_fw.lib.pack_utils import msg_pack_into
 from async_app_fw.protocol.mcp import mcp_parser
+from async_app_fw.protocol.mcp.mcp_payload import PayloadCodec, JSON, PICKLE, UTF8, RAW
+from async_app_fw.protocol.mcp.mcp_capability import Capability
 import logging
 
 from async_app_fw.protocol.mcp.mcp_parser import MCPMsgBase
@@ -41,6 +41,19 @@ def _register_parser(cls):
     return cls
 
 
+def set_payload_codec(msg_cls, codec):
+    '''
+    Use codec for payloads of a registered message class on connections
+    which negotiated it, others keep the codec of its _PAYLOAD. The codec
+    of _PAYLOAD clears the preference.
+    '''
+    assert _MSG_PARSERS.get(msg_cls.cls_msg_type) is not None
+    _, default = msg_cls._PAYLOAD
+    msg_cls._PAYLOAD_CODECS = () if codec is default else (codec,)
+    mcp_parser.compile_schema(msg_cls)
+    _MSG_PARSERS[msg_cls.cls_msg_type] = msg_cls.parser
+
+
 @mcp_parser.register_msg_parser(keyword=VERSION_ID)
 def msg_parser(connection, msg_type, msg_len, version, xid, buf):
     assert version == VERSION_ID
@@ -51,74 +64,54 @@ def msg_parser(connection, msg_type, msg_len, version, xid, buf):
 @_register_parser
 @_set_msg_type(mcproto.MCP_HELLO)
 class MCPHello(MCPMsgBase):
-    def __init__(self, mcp_connection, connection_id=None):
+    _FIELDS = (('connection_id', 'H'),)
+    # None when the peer doesn't negotiate capability.
+    _OPTIONAL_FIELDS = (('features', 'I'), ('max_frame_size', 'I'), ('compression', 'B'),
+                        ('batch_max', 'H'), ('codecs', 'I'))
+
+    def __init__(self, mcp_connection, connection_id=None, capability: Capability = None):
         super().__init__(mcp_connection)
         self.connection_id = connection_id
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(MCPHello, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.connection_id, ) = struct.unpack_from(
-            mcproto.MCP_HELLO_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
+        if capability is None:
+            capability = mcp_connection.local_capability
 
-        return msg
+        (self.features, self.max_frame_size, self.compression,
+         self.batch_max, self.codecs) = capability.as_tuple()
 
-    def _serialize_body(self):
-        assert self.connection_id is not None
+    def get_capability(self):
+        if self.features is None:
+            return None
 
-        msg_pack_into(mcproto.MCP_HELLO_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.connection_id)
+        return Capability(self.features, self.max_frame_size, self.compression,
+                          self.batch_max, self.codecs)
 
 
 class MCPJobIDWithInfo(MCPMsgBase):
+    _FIELDS = (('job_id', 'I'), ('job_info_len', 'I'))
+    _PAYLOAD = ('job_info', JSON)
+
     def __init__(self, mcp_connection, job_id=None, job_info=None):
         super().__init__(mcp_connection)
         self.job_id = job_id
         self.job_info = job_info
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(MCPJobIDWithInfo, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.job_id, msg.job_info_len) = struct.unpack_from(
-            mcproto.MCP_JOB_ID_WITH_INFO_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.MCP_JOB_ID_WITH_INFO_SIZE
-
-        msg.job_info_bytes = msg.buf[offset:]
-        if msg.job_info_len < len(msg.job_info_bytes):
-            msg.job_info_bytes = msg.job_info_bytes[:msg.job_info_len]
-
-        msg.job_info_str = msg.job_info_bytes.decode(encoding='utf-8')
-        msg.job_info = json.loads(msg.job_info_str)
 
-        return msg
+@_register_parser
+@_set_msg_type(mcproto.MCP_JOB_CREATE_REPLY)
+class MCPJobCreateReply(MCPJobIDWithInfo):
+    pass
 
-    def serialize(self):
-        self.job_info_str = json.dumps(self.job_info)
-        self.job_info_bytes = self.job_info_str.encode('utf-8')
-        self.job_info_len = len(self.job_info_bytes)
 
-        return super().serialize()
+def _job_info_encode(job_info):
+    # job_info may be a json string already.
+    if isinstance(job_info, dict):
+        job_info = json.dumps(job_info)
 
-    def _serialize_body(self):
-        assert self.job_id is not None
-        assert self.job_info_bytes is not None
-        assert self.job_info_len is not None
+    return job_info.encode('utf-8')
 
-        msg_pack_into(mcproto.MCP_JOB_ID_WITH_INFO_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.job_id, self.job_info_len)
 
-        self.buf.extend(self.job_info_bytes)
-
-
-@_register_parser
-@_set_msg_type(mcproto.MCP_JOB_CREATE_REPLY)
-class MCPJobCreateReply(MCPJobIDWithInfo):
-    pass
+JOB_INFO = PayloadCodec('job_info', _job_info_encode, JSON.decode)
 
 
 @_set_msg_reply(MCPJobCreateReply)
@@ -126,80 +119,32 @@ class MCPJobCreateReply(MCPJobIDWithInfo):
 @_set_msg_type(mcproto.MCP_JOB_CREATE_REQUEST)
 class MCPJobCreateRequest(MCPMsgBase):
     _JOB_TYPES = {}
+    _FIELDS = (('timeout', 'I'), ('job_info_len', 'I'))
+    _PAYLOAD = ('job_info', JOB_INFO)
 
     def __init__(self, mcp_connection, timeout=0, job_info=None):
         super().__init__(mcp_connection)
         self.timeout = timeout
         self.job_info = job_info
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(MCPJobCreateRequest, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.timeout, msg.job_info_len) = struct.unpack_from(
-            mcproto.MCP_JOB_CREATE_REQUEST_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.MCP_JOB_CREATE_REQUEST_SIZE
-
-        msg.job_info_bytes = msg.buf[offset:]
-        if msg.job_info_len < len(msg.job_info_bytes):
-            msg.job_info_bytes = msg.job_info_bytes[:msg.job_info_len]
-
-        msg.job_info_str = msg.job_info_bytes.decode(encoding='utf-8')
-        msg.job_info = json.loads(msg.job_info_str)
-
-        return msg
-
-    def serialize(self):
-        if isinstance(self.job_info, dict):
-            self.job_info_str = json.dumps(self.job_info)
-        else:
-            self.job_info_str = self.job_info
-
-        self.job_info_bytes = self.job_info_str.encode('utf-8')
-        self.job_info_len = len(self.job_info_bytes)
-
-        return super().serialize()
-
-    def _serialize_body(self):
-        assert self.timeout is not None
-        assert self.job_info_len is not None
-        assert self.job_info_bytes is not None
-
-        msg_pack_into(mcproto.MCP_JOB_CREATE_REQUEST_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.timeout, self.job_info_len)
-
-        self.buf.extend(self.job_info_bytes)
-
 
 @_register_parser
 @_set_msg_type(mcproto.MCP_JOB_ACK)
 class MCPJobACK(MCPMsgBase):
+    _FIELDS = (('job_id', 'I'),)
+
     def __init__(self, mcp_connection, job_id=None):
         super().__init__(mcp_connection)
         self.job_id = job_id
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(MCPJobACK, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.job_id, ) = struct.unpack_from(
-            mcproto.MCP_JOB_ACK_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.job_id is not None
-
-        msg_pack_into(mcproto.MCP_JOB_ACK_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.job_id)
-
 
 @_register_parser
 @_set_msg_type(mcproto.MCP_JOB_STATE_CHANGE)
 class MCPJobStateChange(MCPMsgBase):
+    __slots__ = ('before', 'after')
+    _FIELDS = (('job_id', 'I'), ('state_change', 'B'), ('info_len', 'I'))
+    _PAYLOAD = ('info', JSON)
+
     def __init__(self, mcp_connection, job_id=None, before=None, after=None, info=None):
         super().__init__(mcp_connection)
         self.job_id = job_id
@@ -209,57 +154,24 @@ class MCPJobStateChange(MCPMsgBase):
         self.info = info
         self.info_len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(MCPJobStateChange, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.job_id, msg.state_change, msg.info_len) = struct.unpack_from(
-            mcproto.MCP_JOB_STATE_CHANGE_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        # decode state_chage
-        msg.before = msg.state_change >> 4
-        msg.after = msg.state_change & 0x0f
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.MCP_JOB_STATE_CHANGE_SIZE
-
-        # there is no info.
-        if msg.info_len == 0:
-            msg.info = None
-            msg.info_len = 0
-            return msg
-
-        # retrive job info
-        msg.info_bytes = msg.buf[offset:]
-
-        if msg.info_len < len(msg.info_bytes):
-            msg.info_bytes = msg.info_bytes[:msg.info_len]
-
-        # decode byte and load json.
-        msg.info = json.loads(msg.info_bytes.decode(encoding='utf-8'))
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.job_id is not None
-        assert self.before is not None
-        assert self.after is not None
+    def _serialize_pre(self):
         if self.info is None:
             self.info = ''
 
-        self.info_bytes = json.dumps(self.info).encode(encoding='utf-8')
-        self.info_len = len(self.info_bytes)
         self.state_change = (self.before << 4) | self.after
 
-        msg_pack_into(mcproto.MCP_JOB_STATE_CHANGE_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.job_id, self.state_change, self.info_len)
-
-        self.buf.extend(self.info_bytes)
+    def _post_parse(self):
+        # decode state_chage
+        self.before = self.state_change >> 4
+        self.after = self.state_change & 0x0f
 
 
 @_register_parser
 @_set_msg_type(mcproto.MCP_JOB_OUTPUT)
 class MCPJobOutput(MCPMsgBase):
+    _FIELDS = (('job_id', 'I'), ('state', 'B'), ('info_len', 'I'))
+    _PAYLOAD = ('info', JSON)
+
     def __init__(self, mcp_connection, job_id=None, state=None, info=None):
         super().__init__(mcp_connection)
         self.job_id = job_id
@@ -268,96 +180,31 @@ class MCPJobOutput(MCPMsgBase):
         self.info = info
         self.info_len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(MCPJobOutput, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.job_id, msg.state, msg.info_len) = struct.unpack_from(
-            mcproto.MCP_JOB_STATE_CHANGE_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.MCP_JOB_OUTPUT_SIZE
-
-        # there is no info.
-        if msg.info_len == 0:
-            msg.info = None
-            msg.info_len = 0
-            return msg
-
-        # retrive job info
-        msg.info_bytes = msg.buf[offset:]
-
-        if msg.info_len < len(msg.info_bytes):
-            msg.info_bytes = msg.info_bytes[:msg.info_len]
-
-        # decode byte and load json.
-        msg.info = json.loads(msg.info_bytes.decode(encoding='utf-8'))
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.job_id is not None
-        assert self.state is not None
+    def _serialize_pre(self):
         if self.info is None:
             self.info = ''
 
-        self.info_bytes = json.dumps(self.info).encode(encoding='utf-8')
-        self.info_len = len(self.info_bytes)
-
-        msg_pack_into(mcproto.MCP_JOB_OUTPUT_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.job_id, self.state, self.info_len)
-
-        self.buf.extend(self.info_bytes)
-
 
 @_register_parser
 @_set_msg_type(mcproto.MCP_JOB_DELETE_REPLY)
 class MCPJobDeleteReply(MCPMsgBase):
+    _FIELDS = (('job_id', 'I'),)
+
     def __init__(self, mcp_connection, job_id):
         super().__init__(mcp_connection)
         self.job_id = job_id
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(MCPJobDeleteReply, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.job_id) = struct.unpack_from(
-            mcproto.MCP_JOB_DELETE_REPLY_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.job_id is not None
-
-        msg_pack_into(mcproto.MCP_JOB_DELETE_REPLY_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.job_id)
-
 
 @_set_msg_reply(MCPJobDeleteReply)
 @_register_parser
 @_set_msg_type(mcproto.MCP_JOB_DELETE_REQUEST)
 class MCPJobDeleteRequest(MCPMsgBase):
+    _FIELDS = (('job_id', 'I'),)
+
     def __init__(self, mcp_connection, job_id):
         super().__init__(mcp_connection)
         self.job_id = job_id
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(MCPJobDeleteRequest, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.job_id) = struct.unpack_from(
-            mcproto.MCP_JOB_DELETE_REQUEST_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.job_id is not None
-
-        msg_pack_into(mcproto.MCP_JOB_DELETE_REQUEST_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.job_id)
-
 
 @_register_parser
 @_set_msg_type(mcproto.MCP_JOB_DELETE_ALL)
@@ -367,57 +214,14 @@ class MCPJobDeleteAll(MCPMsgBase):
 
 @_register_parser
 @_set_msg_type(mcproto.MCP_JOB_FEATURE_EXE)
-class MCPJobFeatureExe(MCPMsgBase):
-    def __init__(self, mcp_connection, job_id=None, state=None, info=None):
-        super().__init__(mcp_connection)
-        self.job_id = job_id
-        self.state = state
-        # maximum size of info: 1024 bytes
-        self.info = info
-        self.info_len = None
-
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(MCPJobFeatureExe, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.job_id, msg.state, msg.info_len) = struct.unpack_from(
-            mcproto.MCP_JOB_FEATURE_EXE_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.MCP_JOB_FEATURE_EXE_SIZE
-
-        # there is no info.
-        if msg.info_len == 0:
-            msg.info = None
-            msg.info_len = 0
-            return msg
-
-        # retrive job info
-        msg.info_bytes = msg.buf[offset:]
-
-        if msg.info_len < len(msg.info_bytes):
-            msg.info_bytes = msg.info_bytes[:msg.info_len]
-
-        # decode byte and load json.
-        msg.info = json.loads(msg.info_bytes.decode(encoding='utf-8'))
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.job_id is not None
-        assert self.state is not None
-        if self.info is None:
-            self.info = ''
-
-        self.info_bytes = json.dumps(self.info).encode(encoding='utf-8')
-        self.info_len = len(self.info_bytes)
-
-        msg_pack_into(mcproto.MCP_JOB_FEATURE_EXE_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.job_id, self.state, self.info_len)
+class MCPJobFeatureExe(MCPJobOutput):
+    pass
 
-        self.buf.extend(self.info_bytes)
 
 class APIActionException(MCPMsgBase):
+    _FIELDS = (('info_len', 'I'),)
+    _PAYLOAD = ('exception', PICKLE)
+
     def __init__(self, mcp_connection, exception=None):
         super().__init__(mcp_connection)
         if not isinstance(exception, Exception):
@@ -425,44 +229,14 @@ class APIActionException(MCPMsgBase):
 
         self.info_len = None
         self.exception = exception
-        self.exception_bytes = None
-        # maximum size of info: 1024 bytes
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(MCPJobStateChange, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.info_len, ) = struct.unpack_from(
-            mcproto.API_ACTION_EXCEPTION_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.API_ACTION_EXCEPTION_SIZE
-
-        # retrive exception byte data
-        msg.exception_bytes = msg.buf[offset:]
-
-        if msg.info_len < len(msg.exception_bytes):
-            msg.exception_bytes = msg.exception_bytes[:msg.info_len]
-
-        # decode pickle byte
-        msg.exception = pickle.loads(msg.exception_bytes)
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.exception is not None
-
-        self.excpetion_bytes = pickle.dumps(self.exception)
-        self.info_len = len(self.exception_bytes)
-
-        msg_pack_into(mcproto.API_ACTION_EXCEPTION_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.info_len)
-
-        self.buf.extend(self.exception_bytes)
 
 @_register_parser
 @_set_msg_type(mcproto.API_ACTION_LOGIN)
 class APILogin(MCPMsgBase):
+    _FIELDS = (('api_action_id', 'H'), ('len', 'I'))
+    _PAYLOAD = (('session_info', 'args', 'kwargs'), JSON)
+
     def __init__(self, mcp_connection, api_action_id=None, session_info=None, args=None, kwargs=None):
         super().__init__(mcp_connection)
         self.api_action_id = api_action_id
@@ -472,51 +246,18 @@ class APILogin(MCPMsgBase):
         self.len = None
         # maximum size of info: 1024 bytes
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(APILogin, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.api_action_id, msg.len, ) = struct.unpack_from(
-            mcproto.API_ACTION_LOGIN_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.API_ACTION_LOGIN_SIZE
-
-        # retrive byte data
-        json_bytes = msg.buf[offset:]
-
-        if msg.len < len(json_bytes):
-            json_bytes = json_bytes[:msg.len]
-
-        # decode json
-        data = json.loads(json_bytes.decode('utf-8'))
-
-        msg.session_info = data['session_info']
-        msg.args = data['args']
-        msg.kwargs = data['kwargs']
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.api_action_id is not None
-
-        data_bytes = json.dumps({
-            'session_info': dataclasses.asdict(self.session_info),
-            'args': self.args,
-            'kwargs': self.kwargs
-        }).encode('utf-8')
-
-        self.len = len(data_bytes)
-
-        msg_pack_into(mcproto.API_ACTION_LOGIN_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.api_action_id, self.len)
-
-        self.buf.extend(data_bytes)
+    def _get_payload(self):
+        payload = super()._get_payload()
+        payload['session_info'] = dataclasses.asdict(self.session_info)
+        return payload
 
 
 @_register_parser
 @_set_msg_type(mcproto.API_ACTION_LOGIN_FAILED)
 class APILoginFailed(MCPMsgBase):
+    _FIELDS = (('data_len', 'H'),)
+    _PAYLOAD = ('exception', PICKLE)
+
     def __init__(self, mcp_connection, exception=None):
         super().__init__(mcp_connection)
 
@@ -526,38 +267,13 @@ class APILoginFailed(MCPMsgBase):
         self.exception = exception
         self.data_len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(APIActionException, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-        
-        (msg.data_len, ) = struct.unpack_from(mcproto.API_ACTION_LOGIN_FAILED_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.API_ACTION_LOGIN_FAILED_SIZE
-
-        data_bytes = msg.buf[offset:]
-
-        if msg.data_len < len(data_bytes):
-            data_bytes = data_bytes[:msg.data_len]
-
-        msg.exception = pickle.loads(data_bytes)
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.exception is not None
-
-        data_bytes = pickle.dumps(self.exception)
-        self.data_len = len(data_bytes)
-
-        msg_pack_into(mcproto.API_ACTION_LOGIN_FAILED_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.data_len)
-
-        self.buf.extend(data_bytes)
 
 @_register_parser
 @_set_msg_type(mcproto.API_ACTION_LOGIN_RESPONSE)
 class APILoginResponse(MCPMsgBase):
+    _FIELDS = (('api_action_id', 'H'), ('data_len', 'I'))
+    _PAYLOAD = ('auth', UTF8)
+
     def __init__(self, mcp_connection, api_action_id=None, auth=None):
         super().__init__(mcp_connection)
         self.api_action_id = api_action_id
@@ -565,39 +281,6 @@ class APILoginResponse(MCPMsgBase):
         self.data_len = None
         # maximum size of info: 1024 bytes
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(APILoginResponse, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.api_action_id, msg.data_len, ) = struct.unpack_from(
-            mcproto.API_ACTION_LOGIN_RESPONSE_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.API_ACTION_LOGIN_RESPONSE_SIZE
-
-        auth_bytes = msg.buf[offset:]
-
-        if msg.data_len < len(auth_bytes):
-            auth_bytes = auth_bytes[:msg.data_len]
-
-        # decode json
-        msg.auth = auth_bytes.decode('utf-8')
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.api_action_id is not None
-        assert isinstance(self.auth, str)
-
-        auth_bytes = self.auth.encode('utf-8')
-
-        self.data_len = len(auth_bytes)
-
-        msg_pack_into(mcproto.API_ACTION_LOGIN_RESPONSE_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.api_action_id, self.data_len)
-
-        self.buf.extend(auth_bytes)
-
 
 @_register_parser
 @_set_msg_type(mcproto.API_ACTION_REQUEST)
@@ -613,6 +296,10 @@ class APIActionRequest(MCPMsgBase):
     # reverse
     int_to_method = {key:method for method, key in method_to_int.items()} 
 
+    __slots__ = ('method',)
+    _FIELDS = (('method_id', 'B'), ('api_action_id', 'H'), ('len', 'I'))
+    _PAYLOAD = (('auth', 'base_url', 'args', 'kwargs'), JSON)
+
     def __init__(self, mcp_connection, api_action_id=None, method=None, auth=None, base_url=None, args=None, kwargs=None):
         super().__init__(mcp_connection)
         self.api_action_id = api_action_id
@@ -624,94 +311,32 @@ class APIActionRequest(MCPMsgBase):
         self.len = None
         # maximum size of info: 1024 bytes
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(APIActionRequest, cls).parser(
-            mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (method, msg.api_action_id, msg.len, ) = struct.unpack_from(
-            mcproto.API_ACTION_REQUEST_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
+    def _serialize_pre(self):
+        self.method_id = self.method_to_int[self.method]
 
+    def _post_parse(self):
         # decode method
-        msg.method = cls.int_to_method[method]
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.API_ACTION_REQUEST_SIZE
-
-        # retrive exception byte data
-        json_bytes = msg.buf[offset:]
+        self.method = self.int_to_method[self.method_id]
 
-        if msg.len < len(json_bytes):
-            json_bytes = json_bytes[:msg.len]
-
-        # decode json
-        data = json.loads(json_bytes.decode('utf-8'))
-
-        msg.base_url = data['base_url']
-        msg.auth = data['auth']
-        msg.args = data['args']
-        msg.kwargs = data['kwargs']
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.method is not None
-
-        data_bytes = json.dumps({
-            'auth': self.auth,
-            'base_url': self.base_url,
-            'args': self.args,
-            'kwargs': self.kwargs
-        }).encode('utf-8')
-
-        self.len = len(data_bytes)
-
-        method = self.method_to_int[self.method]
-        msg_pack_into(mcproto.API_ACTION_REQUEST_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, method, self.api_action_id, self.len)
-
-        self.buf.extend(data_bytes)
 
 @_register_parser
 @_set_msg_type(mcproto.API_ACTION_RESPONSE)
 class APIActionResponse(MCPMsgBase):
+    _FIELDS = (('len', 'I'),)
+    _PAYLOAD = ('response', PICKLE)
+
     def __init__(self, mcp_connection, response: aiohttp.ClientResponse = None):
         super().__init__(mcp_connection)
         self.response = response
         self.len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(APIActionResponse, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.len, ) = struct.unpack_from(
-            mcproto.API_ACTION_RESPONSE_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.API_ACTION_RESPONSE_SIZE
-
-        resp_bytes = msg.buf[offset:]
-
-        if msg.len < len(resp_bytes):
-            resp_bytes = resp_bytes[:msg.len]
-
-        # decode json
-        msg.response = pickle.loads(resp_bytes)
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.response is not None
-
-        resp_bytes = pickle.dumps(self.response)
-        self.len = len(resp_bytes)
-
-        msg_pack_into(mcproto.API_ACTION_RESPONSE_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.len)
-
-        self.buf.extend(resp_bytes)
 
 @_register_parser
 @_set_msg_type(mcproto.CAPTURE_SERVICE_EXE)
 class CaptureServiceExe(MCPMsgBase):
+    _FIELDS = (('capture_id', 'H'), ('capture_service_cls_id', 'B'), ('len', 'I'))
+    _PAYLOAD = ('input_vars', JSON)
+
     def __init__(self, mcp_connection, capture_id=None, capture_service_cls_id=None, input_vars=None):
         super().__init__(mcp_connection)
         self.capture_id = capture_id
@@ -719,234 +344,107 @@ class CaptureServiceExe(MCPMsgBase):
         self.input_vars = input_vars
         self.len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CaptureServiceExe, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.capture_id, msg.capture_service_cls_id, msg.len, ) = struct.unpack_from(
-            mcproto.CAPTURE_SERVICE_EXE_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.CAPTURE_SERVICE_EXE_SIZE
-
-        input_vars_bytes = msg.buf[offset:]
-
-        if msg.len < len(input_vars_bytes):
-            input_vars_bytes = input_vars_bytes[:msg.len]
-
-        # decode json
-        msg.input_vars = json.loads(input_vars_bytes.decode('utf-8'))
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.capture_id is not None
-        assert self.capture_service_cls_id is not None
-        assert self.input_vars is not None
-
-        input_vars_bytes = json.dumps(self.input_vars).encode('utf-8')
-        self.len = len(input_vars_bytes)
-
-        msg_pack_into(mcproto.CAPTURE_SERVICE_EXE_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.capture_id, self.capture_service_cls_id, self.len)
-
-        self.buf.extend(input_vars_bytes)
 
 @_register_parser
 @_set_msg_type(mcproto.CAPTURE_SERVICE_SEND_PKT)
 class CaptureServiceSendPKT(MCPMsgBase):
+    _FIELDS = (('capture_id', 'H'), ('len', 'I'))
+    _PAYLOAD = ('pkt', PICKLE)
+
     def __init__(self, mcp_connection, capture_id=None, pkt=None):
         super().__init__(mcp_connection)
         self.capture_id = capture_id
         self.pkt = pkt
         self.len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CaptureServiceSendPKT, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.capture_id, msg.len, ) = struct.unpack_from(
-            mcproto.CAPTURE_SERVICE_SEND_PKT_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.CAPTURE_SERVICE_SEND_PKT_SIZE
-
-        pkt_bytes = msg.buf[offset:]
-
-        if msg.len < len(pkt_bytes):
-            pkt_bytes = pkt_bytes[:msg.len]
-
-        msg.pkt = pickle.loads(pkt_bytes)
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.capture_id is not None
-        assert self.pkt is not None
-
-        pkt_bytes = pickle.dumps(self.pkt)
-        self.len = len(pkt_bytes)
-
-        msg_pack_into(mcproto.CAPTURE_SERVICE_SEND_PKT_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.capture_id, self.len)
-
-        self.buf.extend(pkt_bytes)
 
 @_register_parser
 @_set_msg_type(mcproto.CAPTURE_SERVICE_CANCEL_EXECUTE)
 class CaptureServiceCancelExecute(MCPMsgBase):
+    _FIELDS = (('capture_id', 'H'),)
+
     def __init__(self, connection, capture_id=None):
         super().__init__(connection)
         self.capture_id = capture_id
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CaptureServiceCancelExecute, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.capture_id, ) = struct.unpack_from(
-            mcproto.CAPTURE_SERVICE_CANCEL_EXECUTE_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-        
-        return msg
-
-    def _serialize_body(self):
-        assert self.capture_id is not None
-
-        msg_pack_into(mcproto.CAPTURE_SERVICE_CANCEL_EXECUTE_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.capture_id)
 
 @_register_parser
 @_set_msg_type(mcproto.CAPTURE_SERVICE_SET_EVENT)
 class CaptureServiceSetEvent(MCPMsgBase):
+    _FIELDS = (('capture_id', 'H'), ('event_id', 'B'))
+
     def __init__(self, connection, capture_id=None, event_id=None):
         super().__init__(connection)
         self.capture_id = capture_id
         self.event_id = event_id
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CaptureServiceSetEvent, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.capture_id, msg.event_id) = struct.unpack_from(
-            mcproto.CAPTURE_SERVICE_SET_EVENT_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
- 
-        return msg
-
-    def _serialize_body(self):
-        assert self.capture_id is not None
-        assert self.event_id is not None
-
-        msg_pack_into(mcproto.CAPTURE_SERVICE_SET_EVENT_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.capture_id, self.event_id)
 
 @_register_parser
 @_set_msg_type(mcproto.CAPTURE_SERVICE_SET_EXCEPTION)
 class CaptureServiceSetException(MCPMsgBase):
+    _FIELDS = (('capture_id', 'H'), ('len', 'I'))
+    _PAYLOAD = ('exception', PICKLE)
+
     def __init__(self, connection, capture_id=None, exception=None):
         super().__init__(connection)
         self.capture_id = capture_id
         self.exception = exception
         self.len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CaptureServiceSetException, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.capture_id, msg.len) = struct.unpack_from(
-            mcproto.CAPTURE_SERVICE_SET_EXCEPTION_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-        
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.CAPTURE_SERVICE_SET_EXCEPTION_SIZE
-
-        exception_bytes = msg.buf[offset:]
-
-        if msg.len < len(exception_bytes):
-            exception_bytes = exception_bytes[:msg.len]
 
-        msg.exception = pickle.loads(exception_bytes)
+@_register_parser
+@_set_msg_type(mcproto.CAPTURE_SERVICE_GRANT_CREDIT)
+class CaptureServiceGrantCredit(MCPMsgBase):
+    """Master consumed packets, agent may send credits more of them."""
+    _FIELDS = (('capture_id', 'H'), ('credits', 'I'))
 
-        return msg
+    def __init__(self, connection, capture_id=None, credits=None):
+        super().__init__(connection)
+        self.capture_id = capture_id
+        self.credits = credits
 
-    def _serialize_body(self):
-        assert self.capture_id is not None
-        assert isinstance(self.exception, Exception)
 
-        exception_bytes = pickle.dumps(self.exception)
-        self.len = len(exception_bytes)
+@_register_parser
+@_set_msg_type(mcproto.CAPTURE_SERVICE_DROP_REPORT)
+class CaptureServiceDropReport(MCPMsgBase):
+    """Packets dropped by agent for lack of credit, counted from capture start."""
+    _FIELDS = (('capture_id', 'H'), ('dropped', 'I'))
 
-        msg_pack_into(mcproto.CAPTURE_SERVICE_SET_EXCEPTION_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.capture_id, self.len)
+    def __init__(self, connection, capture_id=None, dropped=None):
+        super().__init__(connection)
+        self.capture_id = capture_id
+        self.dropped = dropped
 
-        self.buf.extend(exception_bytes)
 
 @_register_parser
 @_set_msg_type(mcproto.CMD_SERVICE_EXE)
 class CmdServiceExecute(MCPMsgBase):
+    _FIELDS = (('cmd_id', 'H'), ('len', 'I'))
+    _PAYLOAD = ('input_vars', JSON)
+
     def __init__(self, mcp_connection, cmd_id=None, input_vars=None):
         super().__init__(mcp_connection)
         self.cmd_id = cmd_id
         self.input_vars = input_vars
         self.len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CmdServiceExecute, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.cmd_id, msg.len, ) = struct.unpack_from(
-            mcproto.CMD_SERVICE_EXE_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.CMD_SERVICE_EXE_SIZE
-
-        input_vars_bytes = msg.buf[offset:]
-
-        if msg.len < len(input_vars_bytes):
-            input_vars_bytes = input_vars_bytes[:msg.len]
-
-        # decode json
-        msg.input_vars = json.loads(input_vars_bytes.decode('utf-8'))
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.cmd_id is not None
-        assert self.input_vars is not None
-
-        input_vars_bytes = json.dumps(self.input_vars).encode('utf-8')
-        self.len = len(input_vars_bytes)
-
-        msg_pack_into(mcproto.CMD_SERVICE_EXE_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.cmd_id, self.len)
-
-        self.buf.extend(input_vars_bytes)
 
 @_register_parser
 @_set_msg_type(mcproto.CMD_SERVICE_CANCEL_EXE)
 class CmdServiceCancelExecute(MCPMsgBase):
+    _FIELDS = (('cmd_id', 'H'),)
+
     def __init__(self, connection, cmd_id=None):
         super().__init__(connection)
         self.cmd_id = cmd_id
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CmdServiceCancelExecute, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.cmd_id, ) = struct.unpack_from(
-            mcproto.CMD_SERVICE_CANCEL_EXECUTE_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-        
-        return msg
-
-    def _serialize_body(self):
-        assert self.cmd_id is not None
-
-        msg_pack_into(mcproto.CMD_SERVICE_CANCEL_EXECUTE_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.cmd_id)
 
 @_register_parser
 @_set_msg_type(mcproto.CMD_SERVICE_READ_STD)
 class CmdServiceReadStd(MCPMsgBase):
+    _FIELDS = (('cmd_id', 'H'), ('std_type', 'B'), ('len', 'I'))
+    _PAYLOAD = ('input_vars', JSON)
+
     def __init__(self, mcp_connection, cmd_id=None, std_type=None, input_vars=None):
         super().__init__(mcp_connection)
         self.cmd_id = cmd_id
@@ -954,265 +452,284 @@ class CmdServiceReadStd(MCPMsgBase):
         self.input_vars = input_vars
         self.len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CmdServiceReadStd, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.cmd_id, msg.std_type, msg.len, ) = struct.unpack_from(
-            mcproto.CMD_SERVICE_READ_STD_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.CMD_SERVICE_READ_STD_SIZE
-
-        input_vars_bytes = msg.buf[offset:]
-
-        if msg.len < len(input_vars_bytes):
-            input_vars_bytes = input_vars_bytes[:msg.len]
-
-        # decode json
-        msg.input_vars = json.loads(input_vars_bytes.decode('utf-8'))
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.cmd_id is not None
-        assert self.input_vars is not None
-
-        input_vars_bytes = json.dumps(self.input_vars).encode('utf-8')
-        self.len = len(input_vars_bytes)
-
-        msg_pack_into(mcproto.CMD_SERVICE_READ_STD_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.cmd_id, self.std_type, self.len)
-
-        self.buf.extend(input_vars_bytes)
 
 @_register_parser
 @_set_msg_type(mcproto.CMD_SERVICE_WRITE_STD)
 class CmdServiceWriteStd(MCPMsgBase):
+    _FIELDS = (('cmd_id', 'H'), ('len', 'I'))
+    _PAYLOAD = ('input_vars', JSON)
+
     def __init__(self, mcp_connection, cmd_id=None, input_vars=None):
         super().__init__(mcp_connection)
         self.cmd_id = cmd_id
         self.input_vars = input_vars
         self.len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CmdServiceWriteStd, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.cmd_id, msg.len, ) = struct.unpack_from(
-            mcproto.CMD_SERVICE_WRITE_STD_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.CMD_SERVICE_WRITE_STD_SIZE
-
-        input_vars_bytes = msg.buf[offset:]
-
-        if msg.len < len(input_vars_bytes):
-            input_vars_bytes = input_vars_bytes[:msg.len]
-
-        # decode json
-        msg.input_vars = json.loads(input_vars_bytes.decode('utf-8'))
-
-        return msg
-
-    def _serialize_body(self):
-        assert self.cmd_id is not None
-        assert self.input_vars is not None
-
-        input_vars_bytes = json.dumps(self.input_vars).encode('utf-8')
-        self.len = len(input_vars_bytes)
-
-        msg_pack_into(mcproto.CMD_SERVICE_WRITE_STD_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.cmd_id, self.len)
-
-        self.buf.extend(input_vars_bytes)
 
 @_register_parser
 @_set_msg_type(mcproto.CMD_SERVICE_READ_STD_RES)
 class CmdServiceReadStdRes(MCPMsgBase):
+    _FIELDS = (('cmd_id', 'H'), ('len', 'I'))
+    _PAYLOAD = ('output', UTF8)
+
     def __init__(self, mcp_connection, cmd_id=None, output=None):
         super().__init__(mcp_connection)
         self.cmd_id = cmd_id
         self.output= output
         self.len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CmdServiceReadStdRes, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
 
-        (msg.cmd_id, msg.len, ) = struct.unpack_from(
-            mcproto.CMD_SERVICE_READ_STD_RES_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
+@_register_parser
+@_set_msg_type(mcproto.CMD_SERVICE_WRITE_STD_RES)
+class CmdServiceWriteStdRes(MCPMsgBase):
+    pass
+
+
+class CmdServiceExceptionBase(MCPMsgBase):
+    _FIELDS = (('cmd_id', 'H'), ('len', 'I'))
+    _PAYLOAD = ('exception', PICKLE)
 
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.CMD_SERVICE_READ_STD_RES_SIZE
+    def __init__(self, connection, cmd_id=None, exception=None):
+        super().__init__(connection)
+        self.cmd_id = cmd_id
+        self.exception = exception
+        self.len = None
 
-        output_bytes = msg.buf[offset:]
 
-        if msg.len < len(output_bytes):
-            output_bytes = output_bytes[:msg.len]
+@_register_parser
+@_set_msg_type(mcproto.CMD_SERVICE_READ_STD_EXCPTION)
+class CmdServiceReadStdException(CmdServiceExceptionBase):
+    pass
 
-        msg.output = output_bytes.decode('utf-8')
 
-        return msg
+@_register_parser
+@_set_msg_type(mcproto.CMD_SERVICE_WRITE_STD_EXCPTION)
+class CmdServiceWriteStdException(CmdServiceExceptionBase):
+    pass
 
-    def _serialize_body(self):
-        assert self.cmd_id is not None
-        assert self.output is not None
 
-        output_bytes = self.output.encode('utf-8')
-        self.len = len(output_bytes)
+@_register_parser
+@_set_msg_type(mcproto.CMD_SERVICE_SET_EVENT)
+class CmdServiceSetEvent(MCPMsgBase):
+    _FIELDS = (('cmd_id', 'H'), ('event_id', 'B'))
 
-        msg_pack_into(mcproto.CMD_SERVICE_READ_STD_RES_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.cmd_id, self.len)
+    def __init__(self, connection, cmd_id=None, event_id=None):
+        super().__init__(connection)
+        self.cmd_id = cmd_id
+        self.event_id = event_id
 
-        self.buf.extend(output_bytes)
 
 @_register_parser
-@_set_msg_type(mcproto.CMD_SERVICE_WRITE_STD_RES)
-class CmdServiceWriteStdRes(MCPMsgBase):
+@_set_msg_type(mcproto.CMD_SERVICE_SET_EXCEPTION)
+class CmdServiceSetException(CmdServiceExceptionBase):
     pass
 
+
 @_register_parser
-@_set_msg_type(mcproto.CMD_SERVICE_READ_STD_EXCPTION)
-class CmdServiceReadStdException(MCPMsgBase):
-    def __init__(self, connection, cmd_id=None, exception=None):
+@_set_msg_type(mcproto.MCP_BATCH)
+class MCPBatch(MCPMsgBase):
+    """
+    Complete frames sent as one message, the receiving connection
+    handles every frame as if it was received alone.
+    """
+    _FIELDS = (('count', 'H'), ('len', 'I'))
+    _PAYLOAD = ('frames', RAW)
+
+    def __init__(self, connection, frames=None):
         super().__init__(connection)
-        self.cmd_id = cmd_id
-        self.exception = exception
+        self.count = None if frames is None else len(frames)
+        self.frames = None if frames is None else b''.join(frames)
         self.len = None
 
     @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CmdServiceReadStdException, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
-
-        (msg.cmd_id, msg.len) = struct.unpack_from(
-            mcproto.CMD_SERVICE_READ_STD_EXCEPTION_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-        
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.CMD_SERVICE_READ_STD_EXCEPTION_SIZE
-
-        exception_bytes = msg.buf[offset:]
-
-        if msg.len < len(exception_bytes):
-            exception_bytes = exception_bytes[:msg.len]
+    def pack_header_into(cls, buf, offset, count, frames_len):
+        """
+        Pack header of a batch whose frames are already in buf after
+        offset + MCP_HEADER_SIZE + MCP_BATCH_SIZE.
+        """
+        msg_struct = cls._msg_struct
+        msg_struct.pack_into(buf, offset, cls.cls_msg_type, msg_struct.size + frames_len, VERSION_ID, 0,
+                             count, frames_len)
 
-        msg.exception = pickle.loads(exception_bytes)
 
-        return msg
+def iter_batch_frames(buf):
+    """Yield frames in the MCPBatch message of buf as memoryview."""
+    view = memoryview(buf)
+    (count, frames_len) = struct.unpack_from(mcproto.MCP_BATCH_STR, view, mcproto.MCP_HEADER_SIZE)
+    offset = mcproto.MCP_HEADER_SIZE + mcproto.MCP_BATCH_SIZE
+    end = offset + frames_len
+    if end > len(view):
+        raise mcp_parser.WrongMcpMsgHeader(f'Batch frames length {frames_len} exceeds message.')
 
-    def _serialize_body(self):
-        assert self.cmd_id is not None
-        assert isinstance(self.exception, Exception)
+    for _ in range(count):
+        if end - offset < mcproto.MCP_HEADER_SIZE:
+            raise mcp_parser.WrongMcpMsgHeader('Batch ends in the middle of a frame.')
 
-        exception_bytes = pickle.dumps(self.exception)
-        self.len = len(exception_bytes)
+        (_, msg_len, _, _) = mcp_parser.header(view[offset:end])
+        if msg_len < mcproto.MCP_HEADER_SIZE or offset + msg_len > end:
+            raise mcp_parser.WrongMcpMsgHeader(f'Invalid length {msg_len} of frame in batch.')
 
-        msg_pack_into(mcproto.CMD_SERVICE_READ_STD_EXCEPTION_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.cmd_id, self.len)
+        yield view[offset:offset + msg_len]
+        offset += msg_len
 
-        self.buf.extend(exception_bytes)
 
 @_register_parser
-@_set_msg_type(mcproto.CMD_SERVICE_WRITE_STD_EXCPTION)
-class CmdServiceWriteStdException(MCPMsgBase):
-    def __init__(self, connection, cmd_id=None, exception=None):
+@_set_msg_type(mcproto.MCP_FRAGMENT)
+class MCPFragment(MCPMsgBase):
+    """
+    Part of a frame which is too large to be sent in one piece. Fragments
+    of a stream are sent in order, see mcp_fragment.
+    """
+    _FIELDS = (('stream_id', 'I'), ('total_len', 'I'), ('offset', 'I'), ('len', 'I'))
+    _PAYLOAD = ('data', RAW)
+
+    def __init__(self, connection, stream_id=None, total_len=None, offset=None, data=None):
         super().__init__(connection)
-        self.cmd_id = cmd_id
-        self.exception = exception
+        self.stream_id = stream_id
+        self.total_len = total_len
+        self.offset = offset
+        self.data = data
         self.len = None
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CmdServiceWriteStdException, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
 
-        (msg.cmd_id, msg.len) = struct.unpack_from(
-            mcproto.CMD_SERVICE_WRITE_STD_EXCEPTION_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-        
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.CMD_SERVICE_WRITE_STD_EXCEPTION_SIZE
-
-        exception_bytes = msg.buf[offset:]
+@_register_parser
+@_set_msg_type(mcproto.MCP_STRIPE_JOIN)
+class MCPStripeJoin(MCPMsgBase):
+    """
+    Sent by agent before its hello reply, the connection is stripe
+    stripe_index of the agent whose primary connection has agent_id.
+    stripe_count is the number of connections the agent opens, the
+    primary one included.
+    """
+    _FIELDS = (('agent_id', 'H'), ('stripe_index', 'B'), ('stripe_count', 'B'))
+
+    def __init__(self, connection, agent_id=None, stripe_index=None, stripe_count=None):
+        super().__init__(connection)
+        self.agent_id = agent_id
+        self.stripe_index = stripe_index
+        self.stripe_count = stripe_count
 
-        if msg.len < len(exception_bytes):
-            exception_bytes = exception_bytes[:msg.len]
 
-        msg.exception = pickle.loads(exception_bytes)
+@_register_parser
+@_set_msg_type(mcproto.MCP_SHM_ATTACH)
+class MCPShmAttach(MCPMsgBase):
+    """Sender of bulk frames announces its shared memory ring, see mcp_shm."""
+    _FIELDS = (('size', 'I'), ('len', 'I'))
+    _PAYLOAD = ('name', UTF8)
 
-        return msg
+    def __init__(self, connection, name=None, size=None):
+        super().__init__(connection)
+        self.name = name
+        self.size = size
+        self.len = None
 
-    def _serialize_body(self):
-        assert self.cmd_id is not None
-        assert isinstance(self.exception, Exception)
 
-        exception_bytes = pickle.dumps(self.exception)
-        self.len = len(exception_bytes)
+@_register_parser
+@_set_msg_type(mcproto.MCP_SHM_ATTACHED)
+class MCPShmAttached(MCPMsgBase):
+    """Reply of MCPShmAttach, attached is 0 if the ring can't be used."""
+    _FIELDS = (('attached', 'B'),)
 
-        msg_pack_into(mcproto.CMD_SERVICE_WRITE_STD_EXCEPTION_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.cmd_id, self.len)
+    def __init__(self, connection, attached=None):
+        super().__init__(connection)
+        self.attached = attached
 
-        self.buf.extend(exception_bytes)
 
 @_register_parser
-@_set_msg_type(mcproto.CMD_SERVICE_SET_EVENT)
-class CmdServiceSetEvent(MCPMsgBase):
-    def __init__(self, connection, cmd_id=None, event_id=None):
+@_set_msg_type(mcproto.MCP_SHM_FRAME)
+class MCPShmFrame(MCPMsgBase):
+    """Reference of a frame in the shared memory ring of the sender."""
+    _FIELDS = (('frame_offset', 'I'), ('frame_len', 'I'), ('end', 'Q'))
+
+    def __init__(self, connection, frame_offset=None, frame_len=None, end=None):
         super().__init__(connection)
-        self.cmd_id = cmd_id
-        self.event_id = event_id
+        self.frame_offset = frame_offset
+        self.frame_len = frame_len
+        self.end = end
 
     @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CmdServiceSetEvent, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
+    def pack_into(cls, buf, offset, frame_offset, frame_len, end):
+        """Pack a reference at offset of buf, return its length."""
+        msg_struct = cls._msg_struct
+        msg_struct.pack_into(buf, offset, cls.cls_msg_type, msg_struct.size, VERSION_ID, 0,
+                             frame_offset, frame_len, end)
+        return msg_struct.size
 
-        (msg.cmd_id, msg.event_id) = struct.unpack_from(
-            mcproto.CMD_SERVICE_SET_EVENT_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
- 
-        return msg
 
-    def _serialize_body(self):
-        assert self.cmd_id is not None
-        assert self.event_id is not None
+@_register_parser
+@_set_msg_type(mcproto.MCP_SESSION_OPEN)
+class MCPSessionOpen(MCPMsgBase):
+    """
+    Master opens a session after hello, agent echoes it. Each end counts
+    its messages from its own MCPSessionOpen on, see mcp_session.
+    """
+    _FIELDS = (('session_id', 'Q'),)
+
+    def __init__(self, connection, session_id=None):
+        super().__init__(connection)
+        self.session_id = session_id
 
-        msg_pack_into(mcproto.CMD_SERVICE_SET_EVENT_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.cmd_id, self.event_id)
 
 @_register_parser
-@_set_msg_type(mcproto.CMD_SERVICE_SET_EXCEPTION)
-class CmdServiceSetException(MCPMsgBase):
-    def __init__(self, connection, cmd_id=None, exception=None):
+@_set_msg_type(mcproto.MCP_SESSION_RESUME)
+class MCPSessionResume(MCPMsgBase):
+    """
+    Sent by agent before its hello reply, the connection resumes session
+    session_id, of which the agent has received received messages.
+    """
+    _FIELDS = (('session_id', 'Q'), ('received', 'Q'))
+
+    def __init__(self, connection, session_id=None, received=None):
         super().__init__(connection)
-        self.cmd_id = cmd_id
-        self.exception = exception
-        self.len = None
+        self.session_id = session_id
+        self.received = received
 
-    @classmethod
-    def parser(cls, mcp_connection, msg_type, msg_len, version, xid, buf):
-        msg = super(CmdServiceSetException, cls).parser(
-        mcp_connection, msg_type, msg_len, version, xid, buf)
 
-        (msg.cmd_id, msg.len) = struct.unpack_from(
-            mcproto.CMD_SERVICE_SET_EXCEPTION_STR, msg.buf, mcproto.MCP_HEADER_SIZE)
-        
-        offset = mcproto.MCP_HEADER_SIZE + mcproto.CMD_SERVICE_SET_EXCEPTION_SIZE
+@_register_parser
+@_set_msg_type(mcproto.MCP_SESSION_RESUMED)
+class MCPSessionResumed(MCPMsgBase):
+    """
+    Reply of MCPSessionResume, resumed is 0 if the session is gone, else
+    master has received received messages of it.
+    """
+    _FIELDS = (('resumed', 'B'), ('received', 'Q'))
+
+    def __init__(self, connection, resumed=None, received=None):
+        super().__init__(connection)
+        self.resumed = resumed
+        self.received = received
 
-        exception_bytes = msg.buf[offset:]
 
-        if msg.len < len(exception_bytes):
-            exception_bytes = exception_bytes[:msg.len]
+@_register_parser
+@_set_msg_type(mcproto.MCP_SESSION_ACK)
+class MCPSessionAck(MCPMsgBase):
+    """Receiver of a session has received received messages of it."""
+    _FIELDS = (('received', 'Q'),)
+
+    def __init__(self, connection, received=None):
+        super().__init__(connection)
+        self.received = received
 
-        msg.exception = pickle.loads(exception_bytes)
 
-        return msg
+@_register_parser
+@_set_msg_type(mcproto.MCP_HEARTBEAT)
+class MCPHeartbeat(MCPMsgBase):
+    """Sent periodically by both ends, timestamp is echoed by MCPHeartbeatReply."""
+    _FIELDS = (('seq', 'I'), ('timestamp', 'Q'))
 
-    def _serialize_body(self):
-        assert self.cmd_id is not None
-        assert isinstance(self.exception, Exception)
+    def __init__(self, connection, seq=None, timestamp=None):
+        super().__init__(connection)
+        self.seq = seq
+        self.timestamp = timestamp
 
-        exception_bytes = pickle.dumps(self.exception)
-        self.len = len(exception_bytes)
 
-        msg_pack_into(mcproto.CMD_SERVICE_SET_EXCEPTION_STR,
-                      self.buf, mcproto.MCP_HEADER_SIZE, self.cmd_id, self.len)
+@_register_parser
+@_set_msg_type(mcproto.MCP_HEARTBEAT_REPLY)
+class MCPHeartbeatReply(MCPMsgBase):
+    """Reply of MCPHeartbeat with its seq and timestamp."""
+    _FIELDS = (('seq', 'I'), ('timestamp', 'Q'))
 
-        self.buf.extend(exception_bytes)
\ No newline at end of file
+    def __init__(self, connection, seq=None, timestamp=None):
+        super().__init__(connection)
+        self.seq = seq
+        self.timestamp = timestamp
@@ -0,0 +1,77 @@
+"""
+Payload codecs of MCP messages.
+
+A codec turns the payload value of a message into bytes and back.
+decode always gets a bytes-like object (usually a memoryview of the
+received frame) and must not keep a reference to it.
+
+Codecs are registered by name and by a numeric id, every message class
+chooses its codec in _PAYLOAD. Registered codecs are announced in
+MCPHello, a message class may prefer some of them in _PAYLOAD_CODECS,
+used only on connections whose ends both have them.
+
+- json: plain JSON text.
+- pickle: python pickle, any picklable object.
+- utf8: a single str.
+- raw: bytes as is.
+"""
+import json
+import pickle
+
+
+class PayloadCodec(object):
+    def __init__(self, name, encode, decode, codec_id=None):
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+        self.codec_id = codec_id
+
+    def __repr__(self):
+        return f'<PayloadCodec {self.name}>'
+
+
+_CODECS = {}
+
+
+def register_codec(codec):
+    assert codec.codec_id is not None, 'Registered codec needs a codec_id.'
+    assert codec.name not in _CODECS and codec.codec_id not in _CODECS
+    _CODECS[codec.name] = codec
+    _CODECS[codec.codec_id] = codec
+    return codec
+
+
+def get_codec(key):
+    """Look up a registered codec by name or codec_id."""
+    return _CODECS[key]
+
+
+def registered_codecs():
+    return [codec for key, codec in _CODECS.items() if isinstance(key, str)]
+
+
+def _json_encode(value):
+    return json.dumps(value).encode('utf-8')
+
+
+def _json_decode(data):
+    return json.loads(str(data, 'utf-8'))
+
+
+def _utf8_encode(value):
+    return value.encode('utf-8')
+
+
+def _utf8_decode(data):
+    return str(data, 'utf-8')
+
+
+def _raw_encode(value):
+    return value
+
+
+JSON = register_codec(PayloadCodec('json', _json_encode, _json_decode, codec_id=1))
+PICKLE = register_codec(PayloadCodec('pickle', pickle.dumps, pickle.loads, codec_id=2))
+UTF8 = register_codec(PayloadCodec('utf8', _utf8_encode, _utf8_decode, codec_id=3))
+# codec_id 4 was the compact codec, peers may still announce it.
+RAW = register_codec(PayloadCodec('raw', _raw_encode, bytes, codec_id=5))
@@ -51,10 +51,76 @@ CMD_SERVICE_WRITE_STD_EXCPTION = 33
 CMD_SERVICE_SET_EVENT = 34
 CMD_SERVICE_SET_EXCEPTION = 35
 
+# container of complete frames, only sent when MCP_CAP_BATCH is negotiated.
+MCP_BATCH = 36
+# part of a large frame, only sent when MCP_CAP_FRAGMENT is negotiated.
+MCP_FRAGMENT = 37
+
+# credit based flow control of captured packets, only sent when
+# MCP_CAP_CREDIT is negotiated.
+CAPTURE_SERVICE_GRANT_CREDIT = 38
+CAPTURE_SERVICE_DROP_REPORT = 39
+
+# agent binds a connection to the agent of another one as its stripe,
+# only sent when MCP_CAP_STRIPE is negotiated.
+MCP_STRIPE_JOIN = 40
+
+# shared memory ring of bulk frames on a unix domain socket connection,
+# only sent when MCP_CAP_SHM is negotiated.
+MCP_SHM_ATTACH = 41
+MCP_SHM_ATTACHED = 42
+MCP_SHM_FRAME = 43
+
+# session of an agent which outlives its connection, only sent when
+# MCP_CAP_RESUME is negotiated.
+MCP_SESSION_OPEN = 44
+MCP_SESSION_RESUME = 45
+MCP_SESSION_RESUMED = 46
+MCP_SESSION_ACK = 47
+
+# liveness and round trip time of a connection, only sent when
+# MCP_CAP_HEARTBEAT is negotiated.
+MCP_HEARTBEAT = 48
+MCP_HEARTBEAT_REPLY = 49
+
 # mcp hello
 MCP_HELLO_SIZE = 2
 MCP_HELLO_STR = "!H"
 
+# capability of mcp hello, appended after connection_id.
+# features, max_frame_size, compression, batch_max, codecs
+MCP_HELLO_CAPABILITY_SIZE = 15
+MCP_HELLO_CAPABILITY_STR = "!IIBHI"
+
+# capability features
+MCP_CAP_BATCH = 1 << 0
+MCP_CAP_COMPRESSION = 1 << 1
+MCP_CAP_FRAGMENT = 1 << 2
+MCP_CAP_CREDIT = 1 << 3
+MCP_CAP_STRIPE = 1 << 4
+MCP_CAP_SHM = 1 << 5
+MCP_CAP_RESUME = 1 << 6
+MCP_CAP_HEARTBEAT = 1 << 7
+
+# mcp batch, count and length of frames.
+MCP_BATCH_SIZE = 6
+MCP_BATCH_STR = "!HI"
+
+# mcp fragment, stream_id, total length of frame, offset and length of data.
+MCP_FRAGMENT_SIZE = 16
+MCP_FRAGMENT_STR = "!IIII"
+
+# mcp shm frame, offset and length of frame in the ring, read position after it.
+MCP_SHM_FRAME_SIZE = 16
+MCP_SHM_FRAME_STR = "!IIQ"
+
+# flag in msg_type of header, frame body is compressed.
+MCP_FLAG_COMPRESSED = 0x8000
+
+# capability compression algorithms
+MCP_COMPRESSION_ZLIB = 1 << 0
+MCP_COMPRESSION_LZMA = 1 << 1
+
 MCP_JOB_ID_WITH_INFO_SIZE = 8
 MCP_JOB_ID_WITH_INFO_STR = "!II"
 
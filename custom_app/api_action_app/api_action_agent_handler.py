@@ -69,7 +69,7 @@ class APIActionAgentController(BaseApp):
             LOG.warning(f"API Login Failed.")
  
         msg.xid = login_msg.xid
-        conn.send_msg(msg)
+        conn.send_msg_nowait(msg)
 
     @observe_event(mcp_event.EventAPIActionRequest)
     def api_action_request_handler(self, ev):
@@ -93,7 +93,7 @@ class APIActionAgentController(BaseApp):
             msg = conn.mcproto_parser.APIActionResponse(conn, RemoteResponse(resp))
             msg.xid = xid
 
-            conn.send_msg(msg)
+            conn.send_msg_nowait(msg)
         except Exception as e:
             # send exception back
             print(traceback.format_exc())
\ No newline at end of file
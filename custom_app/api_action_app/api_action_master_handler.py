@@ -36,7 +36,6 @@ class APIActionMasterController(BaseApp):
         self.agent_connection = {}
         self.agent_req = {}
         self.api_actions = {}
-        self.xid_to_req = {}
 
         # Make APIAction competible with remote feature.
         for api_action_cls in _API_ACTION_CLS:
@@ -102,14 +101,14 @@ class APIActionMasterController(BaseApp):
         # send login request to target agent
         msg = conn.mcproto_parser.APILogin(conn, api_action_id=api_action._ID, session_info=ev.session_info, args=ev.args, kwargs=ev.kwargs)
         conn.set_xid(msg)
-        self.xid_to_req.setdefault(msg.xid, ev)
-        conn.send_msg(msg)
+        conn.add_pending_request(msg.xid, ev)
+        conn.send_msg_nowait(msg)
 
     @observe_event(mcp_event.EventAPILoginResponse)
     def remote_login_reply_handler(self, ev):
         msg = ev.msg
 
-        if (req_ev := self.xid_to_req.get(msg.xid, None)) is None:
+        if (req_ev := msg.connection.pop_pending_request(msg.xid)) is None:
             LOG.warning(f"Remote API Login reply error.")
             return
 
@@ -120,7 +119,7 @@ class APIActionMasterController(BaseApp):
     def remote_api_login_falied(self, ev):
         msg = ev.msg 
 
-        if (req := self.xid_to_req.pop(msg.xid, None)) is None:
+        if (req := msg.connection.pop_pending_request(msg.xid)) is None:
             LOG.warning(f"Can't find target login request event. xid = {msg.xid}")
             return
 
@@ -138,14 +137,14 @@ class APIActionMasterController(BaseApp):
         msg = conn.mcproto_parser.APIActionRequest(conn, api_action._ID, ev.method, api_action.auth, api_action.base_url, ev.args, ev.kwargs)
         conn.set_xid(msg)
 
-        self.xid_to_req[msg.xid] = ev
-        conn.send_msg(msg)
+        conn.add_pending_request(msg.xid, ev)
+        conn.send_msg_nowait(msg)
 
     @observe_event(mcp_event.EventAPIActionResponse)
     def remote_api_response(self, ev):
         msg = ev.msg 
 
-        if (req := self.xid_to_req.pop(msg.xid, None)) is None:
+        if (req := msg.connection.pop_pending_request(msg.xid)) is None:
             LOG.warning(f"Can't find target request, xid = {msg.xid}")
             return
 
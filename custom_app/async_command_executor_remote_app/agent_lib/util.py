@@ -9,7 +9,7 @@ def remote_set_event(method):
         connection = self._connection
         method(event_id)
         msg = connection.mcproto_parser.CmdServiceSetEvent(connection, self._cmd_id, event_id)
-        connection.send_msg(msg)
+        connection.send_msg_nowait(msg)
 
     return _remote_set_event
 
@@ -18,7 +18,7 @@ def remote_set_exception(method):
         connection = self._connection
         method(exception)
         msg = connection.mcproto_parser.CmdServiceSetException(connection, self._cmd_id, exception)
-        connection.send_msg(msg)
+        connection.send_msg_nowait(msg)
 
     return _remote_set_exception
 
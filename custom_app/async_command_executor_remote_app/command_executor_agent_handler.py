@@ -47,12 +47,12 @@ class CommandExecutorAgentHandler(BaseApp):
             output = await executor.read_std(*args, std_type=std_type, **kwargs)
             msg = connection.mcproto_parser.CmdServiceReadStdRes(connection, executor._cmd_id, output)
             msg.xid = xid
-            connection.send_msg(msg)
+            connection.send_msg_nowait(msg)
         except Exception as e:
             if executor._cmd_id in self.executors:
                 msg = connection.mcproto_parser.CmdServiceReadStdException(connection, executor._cmd_id, e)
                 msg.xid = xid
-                connection.send_msg(msg)
+                connection.send_msg_nowait(msg)
                 return
 
 
@@ -1,7 +1,6 @@
 from typing import Dict
 from async_app_fw.base.app_manager import BaseApp
 from async_app_fw.event.mcp_event import mcp_event
-from async_app_fw.event.async_event import EventAsyncRequestBase
 from async_app_fw.controller.handler import observe_event
 from async_app_fw.controller.mcp_controller.master_controller import MasterConnection
 from custom_app.util.async_command_executor import AsyncCommandExecutor
@@ -22,7 +21,6 @@ class CommandExecutorMasterHandler(BaseApp):
         self.name = APP_NAME
         self.agent_connection: Dict[str, MasterConnection] = {} 
         self.cmd_service: Dict[int, AsyncCaptureService] = {}
-        self.req_tmp_pool: Dict[int, EventAsyncRequestBase] = {}
 
     def start(self):
         tasks = super().start()
@@ -65,7 +63,7 @@ class CommandExecutorMasterHandler(BaseApp):
 
         # send input variables that execute method need to remote agnet.
         msg = conn.mcproto_parser.CmdServiceExecute(conn, cmd_exe._cmd_id, ev.input_vars)
-        conn.send_msg(msg)
+        conn.send_msg_nowait(msg)
 
     @observe_event(EventRemoteCancelExecute)
     def remote_cancel_execute(self, ev: EventRemoteCancelExecute):
@@ -83,7 +81,7 @@ class CommandExecutorMasterHandler(BaseApp):
         """
 
         msg = conn.mcproto_parser.CmdServiceCancelExecute(conn, cmd_exe._cmd_id)
-        conn.send_msg(msg)
+        conn.send_msg_nowait(msg)
 
     @observe_event(ReqReadStd)
     def remote_read_stdout(self, ev):
@@ -91,9 +89,9 @@ class CommandExecutorMasterHandler(BaseApp):
         conn:MasterConnection = cmd_exe._mcp_connection
         msg = conn.mcproto_parser.CmdServiceReadStd(conn, cmd_exe._cmd_id, ev.std_type, ev.input_vars)
         xid = conn.set_xid(msg)
-        conn.send_msg(msg)
-        # register Async Event Request
-        self.req_tmp_pool[xid] = ev
+        # register Async Event Request before the reply can come, failed if the agent is lost.
+        conn.add_pending_request(xid, ev)
+        conn.send_msg_nowait(msg)
 
     @observe_event(ReqWriterStd)
     def remote_writer_stdin(self, ev):
@@ -101,15 +99,15 @@ class CommandExecutorMasterHandler(BaseApp):
         conn:MasterConnection = cmd_exe._mcp_connection
         msg = conn.mcproto_parser.CmdServiceWriteStd(conn, cmd_exe._cmd_id, ev.inputs_vars)
         xid = conn.set_xid(msg)
-        conn.send_msg(msg)
-        # register Async Event Request
-        self.req_tmp_pool[xid] = ev
+        # register Async Event Request before the reply can come, failed if the agent is lost.
+        conn.add_pending_request(xid, ev)
+        conn.send_msg_nowait(msg)
 
     @observe_event(mcp_event.EventCmdServiceWriteStdException)
     @observe_event(mcp_event.EventCmdServiceReadStdException)
     def read_stdout_exception_handler(self, ev):
         msg = ev.msg
-        if (req := self.req_tmp_pool.get(msg.xid, None)) is None:
+        if (req := msg.connection.pop_pending_request(msg.xid)) is None:
             return
 
         req.push_reply(msg.exception)
@@ -118,7 +116,7 @@ class CommandExecutorMasterHandler(BaseApp):
     @observe_event(mcp_event.EventCmdServiceWriteStdRes)
     def read_stdout_result_handler(self, ev):
         msg = ev.msg
-        if (req := self.req_tmp_pool.get(msg.xid, None)) is None:
+        if (req := msg.connection.pop_pending_request(msg.xid)) is None:
             return
 
         req.push_reply(msg.output)
@@ -6,7 +6,7 @@ def remote_set_event(method):
         connection = self._connection
         method(event_id)
         msg = connection.mcproto_parser.CaptureServiceSetEvent(connection, self._capture_id, event_id)
-        connection.send_msg(msg)
+        connection.send_msg_nowait(msg)
 
     return _remote_set_event
 
@@ -15,7 +15,7 @@ def remote_set_exception(method):
         connection = self._connection
         method(exception)
         msg = connection.mcproto_parser.CaptureServiceSetException(connection, self._capture_id, exception)
-        connection.send_msg(msg)
+        connection.send_msg_nowait(msg)
 
     return _remote_set_exception
 
@@ -6,9 +6,12 @@ from async_app_fw.controller.handler import observe_event
 from async_app_fw.controller.mcp_controller.agent_controller import AgentConnection
 from async_app_fw.controller.mcp_controller.mcp_state import MC_DISCONNECT, MC_STABLE
 from async_app_fw.event.mcp_event import mcp_event
+from async_app_fw.lib.credit import CreditWindow
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
 from custom_app.async_packet_capture_service.agent_lib.util import add_remote_feature
 from custom_app.util.async_tshark import AsyncCaptureService
-from .constant import CAPTURE_SERVCIE_AGENT_HANDLER_APP_NAME as APP_NAME, CAPTURE_SERVICE_CLS_ID_MAPPING
+from .constant import CAPTURE_SERVCIE_AGENT_HANDLER_APP_NAME as APP_NAME, CAPTURE_SERVICE_CLS_ID_MAPPING, \
+    CAPTURE_CREDIT_POLICY, CAPTURE_CREDIT_BUFFER_SIZE
 from async_app_fw.lib.hub import app_hub
 
 _REQUIRED_APP = [
@@ -24,6 +27,9 @@ class CaptureServiceAgentHandler(BaseApp):
         self.master_connection:AgentConnection = None
         self.service: Dict[int, AsyncCaptureService] = {}
         self.service_tasks: Dict[int, asyncio.Task] = {}
+        # capture_id: credit window, when master grants credits for packets.
+        self.credit_windows: Dict[int, CreditWindow] = {}
+        self.reported_drops: Dict[int, int] = {}
         AsyncCaptureService.__new__ = add_remote_feature
 
     @observe_event(mcp_event.EventMCPStateChange, MC_STABLE)
@@ -38,6 +44,8 @@ class CaptureServiceAgentHandler(BaseApp):
 
         self.service.clear()
         self.service_tasks.clear()
+        self.credit_windows.clear()
+        self.reported_drops.clear()
 
     async def stop(self):
         for task in self.service_tasks.values():
@@ -52,9 +60,14 @@ class CaptureServiceAgentHandler(BaseApp):
             conn = self.master_connection
             capture_id = capture._capture_id
     
+            if (window := self.credit_windows.get(capture_id, None)) is not None:
+                # packets are sent as master grants credits.
+                push = window.push
+            else:
+                push = self.packet_sender(conn, capture_id)
+
             async def send_packet_to_master(pkt):
-                msg = conn.mcproto_parser.CaptureServiceSendPKT(conn, capture_id, pkt)
-                conn.send_msg(msg)
+                push(pkt)
  
             input_vars['kwargs']['callback'] = send_packet_to_master
  
@@ -67,6 +80,37 @@ class CaptureServiceAgentHandler(BaseApp):
             await capture.stop()
         finally:
             self.service_tasks.pop(capture_id)
+            if (window := self.credit_windows.pop(capture_id, None)) is not None:
+                window.close()
+                self.report_drops(conn, capture_id, window)
+                self.reported_drops.pop(capture_id, None)
+
+    @staticmethod
+    def packet_sender(conn, capture_id):
+        def send_packet(pkt):
+            msg = conn.mcproto_parser.CaptureServiceSendPKT(conn, capture_id, pkt)
+            conn.send_msg_nowait(msg)
+
+        return send_packet
+
+    def report_drops(self, conn, capture_id, window: CreditWindow):
+        # report only when more packets are dropped.
+        if window.dropped == self.reported_drops.get(capture_id, 0):
+            return
+
+        self.reported_drops[capture_id] = window.dropped
+        msg = conn.mcproto_parser.CaptureServiceDropReport(conn, capture_id, window.dropped & 0xffffffff)
+        conn.send_msg_nowait(msg)
+
+    @observe_event(mcp_event.EventCaptureServiceGrantCredit)
+    def grant_credit_handler(self, ev):
+        msg = ev.msg
+        if (window := self.credit_windows.get(msg.capture_id, None)) is None:
+            # capture has finished.
+            return
+
+        window.grant(msg.credits)
+        self.report_drops(self.master_connection, msg.capture_id, window)
 
     @observe_event(mcp_event.EventCaptureServiceCancelExecute)
     def stop_capture_service(self, ev):
@@ -93,6 +137,13 @@ class CaptureServiceAgentHandler(BaseApp):
             # save capture serivce's instance
             self.service[capture_id] = capture_instance
 
+        conn = self.master_connection
+        if conn.supports(mcproto.MCP_CAP_CREDIT):
+            # created before credits granted after the execute message arrive.
+            self.credit_windows[capture_id] = CreditWindow(
+                self.packet_sender(conn, capture_id), CAPTURE_CREDIT_POLICY, CAPTURE_CREDIT_BUFFER_SIZE)
+            self.reported_drops[capture_id] = 0
+
         # spawn a task to run capture service
         service_task = spawn(self.run_capture_service, capture_instance, msg.input_vars)
         # save task
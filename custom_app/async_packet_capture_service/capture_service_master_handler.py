@@ -2,11 +2,13 @@ from typing import Dict
 import asyncio
 
 from async_app_fw.base.app_manager import BaseApp
-from async_app_fw.controller.handler import observe_event
+from async_app_fw.controller.handler import observe_event, observe_event_batch
 from async_app_fw.controller.mcp_controller.master_controller import MasterConnection
 from async_app_fw.controller.mcp_controller.mcp_state import MC_STABLE
 from async_app_fw.event.mcp_event import mcp_event
+from async_app_fw.lib.credit import CreditGranter
 from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
 from custom_app.util.async_tshark import AsyncCaptureService
 
 from .master_lib.event import EventRemoteExecute, EventRemoteCancelExecute
@@ -58,7 +60,7 @@ class CaptureServiceMasterHandler(BaseApp):
             raise ConnectionIsNoneWhenRemoteExecute()
         elif not isinstance(connection, MasterConnection):
             raise TypeError(f"Connection should be instance of {MasterConnection.__name__}.")
-        elif connection.state != MC_STABLE:
+        elif connection.latest().state != MC_STABLE:
             raise ConnectionIsNotStable()
 
     @observe_event(EventRemoteExecute)
@@ -77,7 +79,22 @@ class CaptureServiceMasterHandler(BaseApp):
 
         # send input variables that execute method need to remote agnet.
         msg = conn.mcproto_parser.CaptureServiceExe(conn, capture._capture_id, capture.capture_cls_id, ev.input_vars)
-        conn.send_msg(msg)
+        conn.send_msg_nowait(msg)
+
+        fake_capture = capture._fake_capture
+        capture_size = fake_capture._packets_queue.maxsize
+        if conn.supports(mcproto.MCP_CAP_CREDIT) and capture_size > 0:
+            # agent sends no more packets than the queue of fake capture holds.
+            fake_capture.credit = CreditGranter(self.credit_granter(conn, capture._capture_id), capture_size)
+            fake_capture.credit.open()
+
+    @staticmethod
+    def credit_granter(conn, capture_id):
+        def grant(credits):
+            msg = conn.mcproto_parser.CaptureServiceGrantCredit(conn, capture_id, credits)
+            conn.send_msg_nowait(msg)
+
+        return grant
 
     @observe_event(EventRemoteCancelExecute)
     def remote_cancel_execute(self, ev):
@@ -93,18 +110,30 @@ class CaptureServiceMasterHandler(BaseApp):
             return
 
         msg = conn.mcproto_parser.CaptureServiceCancelExecute(conn, capture._capture_id)
-        conn.send_msg(msg)
+        conn.send_msg_nowait(msg)
 
-    @observe_event(mcp_event.EventCaptureServiceSendPKT)
-    def receive_packet_from_remote(self, ev):
-        msg = ev.msg
-        spawn(self.capture_services[msg.capture_id]._capture.push_packet, msg.pkt)
+    @observe_event_batch(mcp_event.EventCaptureServiceSendPKT)
+    def receive_packets_from_remote(self, evs):
+        # packets of the drained events, pushed once per capture.
+        packets = {}
+        for ev in evs:
+            msg = ev.msg
+            packets.setdefault(msg.capture_id, []).append(msg.pkt)
+
+        for capture_id, pkts in packets.items():
+            self.capture_services[capture_id]._capture.push_packets(pkts)
 
     @observe_event(mcp_event.EventCaptureServiceSetException)
     def set_exception_by_remote(self, ev):
         msg = ev.msg
         self.capture_services[msg.capture_id]._set_exception(msg.exception)
 
+    @observe_event(mcp_event.EventCaptureServiceDropReport)
+    def drop_reported_by_remote(self, ev):
+        msg = ev.msg
+        # packets agent dropped for lack of credit.
+        self.capture_services[msg.capture_id]._fake_capture.agent_dropped = msg.dropped
+
     @observe_event(mcp_event.EventCaptureServiceSetEvent)
     def event_set_by_remote_agent(self, ev):
         msg = ev.msg
@@ -1,3 +1,4 @@
+from async_app_fw.lib.credit import CREDIT_BUFFER
 from custom_app.util.async_tshark import AsyncLiveCaptureService
 
 CAPTURE_SERVCIE_AGENT_HANDLER_APP_NAME = 'capture_service_agent_handler'
@@ -5,6 +6,10 @@ CAPTURE_SERVCIE_MASTER_HANDLER_APP_NAME = 'capture_service_master_handler'
 
 SERVICE_CLOSE_MONITER_INTERVAL = 10
 
+# what agent does with packets captured while master has granted no credit.
+CAPTURE_CREDIT_POLICY = CREDIT_BUFFER
+CAPTURE_CREDIT_BUFFER_SIZE = 1000
+
 CAPTURE_SERVICE_CLS_ID_MAPPING = {
     AsyncLiveCaptureService.capture_cls_id: AsyncLiveCaptureService
 }
\ No newline at end of file
@@ -4,6 +4,7 @@ import logging
 from types import MethodType
 from async_app_fw.controller.mcp_controller.master_lib.event import ReqGetAgentConnection
 from async_app_fw.base.app_manager import BaseApp
+from async_app_fw.lib.credit import CreditGranter
 from async_app_fw.lib.hub import app_hub
 from custom_app.util.constant import AsyncServiceEventID
 from custom_app.util.async_tshark import AsyncCaptureService
@@ -17,6 +18,11 @@ class FakeCapture:
     def __init__(self, capture_size, callback=None) -> None:
         self._packets_queue = asyncio.Queue(capture_size)
         self.callback = callback
+        # CreditGranter when agent sends packets as credits are granted.
+        self.credit: CreditGranter = None
+        # dropped when queue is full, and dropped by agent for lack of credit.
+        self.dropped = 0
+        self.agent_dropped = 0
 
     def change_capture_size(self, capture_size):
         if capture_size == self._packets_queue.maxsize:
@@ -33,11 +39,20 @@ class FakeCapture:
         if queue.full():
             logging.warning(f'Packet Queue is already full, pop out one packet from queue.')
             queue.get_nowait()
+            self.dropped += 1
+            if self.credit is not None:
+                self.credit.consumed()
 
         if self.callback is None:
             queue.put_nowait(pkt)
         else:
             spawn(self.callback, pkt)
+            if self.credit is not None:
+                self.credit.consumed()
+
+    def push_packets(self, pkts):
+        for pkt in pkts:
+            self.push_packet(pkt)
 
     def set_callback(self, callback):
         if not (callable(self.callback) or callback is None \
@@ -50,12 +65,18 @@ class FakeCapture:
         queue = self._packets_queue
         while not queue.empty():
             queue.get_nowait()
+        self.credit = None
+        self.dropped = 0
+        self.agent_dropped = 0
 
     async def get_packet(self, timeout=None):
         get = await asyncio.wait_for(self._packets_queue.get(), timeout)
         if isinstance(get, Exception):
             raise get
 
+        if self.credit is not None:
+            self.credit.consumed()
+
         return get
 
     def close(self):
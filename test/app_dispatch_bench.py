@@ -0,0 +1,137 @@
+"""
+Microbenchmark of dispatching events to the handlers of an app.
+
+An app has handlers of two event classes, some of them for a few states
+only, and observers of one of them. Lookups of handlers and observers by
+BaseApp.get_handlers and get_observers are timed against the filtering
+they did on every event before they were compiled per (ev_cls, state).
+Then events are sent to the app itself and counted by its handlers, for
+the rate of events dispatched by its event loop.
+
+    python test/app_dispatch_bench.py [events]
+"""
+import asyncio
+import sys
+import time
+
+from async_app_fw.base.app_manager import AppManager, BaseApp
+from async_app_fw.controller.handler import HANDLER_FILTER, observe_event
+from async_app_fw.event.event import EventBase
+from async_app_fw.lib.hub import app_hub
+
+DEFAULT_EVENTS = 200000
+STATES = (1, 2, 3, 4)
+
+
+class EventBenchState(EventBase):
+    pass
+
+
+class EventBenchData(EventBase):
+    pass
+
+
+class DispatchBench(BaseApp):
+    _EVENTS = [EventBenchState, EventBenchData]
+
+    def __init__(self, *_args, **_kwargs):
+        super().__init__(*_args, **_kwargs)
+        self.name = 'dispatch_bench'
+        self.handled = 0
+        self.done = asyncio.Event()
+        self.expect = 0
+
+    def _count(self):
+        self.handled += 1
+        if self.handled == self.expect:
+            self.done.set()
+
+    @observe_event(EventBenchState, 1)
+    def state_1_handler(self, ev):
+        self._count()
+
+    @observe_event(EventBenchState, [2, 3])
+    def state_2_3_handler(self, ev):
+        self._count()
+
+    @observe_event(EventBenchState)
+    def state_handler(self, ev):
+        self._count()
+
+    @observe_event(EventBenchData)
+    def data_handler(self, ev):
+        self._count()
+
+    @observe_event(EventBenchData)
+    def data_stats_handler(self, ev):
+        pass
+
+
+def legacy_get_handlers(app, ev, state=None):
+    """get_handlers as it filtered every event."""
+    ev_cls = ev.__class__
+    handlers = app.event_handlers.get(ev_cls, [])
+    handler_filter = HANDLER_FILTER.get(ev_cls.FILTER_TYPE)
+
+    return filter(lambda hanlder: handler_filter(hanlder, ev, ev_cls, state), handlers)
+
+
+def legacy_get_observers(app, ev, state):
+    observers = []
+    for k, v in app.observers.get(ev.__class__, {}).items():
+        if not state or not v or state in v:
+            observers.append(k)
+
+    return observers
+
+
+def lookups(count, get_handlers, get_observers, events):
+    start = time.perf_counter()
+    for i in range(count):
+        ev, state = events[i & 7]
+        for handler in get_handlers(ev, state):
+            pass
+    handlers = count / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(count):
+        ev, state = events[i & 7]
+        for observer in get_observers(ev, state):
+            pass
+    observers = count / (time.perf_counter() - start)
+    return handlers, observers
+
+
+async def main(count):
+    app = AppManager.get_instance().instantiate(DispatchBench)
+    app.start()
+    for name in ('observer_a', 'observer_b', 'observer_c'):
+        app.register_observer(EventBenchState, name, {STATES[len(name) % 4]})
+        app.register_observer(EventBenchData, name)
+
+    events = [(EventBenchState(), STATES[i % 4]) for i in range(4)] + [(EventBenchData(), None)] * 4
+
+    legacy = lookups(count, lambda ev, state: legacy_get_handlers(app, ev, state),
+                     lambda ev, state: legacy_get_observers(app, ev, state), events)
+    compiled = lookups(count, app.get_handlers, app.get_observers, events)
+    for name, (handlers, observers) in (('filtered', legacy), ('compiled', compiled)):
+        print(f'{name:>9}: get_handlers {handlers:,.0f}/s, get_observers {observers:,.0f}/s')
+
+    app.expect = sum(len(app.get_handlers(ev, state)) - (ev.__class__ is EventBenchData)
+                     for ev, state in events) * (count // 8)
+    start = time.perf_counter()
+    for i in range(count // 8 * 8):
+        ev, state = events[i & 7]
+        app.send_event_to_self(ev, state)
+        if i & 255 == 0:
+            await asyncio.sleep(0)
+    await app.done.wait()
+    elapsed = time.perf_counter() - start
+    print(f'{"loop":>9}: {count // 8 * 8 / elapsed:,.0f} events/s dispatched, '
+          f'{app.handled / elapsed:,.0f} handler calls/s')
+    await app.stop()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_EVENTS
+    app_hub.joinall([app_hub.spawn(main, count)])
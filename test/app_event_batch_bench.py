@@ -0,0 +1,141 @@
+"""
+Microbenchmark of batch-draining event loops and batch handlers.
+
+Packet events, like EventCaptureServiceSendPKT, are sent to an app in
+bursts and the app pushes their packets into the queue of a capture,
+which a consumer reads. The app handles them:
+
+- spawned: one event per wake-up, a handler per event spawning the push,
+  as the capture master handler did.
+- per event: EVENT_BATCH_SIZE events per wake-up, a handler per event
+  pushing the packet.
+- batch: EVENT_BATCH_SIZE events per wake-up, an observe_event_batch
+  handler pushing the packets of the batch at once.
+
+Prints the rate packets reach the consumer at. Then the same events are
+only counted by the handlers, for the cost of dispatching them alone.
+Each rate is the best of RUNS runs.
+
+    python test/app_event_batch_bench.py [events] [burst]
+"""
+import asyncio
+import sys
+import time
+
+from async_app_fw.base import app_manager
+from async_app_fw.base.app_manager import AppManager, BaseApp
+from async_app_fw.controller.handler import observe_event, observe_event_batch
+from async_app_fw.event.event import EventBase
+from async_app_fw.lib.hub import app_hub
+
+DEFAULT_EVENTS = 200000
+DEFAULT_BURST = 500
+RUNS = 3
+
+
+class EventBenchPKT(EventBase):
+    def __init__(self, pkt):
+        super().__init__()
+        self.pkt = pkt
+
+
+class BatchBenchBase(BaseApp):
+    def __init__(self, *_args, **_kwargs):
+        super().__init__(*_args, **_kwargs)
+        self.packets = asyncio.Queue()
+
+    def push_packet(self, pkt):
+        self.packets.put_nowait(pkt)
+
+
+class SpawnedPush(BatchBenchBase):
+    EVENT_BATCH_SIZE = 1
+
+    @observe_event(EventBenchPKT)
+    def packet_handler(self, ev):
+        app_hub.spawn(self.push_packet, ev.pkt)
+
+
+class PerEventPush(BatchBenchBase):
+    @observe_event(EventBenchPKT)
+    def packet_handler(self, ev):
+        self.push_packet(ev.pkt)
+
+
+class BatchPush(BatchBenchBase):
+    @observe_event_batch(EventBenchPKT)
+    def packets_handler(self, evs):
+        for ev in evs:
+            self.push_packet(ev.pkt)
+
+
+class CountBase(BaseApp):
+    def __init__(self, *_args, **_kwargs):
+        super().__init__(*_args, **_kwargs)
+        self.count = 0
+
+
+class PerEventCount(CountBase):
+    @observe_event(EventBenchPKT)
+    def packet_handler(self, ev):
+        self.count += 1
+
+
+class BatchCount(CountBase):
+    @observe_event_batch(EventBenchPKT)
+    def packets_handler(self, evs):
+        self.count += len(evs)
+
+
+async def send(app, count, burst):
+    for i in range(0, count, burst):
+        for j in range(i, min(i + burst, count)):
+            app.send_event_to_self(EventBenchPKT(j))
+        await asyncio.sleep(0)
+
+
+async def run(app, count, burst):
+    async def consume():
+        for _ in range(count):
+            await app.packets.get()
+
+    consumer = asyncio.ensure_future(consume())
+    start = time.perf_counter()
+    await send(app, count, burst)
+    await consumer
+    return count / (time.perf_counter() - start)
+
+
+async def run_count(app, count, burst):
+    app.count = 0
+    start = time.perf_counter()
+    await send(app, count, burst)
+    while app.count < count:
+        await asyncio.sleep(0)
+    return count / (time.perf_counter() - start)
+
+
+async def best(mgr, cls, run_func, count, burst):
+    app = mgr.instantiate(cls)
+    app.start()
+    rate = max([await run_func(app, count, burst) for _ in range(RUNS)])
+    await app.stop()
+    return rate
+
+
+async def main(count, burst):
+    mgr = AppManager.get_instance()
+    print(f'{count:,} packet events in bursts of {burst}, '
+          f'{app_manager.DEFAULT_EVENT_BATCH_SIZE} events per wake-up.')
+    for label, cls in (('spawned', SpawnedPush), ('per event', PerEventPush), ('batch', BatchPush)):
+        print(f'{label:>9}: {await best(mgr, cls, run, count, burst):,.0f} packets/s')
+
+    print('dispatch only:')
+    for label, cls in (('per event', PerEventCount), ('batch', BatchCount)):
+        print(f'{label:>9}: {await best(mgr, cls, run_count, count, burst):,.0f} events/s')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_EVENTS
+    burst = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BURST
+    app_hub.joinall([app_hub.spawn(main, count, burst)])
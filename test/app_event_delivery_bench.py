@@ -0,0 +1,143 @@
+"""
+Microbenchmark of delivering events to the queues of apps.
+
+A source app sends each event to three observer apps and to itself, the
+fan-out of a message received by MachineConnection._recv_loop. Events are
+delivered the way BaseApp.send_event does, queued at once, and the way it
+did before, by a task spawned per event and app. Prints the rate events
+are handled at and how many tasks were created for them.
+
+Then the source outpaces observers with a bounded queue, with each
+EVENT_OVERFLOW_* policy, for the events they kept or dropped.
+
+    python test/app_event_delivery_bench.py [events]
+"""
+import asyncio
+import sys
+import time
+
+from async_app_fw.base import app_manager
+from async_app_fw.base.app_manager import AppManager, BaseApp
+from async_app_fw.controller.handler import observe_event
+from async_app_fw.event.event import EventBase
+from async_app_fw.lib.hub import app_hub
+
+DEFAULT_EVENTS = 100000
+OBSERVERS = ('delivery_observer_a', 'delivery_observer_b', 'delivery_observer_c')
+BOUNDED_OBSERVERS = ('bounded_observer_wait', 'bounded_observer_drop', 'bounded_observer_raise')
+QUEUE_SIZE = 256
+
+
+class EventDeliveryBench(EventBase):
+    pass
+
+
+class DeliverySource(BaseApp):
+    _EVENTS = [EventDeliveryBench]
+
+    def __init__(self, *_args, **_kwargs):
+        super().__init__(*_args, **_kwargs)
+        self.name = 'delivery_source'
+        self.handled = 0
+
+    @observe_event(EventDeliveryBench)
+    def delivery_handler(self, ev):
+        self.handled += 1
+
+
+class DeliveryObserver(BaseApp):
+    def __init__(self, *_args, name, **_kwargs):
+        super().__init__(*_args, **_kwargs)
+        self.name = name
+        self.handled = 0
+
+    @observe_event(EventDeliveryBench)
+    def delivery_handler(self, ev):
+        self.handled += 1
+
+
+class BoundedObserver(DeliveryObserver):
+    EVENT_QUEUE_SIZE = QUEUE_SIZE
+
+
+def spawned_send_event(source, name, ev, state=None):
+    """send_event as it spawned a task per event."""
+    app = app_manager.SERVICE_BRICKS[name]
+    return app_hub.spawn(app._send_event, ev, state)
+
+
+async def deliver(source, apps, count, send_event):
+    loop = asyncio.get_running_loop()
+    tasks = 0
+    factory = loop.get_task_factory()
+
+    def counting_factory(loop, coro, **kwargs):
+        nonlocal tasks
+        tasks += 1
+        if factory is not None:
+            return factory(loop, coro, **kwargs)
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    for app in apps:
+        app.handled = 0
+    loop.set_task_factory(counting_factory)
+    start = time.perf_counter()
+    try:
+        for i in range(count):
+            ev = EventDeliveryBench()
+            for name in OBSERVERS:
+                send_event(source, name, ev)
+            send_event(source, source.name, ev)
+            if i & 63 == 0:
+                await asyncio.sleep(0)
+        while sum(app.handled for app in apps) < count * len(apps):
+            await asyncio.sleep(0)
+    finally:
+        loop.set_task_factory(factory)
+    return count / (time.perf_counter() - start), tasks
+
+
+async def overflow(source, app, count):
+    raised = 0
+    for _ in range(count):
+        try:
+            source.send_event(app.name, EventDeliveryBench())
+        except app_manager.EventQueueFull:
+            raised += 1
+    while app._event_backlog or not app.events.empty():
+        await asyncio.sleep(0.001)
+
+    print(f'{app.event_overflow_policy:>7}: {app.handled:,} handled, {app.event_overflows:,} overflowed'
+          + (f', {raised:,} raised' if raised else ''))
+
+
+async def main(count):
+    mgr = AppManager.get_instance()
+    source = mgr.instantiate(DeliverySource)
+    observers = [mgr.instantiate(DeliveryObserver, name=name) for name in OBSERVERS]
+    bounded = [mgr.instantiate(BoundedObserver, name=name) for name in BOUNDED_OBSERVERS]
+    for app, policy in zip(bounded, (app_manager.EVENT_OVERFLOW_WAIT, app_manager.EVENT_OVERFLOW_DROP,
+                                     app_manager.EVENT_OVERFLOW_RAISE)):
+        app.event_overflow_policy = policy
+    apps = [source] + observers
+    for app in apps + bounded:
+        app.start()
+    await asyncio.sleep(0)
+
+    print(f'{count:,} events to {len(OBSERVERS)} observers and the source, '
+          f'{count * len(apps):,} deliveries.')
+    for label, send_event in (('spawned', spawned_send_event), ('queued', BaseApp.send_event)):
+        rate, tasks = await deliver(source, apps, count, send_event)
+        print(f'{label:>7}: {rate:,.0f} events/s, {rate * len(apps):,.0f} deliveries/s, {tasks:,} tasks')
+
+    print(f'observer queues of {QUEUE_SIZE} events, {count // 10:,} events sent at once.')
+    for app in bounded:
+        await overflow(source, app, count // 10)
+
+    for app in apps + bounded:
+        await app.stop()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_EVENTS
+    app_hub.joinall([app_hub.spawn(main, count)])
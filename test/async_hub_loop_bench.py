@@ -0,0 +1,136 @@
+"""
+Benchmark of the master on the default asyncio loop and on uvloop.
+
+Each loop is run in its own process, app_hub picks its loop from
+ASYNC_APP_FW_LOOP on import. The process runs the master handler and a
+sink app observing EventCmdServiceReadStdRes, then synthetic agents
+connect to the master, reply to its hello and stream the message, each
+with at most a window of messages not dispatched to the sink yet. The
+message carries the time it was sent, dispatch latency is the time until
+the handler of the sink gets it.
+
+    python test/async_hub_loop_bench.py [agents] [messages per agent] [message size]
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+from async_app_fw.lib import hub
+
+DEFAULT_AGENTS = 8
+DEFAULT_MSG_COUNT = 20000
+DEFAULT_MSG_SIZE = 256
+# messages of an agent sent and not dispatched yet.
+WINDOW = 32
+PORT = 7930
+# children run this file as a script, async_app_fw is imported from here.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_child(agents, count, size):
+    from async_app_fw.base.app_manager import AppManager, BaseApp
+    from async_app_fw.controller.handler import observe_event
+    from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+    from async_app_fw.event.mcp_event import mcp_event
+    from async_app_fw.lib.histogram import Histogram
+    from async_app_fw.lib.hub import app_hub
+    from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+    received = [0] * agents
+    wakeup = [asyncio.Event() for _ in range(agents)]
+    latency = Histogram(scale=1e6)
+    done = asyncio.Event()
+    total = agents * count
+
+    class BenchSink(BaseApp):
+        def __init__(self, *_args, **_kwargs):
+            super().__init__(*_args, **_kwargs)
+            self.name = 'bench_sink'
+            self.dispatched = 0
+
+        @observe_event(mcp_event.EventCmdServiceReadStdRes)
+        def read_std_res_handler(self, ev):
+            msg = ev.msg
+            latency.record(time.perf_counter() - float(msg.output[:24]))
+            received[msg.cmd_id] += 1
+            wakeup[msg.cmd_id].set()
+            self.dispatched += 1
+            if self.dispatched == total:
+                done.set()
+
+    class BenchAgent(MachineConnection):
+        def __init__(self, reader, writer):
+            super().__init__(reader, writer, mcp_brick_name='bench_agent', capability=Capability())
+            self.stable = asyncio.Event()
+
+        def _dispatch_msg(self, msg):
+            if msg.__class__.__name__ == 'MCPHello':
+                self.id = msg.connection_id
+                self.set_peer_capability(msg.get_capability())
+                self.send_msg_nowait(self.mcproto_parser.MCPHello(self, self.id, self.local_capability))
+                self.stable.set()
+
+    async def agent(index, padding):
+        conn = BenchAgent(*await asyncio.open_connection('127.0.0.1', PORT))
+        conn.serve()
+        await conn.stable.wait()
+        await start.wait()
+        parser = conn.mcproto_parser
+        for sent in range(count):
+            while sent - received[index] >= WINDOW:
+                wakeup[index].clear()
+                await wakeup[index].wait()
+            conn.send_msg_nowait(parser.CmdServiceReadStdRes(conn, index, f'{time.perf_counter():<24.9f}' + padding))
+        await done.wait()
+        await conn.stop_serve()
+
+    async def main():
+        mgr = AppManager.get_instance()
+        mgr.load_apps(['async_app_fw.controller.mcp_controller.master_handler'])
+        mgr.instantiate_apps(**mgr.create_contexts())
+        sink = mgr.instantiate(BenchSink)
+        sink.start()
+        await asyncio.sleep(0.1)
+
+        padding = 'x' * max(size - 24, 0)
+        tasks = [app_hub.spawn(agent, index, padding) for index in range(agents)]
+        # every agent is connected before the clock starts.
+        await asyncio.sleep(0.5)
+        cpu = time.process_time()
+        begin = time.perf_counter()
+        start.set()
+        await done.wait()
+        elapsed = time.perf_counter() - begin
+        cpu = time.process_time() - cpu
+        await asyncio.gather(*tasks)
+
+        print(f'{type(app_hub.loop).__module__.split(".")[0]:>8}: {total / elapsed:,.0f} msg/s, '
+              f'cpu {cpu:.2f} s, dispatch latency p50 {latency.percentile(50) * 1e3:.2f} ms, '
+              f'p99 {latency.percentile(99) * 1e3:.2f} ms, max {latency.max * 1e3:.2f} ms')
+        await mgr.close()
+
+    start = asyncio.Event()
+    app_hub.joinall([app_hub.spawn(main)])
+
+
+if __name__ == '__main__':
+    if os.environ.get('BENCH_CHILD'):
+        run_child(*map(int, sys.argv[1:4]))
+        sys.exit()
+
+    agents = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_AGENTS
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_MSG_COUNT
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_MSG_SIZE
+    print(f'{agents} agents, {count} messages of {size} bytes each, window {WINDOW}.')
+    loops = [hub.LOOP_ASYNCIO]
+    if hub.uvloop is not None:
+        loops.append(hub.LOOP_UVLOOP)
+    else:
+        print('uvloop is not installed, only the default loop is run.')
+    for loop in loops:
+        path = os.environ.get('PYTHONPATH')
+        env = dict(os.environ, BENCH_CHILD='1', PYTHONPATH=ROOT if not path else os.pathsep.join((ROOT, path)),
+                   **{hub.LOOP_ENV: loop})
+        subprocess.run([sys.executable, __file__, str(agents), str(count), str(size)], env=env, check=True)
@@ -0,0 +1,154 @@
+"""
+Benchmark of the master with agent connections sharded across loops.
+
+For each shard count a master process runs the master handler with
+MCPMasterHandler.shards set, and a sink app observing
+EventCmdServiceReadStdRes. An agent process then connects many synthetic
+agents which reply to the hello of master and stream the message. The
+master prints the rate the sink dispatched them at, and how many
+connections, handoffs and wake-ups each shard had.
+
+In CPython the loops of the shards share the GIL, connections spread
+across them mostly trade throughput for shorter loop latency on one core,
+see the number of cores the machine has before reading the results.
+
+    python test/async_hub_shard_bench.py [agents] [messages per agent] [message size]
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+DEFAULT_AGENTS = 200
+DEFAULT_MSG_COUNT = 500
+DEFAULT_MSG_SIZE = 256
+DEFAULT_SHARDS = (1, 2, 4)
+# port master listens to.
+PORT = 7930
+# children run this file as a script, async_app_fw is imported from here.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child_env(role):
+    path = os.environ.get('PYTHONPATH')
+    return dict(os.environ, BENCH_CHILD=role, PYTHONPATH=ROOT if not path else os.pathsep.join((ROOT, path)))
+
+
+def run_master(shards, agents, count):
+    from async_app_fw.base.app_manager import AppManager, BaseApp
+    from async_app_fw.controller.handler import observe_event
+    from async_app_fw.controller.mcp_controller import master_handler
+    from async_app_fw.event.mcp_event import mcp_event
+    from async_app_fw.lib.hub import app_hub
+
+    total = agents * count
+    done = asyncio.Event()
+
+    # instantiate_apps starts the master handler as soon as it is created.
+    master_handler.DEFAULT_SHARDS = shards
+
+    class BenchSink(BaseApp):
+        def __init__(self, *_args, **_kwargs):
+            super().__init__(*_args, **_kwargs)
+            self.name = 'bench_sink'
+            self.dispatched = 0
+            self.begin = None
+
+        @observe_event(mcp_event.EventCmdServiceReadStdRes)
+        def read_std_res_handler(self, ev):
+            if self.begin is None:
+                self.begin = time.perf_counter()
+            self.dispatched += 1
+            if self.dispatched == total:
+                done.set()
+
+    async def main():
+        mgr = AppManager.get_instance()
+        mgr.load_apps(['async_app_fw.controller.mcp_controller.master_handler'])
+        mgr.instantiate_apps(**mgr.create_contexts())
+        sink = mgr.instantiate(BenchSink)
+        sink.start()
+        await asyncio.sleep(0.2)
+        print('ready', flush=True)
+
+        cpu = time.process_time()
+        await done.wait()
+        elapsed = time.perf_counter() - sink.begin
+        cpu = time.process_time() - cpu
+        stats = ', '.join(f'#{shard.index} {shard.connections} conn {shard.handoffs} handoffs '
+                          f'{shard.wakeups} wake-ups' for shard in app_hub.shards)
+        print(f'{shards} shards: {total / elapsed:,.0f} msg/s, cpu {cpu:.2f} s'
+              + (f'\n          {stats}' if stats else ''), flush=True)
+        await mgr.close()
+
+    app_hub.joinall([app_hub.spawn(main)])
+
+
+def run_agents(agents, count, size):
+    from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+    from async_app_fw.lib.hub import app_hub
+    from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+    class BenchAgent(MachineConnection):
+        def __init__(self, reader, writer):
+            super().__init__(reader, writer, mcp_brick_name='bench_agent', capability=Capability())
+            self.stable = asyncio.Event()
+
+        def _dispatch_msg(self, msg):
+            if msg.__class__.__name__ == 'MCPHello':
+                self.id = msg.connection_id
+                self.set_peer_capability(msg.get_capability())
+                self.send_msg_nowait(self.mcproto_parser.MCPHello(self, self.id, self.local_capability))
+                self.stable.set()
+
+    async def agent(index, output, start):
+        conn = BenchAgent(*await asyncio.open_connection('127.0.0.1', PORT))
+        conn.serve()
+        await conn.stable.wait()
+        await start.wait()
+        parser = conn.mcproto_parser
+        for _ in range(count):
+            await conn.send_msg(parser.CmdServiceReadStdRes(conn, index & 0xffff, output))
+        return conn
+
+    async def main():
+        start = asyncio.Event()
+        output = 'x' * size
+        tasks = [app_hub.spawn(agent, index, output, start) for index in range(agents)]
+        # every agent is connected before they stream.
+        await asyncio.sleep(1)
+        start.set()
+        conns = await asyncio.gather(*tasks)
+        # master closes the connections when it is done.
+        await asyncio.sleep(2)
+        for conn in conns:
+            await conn.stop_serve()
+
+    app_hub.joinall([app_hub.spawn(main)])
+
+
+if __name__ == '__main__':
+    role = os.environ.get('BENCH_CHILD')
+    if role == 'master':
+        run_master(*map(int, sys.argv[1:4]))
+        sys.exit()
+    if role == 'agents':
+        run_agents(*map(int, sys.argv[1:4]))
+        sys.exit()
+
+    agents = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_AGENTS
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_MSG_COUNT
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_MSG_SIZE
+    print(f'{agents} agents, {count} messages of {size} bytes each, {os.cpu_count()} cores.')
+    for shards in DEFAULT_SHARDS:
+        master = subprocess.Popen([sys.executable, __file__, str(shards), str(agents), str(count)],
+                                  env=child_env('master'),
+                                  stdout=subprocess.PIPE, text=True)
+        if master.stdout.readline().strip() != 'ready':
+            master.kill()
+            sys.exit('master did not start')
+        subprocess.run([sys.executable, __file__, str(agents), str(count), str(size)],
+                       env=child_env('agents'), check=True)
+        sys.stdout.write(master.stdout.read())
+        master.wait()
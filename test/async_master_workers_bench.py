@@ -0,0 +1,158 @@
+"""
+Benchmark of the master served by worker processes sharing its port.
+
+For each worker count a master is run by run_master_workers, with the
+master handler and the WorkerBench app below in every worker. An agent
+process then connects synthetic agents, each from its own loopback
+address since agents are known by their ip. Worker 0 waits until every
+agent is connected to some worker and prints how long it took and how
+the agents are spread, then sends ReqWhichWorker to each agent by
+ReqForwardRequest, which is forwarded by the coordinator to the worker
+the agent is connected to, and prints the latency of these requests.
+
+    python test/async_master_workers_bench.py [agents]
+"""
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from async_app_fw.base.app_manager import BaseApp, lookup_service_brick
+from async_app_fw.controller.handler import observe_event
+from async_app_fw.controller.mcp_controller.master_lib.constant import APP_NAME as MASTER_APP_NAME
+from async_app_fw.controller.mcp_controller.master_lib.event import ReqForwardRequest, ReqWaitAgentsConnect
+from async_app_fw.controller.mcp_controller.master_worker import current_worker
+from async_app_fw.event.async_event import EventAsyncRequestBase
+from async_app_fw.lib.histogram import Histogram
+from async_app_fw.lib.hub import app_hub
+
+DEFAULT_AGENTS = 1000
+DEFAULT_WORKERS = (1, 2, 4)
+# port master listens to.
+PORT = 7930
+BENCH_APP_NAME = 'worker_bench'
+
+
+def agent_address(index):
+    return f'127.0.{1 + index // 250}.{1 + index % 250}'
+
+
+class ReqWhichWorker(EventAsyncRequestBase):
+    REQUEST_NAME = 'Worker bench, worker of agent.'
+    DST_NAME = BENCH_APP_NAME
+
+    def __init__(self, agent, timeout=None):
+        super().__init__(timeout)
+        self.agent = agent
+
+
+class WorkerBench(BaseApp):
+    _EVENTS = [ReqWhichWorker]
+
+    def __init__(self, *_args, **_kwargs):
+        super().__init__(*_args, **_kwargs)
+        self.name = BENCH_APP_NAME
+        self.worker = current_worker()
+
+    def start(self):
+        task = super().start()
+        if self.worker is not None and self.worker.index == 0:
+            app_hub.spawn(self.run, int(os.environ['BENCH_AGENTS']))
+        return task
+
+    @observe_event(ReqWhichWorker)
+    def which_worker_handler(self, ev):
+        conn = lookup_service_brick(MASTER_APP_NAME).ip_to_connection.get(ev.agent)
+        ev.push_reply((self.worker.index, conn.id if conn is not None else None))
+
+    async def run(self, agents):
+        agents = [agent_address(index) for index in range(agents)]
+        # counted from the first agent connected to some worker.
+        master = lookup_service_brick(MASTER_APP_NAME)
+        while not any(master.is_agent_connected(agent, any_worker=True) for agent in agents):
+            await asyncio.sleep(0.01)
+        begin = time.perf_counter()
+        await ReqWaitAgentsConnect.send_request(agents, wait_connection_timeout=120, any_worker=True)
+        connected = time.perf_counter() - begin
+
+        latency = Histogram(scale=1e6)
+        workers = Counter()
+        ids = set()
+        for agent in agents:
+            start = time.perf_counter()
+            reply = await ReqForwardRequest.send_request(agent, ReqWhichWorker, (agent,), timeout=5)
+            latency.record(time.perf_counter() - start)
+            # None if the request failed, the agent is not connected.
+            index, conn_id = reply or (None, None)
+            workers[index] += 1
+            ids.add(conn_id)
+
+        missing = workers.pop(None, 0)
+        spread = ', '.join(f'#{index} {count}' for index, count in sorted(workers.items()))
+        print(f'{self.worker.count} workers: {len(agents)} agents connected in {connected:.2f} s, '
+              f'{spread}, {len(ids - {None})} distinct ids, {missing} missing\n'
+              f'           forwarded request p50 {latency.percentile(50) * 1e3:.2f} ms, '
+              f'p99 {latency.percentile(99) * 1e3:.2f} ms', flush=True)
+
+
+def run_master(workers):
+    from async_app_fw.controller.mcp_controller.master_worker import run_master_workers
+
+    run_master_workers(['async_app_fw.controller.mcp_controller.master_handler',
+                        'test.async_master_workers_bench'], workers=workers)
+
+
+def run_agents(agents):
+    from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+    from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+    class BenchAgent(MachineConnection):
+        def __init__(self, reader, writer):
+            super().__init__(reader, writer, mcp_brick_name='bench_agent', capability=Capability())
+
+        def _dispatch_msg(self, msg):
+            if msg.__class__.__name__ == 'MCPHello':
+                self.id = msg.connection_id
+                self.set_peer_capability(msg.get_capability())
+                self.send_msg_nowait(self.mcproto_parser.MCPHello(self, self.id, self.local_capability))
+
+    async def agent(index):
+        conn = BenchAgent(*await asyncio.open_connection('127.0.0.1', PORT,
+                                                         local_addr=(agent_address(index), 0)))
+        await conn.serve()
+
+    async def main():
+        await asyncio.gather(*(app_hub.spawn(agent, index) for index in range(agents)))
+
+    app_hub.joinall([app_hub.spawn(main)])
+
+
+if __name__ == '__main__':
+    role = os.environ.get('BENCH_CHILD')
+    if role == 'master':
+        run_master(int(sys.argv[1]))
+        sys.exit()
+    if role == 'agents':
+        run_agents(int(sys.argv[1]))
+        sys.exit()
+
+    agents = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_AGENTS
+    print(f'{agents} agents, {os.cpu_count()} cores.')
+    for workers in DEFAULT_WORKERS:
+        # workers are children of the master process, stopped with its group.
+        master = subprocess.Popen([sys.executable, '-m', 'test.async_master_workers_bench', str(workers)],
+                                  env=dict(os.environ, BENCH_CHILD='master', BENCH_AGENTS=str(agents)),
+                                  stdout=subprocess.PIPE, text=True, start_new_session=True)
+        time.sleep(1 + workers * 0.5)
+        agent_proc = subprocess.Popen([sys.executable, '-m', 'test.async_master_workers_bench', str(agents)],
+                                      env=dict(os.environ, BENCH_CHILD='agents'), start_new_session=True)
+        try:
+            for _ in range(2):
+                sys.stdout.write(master.stdout.readline())
+        finally:
+            for proc in (agent_proc, master):
+                os.killpg(proc.pid, signal.SIGTERM)
+                proc.wait()
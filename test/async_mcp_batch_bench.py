@@ -0,0 +1,89 @@
+"""
+Loopback benchmark of MCP send path with and without MCPBatch coalescing.
+Prints how many writes the send loop made, see MachineConnection.flush_frames.
+
+A MachineConnection sends CaptureServiceSendPKT messages with send_msg to
+another MachineConnection over loopback.
+
+    python test/async_mcp_batch_bench.py [message count]
+"""
+import asyncio
+import sys
+import time
+
+from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
+from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+DEFAULT_MSG_COUNT = 20000
+PKT = {'layers': ['eth', 'ip', 'udp'], 'length': 128, 'payload': 'x' * 64}
+
+
+class BenchConnection(MachineConnection):
+    def __init__(self, reader, writer, capability, expect=0, done=None):
+        super().__init__(reader, writer, mcp_brick_name='mcp_bench', capability=capability)
+        self.expect = expect
+        self.done = done
+        self.count = 0
+        self.batches = 0
+
+    def _recv_frame(self, frame):
+        if frame[1] == mcproto.MCP_BATCH:
+            self.batches += 1
+        return super()._recv_frame(frame)
+
+    def _dispatch_msg(self, msg):
+        self.count += 1
+        if self.count == self.expect:
+            self.done.set()
+
+
+async def run(capability, count):
+    done = asyncio.Event()
+    receivers = []
+
+    async def handle(reader, writer):
+        conn = BenchConnection(reader, writer, capability, count, done)
+        conn.set_peer_capability(capability)
+        receivers.append(conn)
+        await conn.serve()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    sender = BenchConnection(reader, writer, capability)
+    sender.set_peer_capability(capability)
+    sender.serve()
+
+    start = time.perf_counter()
+    for i in range(count):
+        sender.send_msg(sender.mcproto_parser.CaptureServiceSendPKT(sender, i & 0xffff, PKT))
+        if i % 500 == 0:
+            await asyncio.sleep(0)
+    await done.wait()
+    elapsed = time.perf_counter() - start
+
+    batches = receivers[0].batches
+    flush_frames = sender.flush_frames
+    await sender.stop_serve()
+    for conn in receivers:
+        await conn.stop_serve()
+    server.close()
+    await server.wait_closed()
+
+    return elapsed, batches, flush_frames
+
+
+async def main(count):
+    for name, capability in (('no batch', Capability(features=0)),
+                             ('batch', Capability(features=mcproto.MCP_CAP_BATCH))):
+        elapsed, batches, flush_frames = await run(capability, count)
+        print(f'{name:>10}: {elapsed:.3f} sec, {count / elapsed:,.0f} msg/s, {batches} batch frames, '
+              f'{flush_frames.count} flushes of {flush_frames.mean:.1f} frames')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MSG_COUNT
+    task = app_hub.spawn(main, count)
+    app_hub.joinall([task])
@@ -0,0 +1,94 @@
+"""
+Loopback benchmark of MCP per-frame compression.
+
+A MachineConnection sends CmdServiceReadStdRes with command output to
+another MachineConnection over loopback, with compression off, zlib and
+lzma. Prints throughput, compression ratio and CPU time counters.
+
+    python test/async_mcp_compression_bench.py [message count] [threshold]
+"""
+import asyncio
+import sys
+import time
+
+from async_app_fw.controller.mcp_controller.mcp_controller import \
+    MachineConnection, DEFAULT_COMPRESSION_THRESHOLD
+from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
+from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+DEFAULT_MSG_COUNT = 2000
+OUTPUT = ''.join(f'eth{i % 8}      Link encap:Ethernet  HWaddr 00:08:9b:{i % 256:02x}:aa:{i % 7:02x}\n'
+                 f'          RX packets:{i * 1031} errors:0 dropped:0 overruns:0 frame:0\n'
+                 for i in range(64))
+
+
+class BenchConnection(MachineConnection):
+    def __init__(self, reader, writer, capability, expect=0, done=None):
+        super().__init__(reader, writer, mcp_brick_name='mcp_bench', capability=capability)
+        self.expect = expect
+        self.done = done
+        self.count = 0
+
+    def _dispatch_msg(self, msg):
+        assert msg.output == OUTPUT
+        self.count += 1
+        if self.count == self.expect:
+            self.done.set()
+
+
+async def run(capability, count, threshold):
+    done = asyncio.Event()
+    receivers = []
+
+    async def handle(reader, writer):
+        conn = BenchConnection(reader, writer, capability, count, done)
+        conn.set_peer_capability(capability)
+        receivers.append(conn)
+        await conn.serve()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    sender = BenchConnection(reader, writer, capability)
+    sender.set_peer_capability(capability)
+    sender.compression_threshold = threshold
+    sender.serve()
+
+    start = time.perf_counter()
+    for i in range(count):
+        sender.send_msg(sender.mcproto_parser.CmdServiceReadStdRes(sender, i & 0xffff, OUTPUT))
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    await done.wait()
+    elapsed = time.perf_counter() - start
+
+    stats = (sender.compression_stats, receivers[0].compression_stats)
+    await sender.stop_serve()
+    for conn in receivers:
+        await conn.stop_serve()
+    server.close()
+    await server.wait_closed()
+
+    return elapsed, stats
+
+
+async def main(count, threshold):
+    print(f'{count} messages of {len(OUTPUT)} bytes output, threshold {threshold} bytes.')
+    cases = (
+        ('off', Capability(features=0)),
+        ('zlib', Capability(features=mcproto.MCP_CAP_COMPRESSION, compression=mcproto.MCP_COMPRESSION_ZLIB)),
+        ('lzma', Capability(features=mcproto.MCP_CAP_COMPRESSION, compression=mcproto.MCP_COMPRESSION_LZMA)),
+    )
+    for name, capability in cases:
+        elapsed, (send_stats, recv_stats) = await run(capability, count, threshold)
+        print(f'{name:>5}: {elapsed:.3f} sec, {count / elapsed:,.0f} msg/s, ratio {send_stats.ratio:.3f}, '
+              f'compress cpu {send_stats.compress_cpu_time:.3f} sec, '
+              f'decompress cpu {recv_stats.decompress_cpu_time:.3f} sec')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MSG_COUNT
+    threshold = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_COMPRESSION_THRESHOLD
+    task = app_hub.spawn(main, count, threshold)
+    app_hub.joinall([task])
@@ -0,0 +1,141 @@
+"""
+Loopback benchmark of credit based flow control of captured packets.
+
+An agent side MachineConnection produces CaptureServiceSendPKT faster
+than the master side consumes them from a queue of the capture size, the
+way FakeCapture does. Without credit every packet is sent and the master
+drops the oldest ones when its queue is full; with credit the agent only
+sends what was granted and drops the rest at the source.
+
+    python test/async_mcp_credit_bench.py [seconds] [produced pkt/s] [consumed pkt/s]
+"""
+import asyncio
+import sys
+import time
+
+from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+from async_app_fw.lib.credit import CREDIT_BUFFER, CreditGranter, CreditWindow
+from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+DEFAULT_SECONDS = 3
+DEFAULT_PRODUCE_RATE = 40000
+DEFAULT_CONSUME_RATE = 10000
+CAPTURE_SIZE = 1000
+CAPTURE_ID = 1
+TICK = 0.005
+PKT = {'sniff_time': 1700000000.123456, 'length': 98, 'layers': ['eth', 'ip', 'icmp']}
+
+
+class BenchConnection(MachineConnection):
+    def __init__(self, reader, writer):
+        super().__init__(reader, writer, mcp_brick_name='mcp_bench', capability=Capability())
+        self.packets = asyncio.Queue(CAPTURE_SIZE)
+        self.received = 0
+        self.master_dropped = 0
+        self.agent_dropped = 0
+        # master: CreditGranter, agent: CreditWindow
+        self.credit = None
+
+    def _dispatch_msg(self, msg):
+        parser = self.mcproto_parser
+        if isinstance(msg, parser.CaptureServiceSendPKT):
+            self.received += 1
+            if self.packets.full():
+                self.packets.get_nowait()
+                self.master_dropped += 1
+                if self.credit is not None:
+                    self.credit.consumed()
+            self.packets.put_nowait(msg.pkt)
+        elif isinstance(msg, parser.CaptureServiceGrantCredit):
+            self.credit.grant(msg.credits)
+        elif isinstance(msg, parser.CaptureServiceDropReport):
+            self.agent_dropped = msg.dropped
+
+
+async def run(credit, seconds, produce_rate, consume_rate):
+    masters = []
+
+    async def handle(reader, writer):
+        conn = BenchConnection(reader, writer)
+        conn.set_peer_capability(Capability())
+        masters.append(conn)
+        await conn.serve()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    agent = BenchConnection(reader, writer)
+    agent.set_peer_capability(Capability())
+    agent.serve()
+    await asyncio.sleep(0.05)
+    master = masters[0]
+    parser = agent.mcproto_parser
+
+    def send_packet(pkt):
+        agent.send_msg_nowait(parser.CaptureServiceSendPKT(agent, CAPTURE_ID, pkt))
+
+    push = send_packet
+    if credit:
+        agent.credit = window = CreditWindow(send_packet, CREDIT_BUFFER, CAPTURE_SIZE)
+        push = window.push
+
+        def grant(credits):
+            master.send_msg_nowait(parser.CaptureServiceGrantCredit(master, CAPTURE_ID, credits))
+            if window.dropped:
+                # reported the way the agent handler does, after each grant.
+                agent.send_msg_nowait(parser.CaptureServiceDropReport(agent, CAPTURE_ID, window.dropped))
+
+        master.credit = CreditGranter(grant, CAPTURE_SIZE)
+        master.credit.open()
+
+    deadline = time.perf_counter() + seconds
+
+    async def produce():
+        while time.perf_counter() < deadline:
+            for _ in range(int(produce_rate * TICK)):
+                push(PKT)
+            await asyncio.sleep(TICK)
+
+    consumed = 0
+
+    async def consume():
+        nonlocal consumed
+        while time.perf_counter() < deadline:
+            for _ in range(int(consume_rate * TICK)):
+                if master.packets.empty():
+                    break
+                master.packets.get_nowait()
+                consumed += 1
+                if master.credit is not None:
+                    master.credit.consumed()
+            await asyncio.sleep(TICK)
+
+    cpu = time.process_time()
+    await asyncio.gather(app_hub.spawn(produce), app_hub.spawn(consume))
+    await asyncio.sleep(0.2)
+    cpu = time.process_time() - cpu
+
+    await agent.stop_serve()
+    for conn in masters:
+        await conn.stop_serve()
+    server.close()
+    await server.wait_closed()
+
+    return master.received, master.master_dropped, master.agent_dropped, consumed, cpu
+
+
+async def main(seconds, produce_rate, consume_rate):
+    print(f'{produce_rate} pkt/s produced, {consume_rate} pkt/s consumed, capture size {CAPTURE_SIZE}.')
+    for name, credit in (('no credit', False), ('credit', True)):
+        sent, master_dropped, agent_dropped, consumed, cpu = await run(credit, seconds, produce_rate, consume_rate)
+        print(f'{name:>9}: {sent} sent, {master_dropped} dropped by master, {agent_dropped} dropped by agent, '
+              f'{consumed} consumed, cpu {cpu:.2f} s')
+
+
+if __name__ == '__main__':
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SECONDS
+    produce_rate = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PRODUCE_RATE
+    consume_rate = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_CONSUME_RATE
+    task = app_hub.spawn(main, seconds, produce_rate, consume_rate)
+    app_hub.joinall([task])
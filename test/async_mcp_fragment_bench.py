@@ -0,0 +1,108 @@
+"""
+Loopback benchmark of control message latency during a bulk transfer.
+
+A MachineConnection sends a few large CmdServiceReadStdRes while a small
+CaptureServiceSetEvent is sent every millisecond, with and without
+fragmentation. Prints latency of the small messages and bulk throughput.
+
+    python test/async_mcp_fragment_bench.py [bulk message MiB] [bulk message count]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
+from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+DEFAULT_BULK_MIB = 16
+DEFAULT_BULK_COUNT = 4
+CONTROL_INTERVAL = 0.001
+
+
+class BenchConnection(MachineConnection):
+    def __init__(self, reader, writer, capability, done=None, bulk_count=0, sent=None):
+        super().__init__(reader, writer, mcp_brick_name='mcp_bench', capability=capability)
+        self.done = done
+        # capture_id of control message: time sent
+        self.sent = sent
+        self.bulk_count = bulk_count
+        self.bulk_received = 0
+        self.latencies = []
+
+    def _dispatch_msg(self, msg):
+        if isinstance(msg, self.mcproto_parser.CaptureServiceSetEvent):
+            self.latencies.append(time.perf_counter() - self.sent.pop(msg.capture_id))
+            return
+
+        self.bulk_received += 1
+        if self.bulk_received == self.bulk_count:
+            self.done.set()
+
+
+async def run(capability, output, bulk_count):
+    done = asyncio.Event()
+    sent = {}
+    receivers = []
+
+    async def handle(reader, writer):
+        conn = BenchConnection(reader, writer, capability, done, bulk_count, sent)
+        conn.set_peer_capability(capability)
+        receivers.append(conn)
+        await conn.serve()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    sender = BenchConnection(reader, writer, capability)
+    sender.set_peer_capability(capability)
+    sender.serve()
+
+    async def control():
+        capture_id = 0
+        while not done.is_set():
+            capture_id = (capture_id + 1) & 0xffff
+            sent[capture_id] = time.perf_counter()
+            sender.send_msg(sender.mcproto_parser.CaptureServiceSetEvent(sender, capture_id, 0))
+            await asyncio.sleep(CONTROL_INTERVAL)
+
+    control_task = app_hub.spawn(control)
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    for i in range(bulk_count):
+        sender.send_msg(sender.mcproto_parser.CmdServiceReadStdRes(sender, i, output))
+    await done.wait()
+    elapsed = time.perf_counter() - start
+
+    await control_task
+    latencies = receivers[0].latencies
+    await sender.stop_serve()
+    for conn in receivers:
+        await conn.stop_serve()
+    server.close()
+    await server.wait_closed()
+
+    return elapsed, latencies
+
+
+async def main(bulk_mib, bulk_count):
+    output = 'x' * (bulk_mib * 1024 * 1024)
+    print(f'{bulk_count} bulk messages of {bulk_mib} MiB, control message every {CONTROL_INTERVAL * 1000:.0f} ms.')
+    for name, capability in (('single', Capability(features=0)),
+                             ('fragment', Capability(features=mcproto.MCP_CAP_FRAGMENT))):
+        elapsed, latencies = await run(capability, output, bulk_count)
+        latencies = sorted(latencies)
+        p99 = latencies[int(len(latencies) * 0.99)]
+        print(f'{name:>9}: bulk {bulk_mib * bulk_count / elapsed:,.1f} MiB/s, control latency '
+              f'median {statistics.median(latencies) * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms, '
+              f'max {latencies[-1] * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    bulk_mib = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BULK_MIB
+    bulk_count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BULK_COUNT
+    task = app_hub.spawn(main, bulk_mib, bulk_count)
+    app_hub.joinall([task])
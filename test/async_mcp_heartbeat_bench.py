@@ -0,0 +1,103 @@
+"""
+Loopback benchmark of heartbeats.
+
+An agent side and a master side MachineConnection exchange heartbeats
+every interval for a while, the round trip times recorded by both are
+printed, with and without CmdServiceReadStdRes streamed by the agent.
+Then a request is registered as waiting for the agent, the agent stops
+reading its socket, and the time master takes to declare it dead and to
+fail the request is measured.
+
+    python test/async_mcp_heartbeat_bench.py [interval] [max missed]
+"""
+import asyncio
+import sys
+import time
+
+from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+from async_app_fw.event.async_event import EventAsyncRequestBase, REQ_WAIT_REPLY
+from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+DEFAULT_INTERVAL = 0.05
+DEFAULT_MAX_MISSED = 3
+DEFAULT_DURATION = 2
+
+
+class BenchConnection(MachineConnection):
+    def __init__(self, reader, writer, interval, max_missed):
+        super().__init__(reader, writer, mcp_brick_name='mcp_bench', capability=Capability())
+        self.heartbeat_interval = interval
+        self.heartbeat_max_missed = max_missed
+        self.set_peer_capability(Capability())
+
+    def _dispatch_msg(self, msg):
+        pass
+
+
+class ReqBench(EventAsyncRequestBase):
+    REQUEST_NAME = 'Heartbeat bench'
+
+
+def rtt_line(name, conn):
+    rtt = conn.rtt
+    return (f'{name:>14}: {rtt.count} heartbeats, rtt mean {rtt.mean * 1e6:.0f} us, '
+            f'p50 {rtt.percentile(50) * 1e6:.0f} us, p99 {rtt.percentile(99) * 1e6:.0f} us')
+
+
+async def main(interval, max_missed):
+    masters = []
+
+    async def handle(reader, writer):
+        conn = BenchConnection(reader, writer, interval, max_missed)
+        masters.append(conn)
+        await conn.serve()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    agent = BenchConnection(*await asyncio.open_connection('127.0.0.1', port), interval, max_missed)
+    agent.serve()
+    await asyncio.sleep(0.05)
+    master = masters[0]
+
+    print(f'heartbeat every {interval} sec, peer dead after {max_missed} missed.')
+    await asyncio.sleep(DEFAULT_DURATION)
+    print(rtt_line('idle master', master))
+    print(rtt_line('idle agent', agent))
+
+    master.rtt.reset()
+    agent.rtt.reset()
+    output = 'x' * 1024
+    parser = agent.mcproto_parser
+    end = time.monotonic() + DEFAULT_DURATION
+    sent = 0
+    while time.monotonic() < end:
+        agent.send_msg_nowait(parser.CmdServiceReadStdRes(agent, sent & 0xffff, output))
+        sent += 1
+        if sent % 50 == 0:
+            await asyncio.sleep(0)
+    print(rtt_line('loaded master', master))
+    print(f'{"":>14}  while {sent / DEFAULT_DURATION:,.0f} msg/s were streamed to it.')
+    await asyncio.sleep(interval * 2)
+
+    req = ReqBench()
+    req.update_state(REQ_WAIT_REPLY)
+    master.add_pending_request(master.set_xid(parser.MCPHeartbeat(master)), req)
+    agent.writer.transport.pause_reading()
+    start = time.perf_counter()
+    reply = await asyncio.wait_for(req.reply_q.get(), timeout=interval * (max_missed + 2) + 1)
+    detected = time.perf_counter() - start
+    print(f'agent stopped reading, its request failed after {detected * 1000:.0f} ms '
+          f'(at most {interval * (max_missed + 1) * 1000:.0f} ms): {reply!r}')
+
+    for conn in (agent, master):
+        await conn.stop_serve()
+    server.close()
+    await server.wait_closed()
+
+
+if __name__ == '__main__':
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_INTERVAL
+    max_missed = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_MAX_MISSED
+    task = app_hub.spawn(main, interval, max_missed)
+    app_hub.joinall([task])
@@ -0,0 +1,137 @@
+"""
+Loopback benchmark of resumable sessions.
+
+An agent side MachineConnection sends CmdServiceReadStdRes to a master
+side one, first without a session, then with a session, which keeps every
+message until the master acknowledges it. Then the connection of the agent
+is aborted half way through the messages, the agent reconnects at once
+and resumes the session, and every message is checked to arrive once and
+in order.
+
+    python test/async_mcp_resume_bench.py [message count] [message size]
+"""
+import asyncio
+import sys
+import time
+
+from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+from async_app_fw.controller.mcp_controller.mcp_session import SessionTable
+from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+DEFAULT_MSG_COUNT = 50000
+DEFAULT_MSG_SIZE = 256
+
+
+class BenchConnection(MachineConnection):
+    def __init__(self, reader, writer, sessions=None, received=None):
+        super().__init__(reader, writer, mcp_brick_name='mcp_bench', capability=Capability())
+        self.sessions = sessions
+        self.received = received
+        self.resumed = asyncio.Event()
+        self.set_peer_capability(Capability())
+
+    def _session_resumed(self, msg):
+        super()._session_resumed(msg)
+        self.resumed.set()
+
+    def _dispatch_msg(self, msg):
+        if self.received is not None and hasattr(msg, 'cmd_id'):
+            self.received.append(msg.cmd_id)
+
+
+async def run(count, output, session, flap):
+    agent_sessions = SessionTable() if session else None
+    master_sessions = SessionTable() if session else None
+    received = []
+    masters = []
+    done = asyncio.Event()
+
+    async def handle(reader, writer):
+        conn = BenchConnection(reader, writer, master_sessions, received)
+        masters.append(conn)
+        serve_task = conn.serve()
+        try:
+            await serve_task
+        finally:
+            conn.suspend()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def connect():
+        conn = BenchConnection(*await asyncio.open_connection('127.0.0.1', port), agent_sessions)
+        conn.serve()
+        return conn
+
+    agent = await connect()
+    await asyncio.sleep(0.05)
+    if session:
+        masters[0].open_session()
+        await asyncio.sleep(0.05)
+
+    async def watch():
+        while len(received) < count:
+            await asyncio.sleep(0.001)
+        done.set()
+
+    watcher = app_hub.spawn(watch)
+    parser = agent.mcproto_parser
+    resume_time = None
+    start = time.perf_counter()
+    cpu = time.process_time()
+    for i in range(count):
+        # cmd_id numbers the messages, wrapped by its 16 bits.
+        agent.send_msg_nowait(parser.CmdServiceReadStdRes(agent, i & 0xffff, output))
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+        if flap and i == count // 2:
+            agent.writer.transport.abort()
+            await agent.stop_serve()
+            agent.suspend()
+            resume_start = time.perf_counter()
+            new_agent = await connect()
+            new_agent.resume_session()
+            await new_agent.resumed.wait()
+            resume_time = time.perf_counter() - resume_start
+            if new_agent.session is None:
+                # master missed more than the retransmit buffer kept.
+                break
+
+    if flap and new_agent.session is None:
+        resume_time = None
+    else:
+        await done.wait()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    in_order = received == [i & 0xffff for i in range(count)]
+
+    watcher.cancel()
+    for conn in [agent.latest()] + masters:
+        await conn.stop_serve()
+    server.close()
+    await server.wait_closed()
+
+    return elapsed, cpu, in_order, resume_time
+
+
+async def main(count, size):
+    output = 'x' * size
+    print(f'{count} messages of {size} bytes.')
+    for name, session, flap in (('no session', False, False),
+                                ('session', True, False),
+                                ('flap', True, True)):
+        elapsed, cpu, in_order, resume_time = await run(count, output, session, flap)
+        line = (f'{name:>10}: {elapsed:.3f} sec, {count / elapsed:,.0f} msg/s, cpu {cpu:.2f} s, '
+                f'received once in order: {in_order}')
+        if flap:
+            line += (f', reconnected and resumed in {resume_time * 1000:.2f} ms' if resume_time is not None
+                     else ', session not resumed')
+        print(line)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MSG_COUNT
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_MSG_SIZE
+    task = app_hub.spawn(main, count, size)
+    app_hub.joinall([task])
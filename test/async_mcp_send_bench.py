@@ -0,0 +1,93 @@
+"""
+Loopback benchmark of send_msg against send_msg_nowait.
+
+A MachineConnection sends CaptureServiceSetEvent messages to a receiving
+connection in bursts of the send queue size, once through send_msg and
+once through send_msg_nowait. Prints throughput and asyncio tasks created
+for each message, counted by a task factory on the loop.
+
+    python test/async_mcp_send_bench.py [message count]
+"""
+import asyncio
+import sys
+import time
+
+from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+DEFAULT_MSG_COUNT = 100000
+BURST = 1000
+
+
+class BenchConnection(MachineConnection):
+    def __init__(self, reader, writer, done=None, count=0):
+        super().__init__(reader, writer, mcp_brick_name='mcp_bench', capability=Capability())
+        self.done = done
+        self.count = count
+        self.received = 0
+
+    def _dispatch_msg(self, msg):
+        self.received += 1
+        if self.received == self.count:
+            self.done.set()
+
+
+async def run(name, count):
+    done = asyncio.Event()
+    receivers = []
+
+    async def handle(reader, writer):
+        conn = BenchConnection(reader, writer, done, count)
+        conn.set_peer_capability(Capability())
+        receivers.append(conn)
+        await conn.serve()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    sender = BenchConnection(reader, writer)
+    sender.set_peer_capability(Capability())
+    sender.serve()
+    await asyncio.sleep(0.05)
+
+    loop = asyncio.get_running_loop()
+    tasks = 0
+
+    def task_factory(loop, coro, **kwargs):
+        nonlocal tasks
+        tasks += 1
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    send = getattr(sender, name)
+    parser = sender.mcproto_parser
+    loop.set_task_factory(task_factory)
+    start = time.perf_counter()
+    for i in range(0, count, BURST):
+        for capture_id in range(i, min(i + BURST, count)):
+            send(parser.CaptureServiceSetEvent(sender, capture_id & 0xffff, 0))
+        await asyncio.sleep(0)
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    loop.set_task_factory(None)
+
+    await sender.stop_serve()
+    for conn in receivers:
+        await conn.stop_serve()
+    server.close()
+    await server.wait_closed()
+
+    return count / elapsed, tasks / count
+
+
+async def main(count):
+    print(f'{count} messages in bursts of {BURST}.')
+    for name in ('send_msg', 'send_msg_nowait'):
+        rate, tasks = await run(name, count)
+        print(f'{name:>15}: {rate:,.0f} msg/s, {tasks:.3f} tasks created per message')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MSG_COUNT
+    task = app_hub.spawn(main, count)
+    app_hub.joinall([task])
@@ -0,0 +1,121 @@
+"""
+Loopback benchmark of control message latency behind a busy capture.
+
+A MachineConnection keeps its capture lane full of CaptureServiceSendPKT
+while a CmdServiceCancelExecute is sent every millisecond, once with a
+single FIFO lane and once with the default send lanes. Prints latency of
+the control messages, packet throughput and stats of the send lanes. Lane
+wait is the time spent in the send queue, the rest of the latency is
+spent in flight and by the receiver working through earlier packets.
+
+    python test/async_mcp_send_lane_bench.py [seconds]
+"""
+import asyncio
+import socket
+import statistics
+import sys
+import time
+
+from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+from async_app_fw.controller.mcp_controller.mcp_send_lane import LANE_CONTROL, SendLanes
+from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+DEFAULT_SECONDS = 3
+CONTROL_INTERVAL = 0.001
+# small socket buffers, less of the latency is spent in flight.
+SOCKET_BUFFER = 64 * 1024
+PKT = {'sniff_time': 1700000000.123456, 'length': 98, 'layers': ['eth', 'ip', 'icmp']}
+
+
+class BenchConnection(MachineConnection):
+    def __init__(self, reader, writer, sent=None):
+        super().__init__(reader, writer, mcp_brick_name='mcp_bench', capability=Capability())
+        # cmd_id of control message: time sent
+        self.sent = sent
+        self.packets = 0
+        self.latencies = []
+
+    def _dispatch_msg(self, msg):
+        if isinstance(msg, self.mcproto_parser.CmdServiceCancelExecute):
+            self.latencies.append(time.perf_counter() - self.sent.pop(msg.cmd_id))
+        else:
+            self.packets += 1
+
+
+async def run(lanes, seconds):
+    sent = {}
+    receivers = []
+
+    async def handle(reader, writer):
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+        conn = BenchConnection(reader, writer, sent)
+        conn.set_peer_capability(Capability())
+        receivers.append(conn)
+        await conn.serve()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER)
+    sender = BenchConnection(reader, writer)
+    sender.set_peer_capability(Capability())
+    sender.send_q = lanes
+    sender.serve()
+    await asyncio.sleep(0.05)
+
+    parser = sender.mcproto_parser
+    deadline = time.perf_counter() + seconds
+
+    # the same frame is queued again, so refilling the lane costs nothing.
+    msg = parser.CaptureServiceSendPKT(sender, 1, PKT)
+    sender.set_xid(msg)
+    msg.serialize()
+    frame = bytes(msg.buf)
+
+    async def capture():
+        while time.perf_counter() < deadline:
+            # keep the lane full.
+            await sender.send_q.put((frame, False))
+
+    async def control():
+        cmd_id = 0
+        while time.perf_counter() < deadline:
+            cmd_id = (cmd_id + 1) & 0xffff
+            sent[cmd_id] = time.perf_counter()
+            sender.send_msg_nowait(parser.CmdServiceCancelExecute(sender, cmd_id))
+            await asyncio.sleep(CONTROL_INTERVAL)
+
+    await asyncio.gather(app_hub.spawn(capture), app_hub.spawn(control))
+    stats = sender.send_lane_stats()
+    await asyncio.sleep(0.5)
+
+    receiver = receivers[0]
+    await sender.stop_serve()
+    for conn in receivers:
+        await conn.stop_serve()
+    server.close()
+    await server.wait_closed()
+
+    return receiver.packets / seconds, receiver.latencies, stats
+
+
+async def main(seconds):
+    print(f'Capture lane kept full, control message every {CONTROL_INTERVAL * 1000:.0f} ms.')
+    for name, lanes in (('fifo', SendLanes(lanes=((LANE_CONTROL, None),))), ('lanes', SendLanes())):
+        rate, latencies, stats = await run(lanes, seconds)
+        latencies = sorted(latencies)
+        p99 = latencies[int(len(latencies) * 0.99)]
+        print(f'{name:>6}: {rate:,.0f} pkt/s, control latency median {statistics.median(latencies) * 1000:.2f} ms, '
+              f'p99 {p99 * 1000:.2f} ms, max {latencies[-1] * 1000:.2f} ms')
+        for lane, lane_stats in stats.items():
+            if lane_stats['sent']:
+                print(f'{lane:>14}: sent {lane_stats["sent"]}, max depth {lane_stats["max_depth"]}, '
+                      f'wait mean {lane_stats["wait_mean"] * 1000:.2f} ms, '
+                      f'p99 {lane_stats["wait_p99"] * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SECONDS
+    task = app_hub.spawn(main, seconds)
+    app_hub.joinall([task])
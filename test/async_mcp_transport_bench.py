@@ -0,0 +1,93 @@
+"""
+Loopback benchmark of MCP receive path.
+
+Compare StreamReader transport with BufferedProtocol transport by sending
+small MCPJobACK / CaptureServiceSetEvent frames to a MachineConnection.
+
+    python test/async_mcp_transport_bench.py [message count]
+"""
+import asyncio
+import sys
+import time
+from types import SimpleNamespace
+
+from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+from async_app_fw.controller.mcp_controller.mcp_transport import \
+    TRANSPORT_STREAM, TRANSPORT_BUFFERED, get_server_factory
+from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp import mcp_parser_v_1_0 as mcproto_parser
+
+DEFAULT_MSG_COUNT = 100000
+
+
+class BenchConnection(MachineConnection):
+    def __init__(self, reader, writer, expect, done):
+        super().__init__(reader, writer, mcp_brick_name='mcp_bench')
+        self.expect = expect
+        self.done = done
+        self.count = 0
+
+    def _dispatch_msg(self, msg):
+        self.count += 1
+        if self.count == self.expect:
+            self.done.set()
+
+
+def prepare_frames(count):
+    conn = SimpleNamespace(mcproto_parser=mcproto_parser)
+    frames = bytearray()
+
+    for i in range(count):
+        if i % 2:
+            msg = mcproto_parser.MCPJobACK(conn, i)
+        else:
+            msg = mcproto_parser.CaptureServiceSetEvent(conn, i & 0xffff, i & 0xff)
+        msg.xid = i
+        msg.serialize()
+        frames += msg.buf
+
+    return bytes(frames)
+
+
+async def run_transport(transport, frames, count):
+    done = asyncio.Event()
+    connections = []
+
+    async def handle(reader, writer):
+        conn = BenchConnection(reader, writer, count, done)
+        connections.append(conn)
+        await conn.serve()
+
+    server = await get_server_factory(transport)(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    _, writer = await asyncio.open_connection('127.0.0.1', port)
+    start = time.perf_counter()
+    writer.write(frames)
+    await writer.drain()
+    await done.wait()
+    elapsed = time.perf_counter() - start
+
+    writer.close()
+    await writer.wait_closed()
+    for conn in connections:
+        await conn.stop_serve()
+    server.close()
+    await server.wait_closed()
+
+    return elapsed
+
+
+async def main(count):
+    frames = prepare_frames(count)
+    print(f'{count} frames, {len(frames)} bytes.')
+
+    for transport in (TRANSPORT_STREAM, TRANSPORT_BUFFERED):
+        elapsed = await run_transport(transport, frames, count)
+        print(f'{transport:>10}: {elapsed:.3f} sec, {count / elapsed:,.0f} msg/s')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MSG_COUNT
+    task = app_hub.spawn(main, count)
+    app_hub.joinall([task])
@@ -0,0 +1,121 @@
+"""
+Loopback benchmark of bulk frames between co-located master and agent.
+
+Sends CmdServiceReadStdRes of a given size from one MachineConnection to
+another over loopback TCP, a unix domain socket, and a unix domain socket
+with the shared memory ring of mcp_shm. Frames are not compressed, above
+the fragment size they are fragmented on the socket, a frame put in the
+ring is sent as it is.
+
+    python test/async_mcp_unix_bench.py [message count] [message size]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from async_app_fw.controller.mcp_controller.mcp_controller import MachineConnection
+from async_app_fw.controller.mcp_controller.mcp_transport import \
+    TRANSPORT_STREAM, TRANSPORT_UNIX, get_connection_factory, get_server_factory
+from async_app_fw.lib.hub import app_hub
+from async_app_fw.protocol.mcp import mcp_v_1_0 as mcproto
+from async_app_fw.protocol.mcp.mcp_capability import DEFAULT_FEATURES, Capability
+
+DEFAULT_MSG_COUNT = 2000
+DEFAULT_MSG_SIZE = 256 * 1024
+SHM_SIZE = 16 * 1024 * 1024
+CMD_ID = 1
+
+
+def capability():
+    return Capability(DEFAULT_FEATURES & ~mcproto.MCP_CAP_COMPRESSION)
+
+
+class BenchConnection(MachineConnection):
+    def __init__(self, reader, writer, expect=0, done=None, shm_size=0):
+        super().__init__(reader, writer, mcp_brick_name='mcp_bench', capability=capability())
+        self.shm_size = shm_size
+        self.expect = expect
+        self.done = done
+        self.count = 0
+        self.shm_ready = asyncio.Event()
+
+    def _shm_attached(self, msg):
+        super()._shm_attached(msg)
+        self.shm_ready.set()
+
+    def _dispatch_msg(self, msg):
+        self.count += 1
+        if self.count == self.expect:
+            self.done.set()
+
+
+async def run(transport, shm_size, count, output):
+    done = asyncio.Event()
+    receivers = []
+
+    async def handle(reader, writer):
+        conn = BenchConnection(reader, writer, count, done)
+        conn.set_peer_capability(capability())
+        receivers.append(conn)
+        await conn.serve()
+
+    if transport == TRANSPORT_UNIX:
+        path = os.path.join(tempfile.mkdtemp(), 'mcp_bench.sock')
+        server = await get_server_factory(transport)(handle, path)
+        reader, writer = await get_connection_factory(transport)(path)
+    else:
+        server = await get_server_factory(transport)(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await get_connection_factory(transport)('127.0.0.1', port)
+
+    sender = BenchConnection(reader, writer, shm_size=shm_size)
+    sender.serve()
+    sender.set_peer_capability(capability())
+    if shm_size:
+        await asyncio.wait_for(sender.shm_ready.wait(), 1)
+    else:
+        await asyncio.sleep(0.05)
+
+    parser = sender.mcproto_parser
+    start = time.perf_counter()
+    cpu = time.process_time()
+    for _ in range(count):
+        msg = parser.CmdServiceReadStdRes(sender, CMD_ID, output)
+        sender.set_xid(msg)
+        msg.serialize()
+        await sender.send_q.put((msg.buf, False))
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    shm_frames, shm_fallbacks = sender.shm_frames, sender.shm_fallbacks
+
+    await sender.stop_serve()
+    for conn in receivers:
+        await conn.stop_serve()
+    server.close()
+    await server.wait_closed()
+
+    return elapsed, cpu, shm_frames, shm_fallbacks
+
+
+async def main(count, size):
+    output = 'x' * size
+    print(f'{count} messages of {size} bytes.')
+    for name, transport, shm_size in (('tcp', TRANSPORT_STREAM, 0),
+                                      ('unix', TRANSPORT_UNIX, 0),
+                                      ('unix+shm', TRANSPORT_UNIX, SHM_SIZE)):
+        elapsed, cpu, shm_frames, shm_fallbacks = await run(transport, shm_size, count, output)
+        line = (f'{name:>8}: {elapsed:.3f} sec, {count / elapsed:,.0f} msg/s, '
+                f'{count * size / elapsed / 1e6:,.0f} MB/s, cpu {cpu:.2f} s')
+        if shm_size:
+            line += f', {shm_frames} frames by shared memory, {shm_fallbacks} by socket'
+        print(line)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MSG_COUNT
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_MSG_SIZE
+    task = app_hub.spawn(main, count, size)
+    app_hub.joinall([task])
@@ -0,0 +1,81 @@
+"""
+Loopback benchmark of TLS reconnects of StreamClient.
+
+Generates a self-signed certificate with the openssl command, serves it
+by a StreamServer and connects to it the given number of times, once
+with a new StreamClient for each connection (full handshake) and once
+with one StreamClient whose context resumes the previous session, the
+way the connect_loop of an agent reconnects. The server writes a few
+bytes on each connection, which carry the TLS 1.3 session ticket.
+
+    python test/async_tls_bench.py [connections]
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from async_app_fw.lib import hub
+from async_app_fw.lib.histogram import Histogram
+from async_app_fw.lib.hub import app_hub
+
+DEFAULT_CONNECTIONS = 200
+PORT = 7931
+
+
+def make_self_signed(directory):
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-keyout', keyfile, '-out', certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+async def connect(client):
+    reader, writer = await client.connect()
+    await reader.readexactly(5)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def main(connections):
+    certfile, keyfile = make_self_signed(tempfile.mkdtemp())
+
+    async def handle(reader, writer):
+        writer.write(b'hello')
+        await writer.drain()
+        await reader.read()
+        writer.close()
+
+    server = hub.StreamServer(('127.0.0.1', PORT), handle, certfile=certfile, keyfile=keyfile)
+    server_task = app_hub.spawn(server.serve_forever)
+    await asyncio.sleep(0.1)
+
+    print(f'{connections} TLS connections to 127.0.0.1:{PORT}.')
+    for name, resume in (('full', False), ('resumed', True)):
+        connect_time = Histogram(scale=1e6)
+        resumed = 0
+        client = None
+        cpu = time.process_time()
+        for _ in range(connections):
+            if client is None or not resume:
+                client = hub.StreamClient(('127.0.0.1', PORT), ca_certs=certfile, server_hostname='localhost')
+                client.connect_time = connect_time
+            before = client.resumed
+            await connect(client)
+            resumed += client.resumed - before
+        cpu = time.process_time() - cpu
+        print(f'{name:>8}: connect mean {connect_time.mean * 1000:.2f} ms, '
+              f'p99 {connect_time.percentile(99) * 1000:.2f} ms, {resumed} resumed, '
+              f'cpu {cpu / connections * 1000:.2f} ms per connection')
+
+    server_task.cancel()
+
+
+if __name__ == '__main__':
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CONNECTIONS
+    task = app_hub.spawn(main, connections)
+    app_hub.joinall([task])
@@ -0,0 +1,181 @@
+"""
+Interop check of MCP messages between this tree and a baseline revision.
+
+The parser modules of the baseline, the first commit of the repository
+unless a revision is given, are loaded from git next to the current
+ones. Every message type the baseline has is then sent both ways:
+
+- baseline -> current, parsed on a connection negotiated with a peer
+  without capability, as an old agent is.
+- current -> baseline, serialized on such a connection.
+- current -> current, on a connection where both ends negotiated every
+  feature and codec.
+
+Messages which prefer a codec in _PAYLOAD_CODECS use it only between
+current peers, old peers must get the frames of the baseline.
+
+    python test/mcp_interop_check.py [revision]
+"""
+import dataclasses
+import os
+import subprocess
+import sys
+import types
+
+from async_app_fw.protocol.mcp import mcp_parser, mcp_parser_v_1_0 as mcp_v10
+from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARSER_PATH = 'async_app_fw/protocol/mcp/mcp_parser.py'
+PARSER_V10_PATH = 'async_app_fw/protocol/mcp/mcp_parser_v_1_0.py'
+
+
+@dataclasses.dataclass
+class SessionInfo:
+    host: str = '10.0.0.1'
+    port: int = 443
+
+
+ERROR = ValueError('Invalid value of port speed.', 1000)
+
+# message type: constructor arguments, the same for baseline and current.
+CASES = {
+    'MCPHello': dict(connection_id=4),
+    'MCPJobCreateReply': dict(job_id=3, job_info={'a': 1}),
+    'MCPJobCreateRequest': dict(timeout=5, job_info={'a': 1}),
+    'MCPJobACK': dict(job_id=3),
+    'MCPJobStateChange': dict(job_id=3, before=1, after=2, info='info'),
+    'MCPJobOutput': dict(job_id=3, state=1, info={'out': 'x'}),
+    'MCPJobDeleteReply': dict(job_id=3),
+    'MCPJobDeleteRequest': dict(job_id=3),
+    'MCPJobDeleteAll': dict(),
+    'MCPJobFeatureExe': dict(job_id=3, state=1, info={'out': 'x'}),
+    'APILogin': dict(api_action_id=2, session_info=SessionInfo(), args=[1], kwargs={'k': 2}),
+    'APILoginFailed': dict(exception=ERROR),
+    'APILoginResponse': dict(api_action_id=2, auth='token'),
+    'APIActionRequest': dict(api_action_id=2, method='get', auth='token', base_url='https://10.0.0.1',
+                             args=['/ports'], kwargs={}),
+    'APIActionResponse': dict(response={'status': 200, 'json': {'ports': [1, 2]}}),
+    'CaptureServiceExe': dict(capture_id=1, capture_service_cls_id=2, input_vars={'interface': 'eth0'}),
+    'CaptureServiceSendPKT': dict(capture_id=1, pkt={'length': 98, 'raw': bytes(range(98))}),
+    'CaptureServiceCancelExecute': dict(capture_id=1),
+    'CaptureServiceSetEvent': dict(capture_id=1, event_id=2),
+    'CaptureServiceSetException': dict(capture_id=1, exception=ERROR),
+    'CmdServiceExecute': dict(cmd_id=1, input_vars={'cmd': 'ls'}),
+    'CmdServiceCancelExecute': dict(cmd_id=1),
+    'CmdServiceReadStd': dict(cmd_id=1, std_type=1, input_vars={'size': 10}),
+    'CmdServiceWriteStd': dict(cmd_id=1, input_vars={'data': 'y'}),
+    'CmdServiceReadStdRes': dict(cmd_id=1, output='output'),
+    'CmdServiceWriteStdRes': dict(),
+    'CmdServiceReadStdException': dict(cmd_id=1, exception=ERROR),
+    'CmdServiceWriteStdException': dict(cmd_id=1, exception=ERROR),
+    'CmdServiceSetEvent': dict(cmd_id=1, event_id=2),
+    'CmdServiceSetException': dict(cmd_id=1, exception=ERROR),
+}
+
+
+class Connection(object):
+    def __init__(self, parser, peer_capability=False):
+        self.mcproto_parser = parser
+        self.local_capability = Capability()
+        # False: not negotiated, None: peer without capability.
+        self.capability = None if peer_capability is False else self.local_capability.negotiate(peer_capability)
+
+
+def load_baseline(rev):
+    def source(path):
+        return subprocess.run(['git', 'show', f'{rev}:{path}'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout
+
+    def load(name, path, text):
+        module = types.ModuleType(name)
+        sys.modules[name] = module
+        exec(compile(text, f'{rev}:{path}', 'exec'), module.__dict__)
+        return module
+
+    parser = load('baseline_mcp_parser', PARSER_PATH, source(PARSER_PATH))
+    text = source(PARSER_V10_PATH)
+    for old, new in (('from async_app_fw.protocol.mcp import mcp_parser\n', 'import baseline_mcp_parser as mcp_parser\n'),
+                     ('from async_app_fw.protocol.mcp.mcp_parser import', 'from baseline_mcp_parser import')):
+        assert old in text, f'{rev}:{PARSER_V10_PATH} does not import {old.strip()}'
+        text = text.replace(old, new)
+    return parser, load('baseline_mcp_parser_v_1_0', PARSER_V10_PATH, text)
+
+
+def parse(parser, conn, buf):
+    buf = bytes(buf)
+    return parser.msg(conn, *mcp_parser.header(buf), buf)
+
+
+def check(name, msg, kwargs):
+    assert type(msg).__name__ == name, f'{name} parsed as {type(msg).__name__}'
+    for key, value in kwargs.items():
+        got = getattr(msg, key)
+        if isinstance(value, Exception):
+            ok = type(got) is type(value) and got.args == value.args
+        elif dataclasses.is_dataclass(value):
+            ok = got == dataclasses.asdict(value)
+        else:
+            ok = got == value
+        assert ok, f'{name}.{key}: {got!r} != {value!r}'
+
+
+def run(baseline_parser, baseline_v10, label):
+    baseline_conn = Connection(baseline_v10)
+    legacy_conn = Connection(mcp_v10, None)
+    full_conn = Connection(mcp_v10, Capability())
+    negotiated = 0
+    # types the baseline can't parse even from itself.
+    unparsable = []
+
+    for name, kwargs in CASES.items():
+        # baseline -> current
+        old = getattr(baseline_v10, name)(baseline_conn, **kwargs)
+        old.xid = 7
+        old.serialize()
+        check(name, parse(mcp_parser, legacy_conn, old.buf), kwargs)
+
+        # current -> baseline, the same frame as baseline sends.
+        new = getattr(mcp_v10, name)(legacy_conn, **kwargs)
+        new.xid = 7
+        new.serialize()
+        if name != 'MCPHello':
+            # hello of the current tree carries capability after connection_id.
+            assert bytes(new.buf) == bytes(old.buf), f'{name}: frame differs from baseline'
+        baseline_parser.LOG.disabled = True
+        try:
+            parse(baseline_parser, baseline_conn, old.buf)
+        except Exception:
+            unparsable.append(name)
+        else:
+            check(name, parse(baseline_parser, baseline_conn, new.buf), kwargs)
+        finally:
+            baseline_parser.LOG.disabled = False
+
+        # current -> current, negotiated.
+        new = getattr(mcp_v10, name)(full_conn, **kwargs)
+        new.xid = 7
+        new.serialize()
+        check(name, parse(mcp_parser, full_conn, new.buf), kwargs)
+        msg_cls = type(new)
+        if msg_cls._PAYLOAD is not None and msg_cls.payload_codec(full_conn) is not msg_cls._payload_codec:
+            negotiated += 1
+
+    print(f'{label}: {len(CASES)} message types ok both ways, '
+          f'{negotiated} with a negotiated codec between current peers.')
+    if unparsable:
+        print(f'    baseline fails to parse its own {", ".join(unparsable)}, their frames are identical.')
+
+
+def main(rev):
+    baseline_parser, baseline_v10 = load_baseline(rev)
+    run(baseline_parser, baseline_v10, 'default codecs')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        revision = sys.argv[1]
+    else:
+        revision = subprocess.run(['git', 'rev-list', '--max-parents=0', 'HEAD'], cwd=ROOT, check=True,
+                                  capture_output=True, text=True).stdout.split()[0]
+    main(revision)
@@ -0,0 +1,94 @@
+"""
+Memory and allocation benchmark of the MCP receive path at a fixed rate.
+
+CaptureServiceSendPKT frames are parsed, wrapped in their event and the
+packet is read, at 50k messages per second for a few seconds. Prints
+object sizes, CPU share of the rate, gc collections and memory of kept
+messages.
+
+    python test/mcp_msg_alloc_bench.py [messages per second] [seconds]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from async_app_fw.event.mcp_event import mcp_event
+from async_app_fw.protocol.mcp import mcp_parser, mcp_parser_v_1_0 as mcproto_parser
+from async_app_fw.protocol.mcp.mcp_capability import Capability
+
+DEFAULT_RATE = 50000
+DEFAULT_SECONDS = 3
+# messages handled between checks of the clock.
+TICK = 500
+PKT = {'sniff_time': 1700000000.123456, 'length': 98, 'layers': ['eth', 'ip', 'icmp']}
+
+
+def frame(conn):
+    msg = mcproto_parser.CaptureServiceSendPKT(conn, 1, PKT)
+    msg.xid = 1
+    msg.serialize()
+    return bytes(msg.buf)
+
+
+def run(conn, buf, rate, seconds):
+    (msg_type, msg_len, version, xid) = mcp_parser.header(buf)
+    parse = mcproto_parser.msg_parser
+    to_ev = mcp_event.mcp_msg_to_ev
+    interval = TICK / rate
+
+    gc.collect()
+    collections = sum(stat['collections'] for stat in gc.get_stats())
+    cpu = time.thread_time()
+    start = next_tick = time.perf_counter()
+    count = 0
+
+    while count < rate * seconds:
+        for _ in range(TICK):
+            ev = to_ev(parse(conn, msg_type, msg_len, version, xid, buf))
+            ev.msg.pkt
+        count += TICK
+
+        next_tick += interval
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    elapsed = time.perf_counter() - start
+    cpu = time.thread_time() - cpu
+    collections = sum(stat['collections'] for stat in gc.get_stats()) - collections
+
+    return count / elapsed, cpu / elapsed, collections
+
+
+def retained(conn, buf, count):
+    """Traced bytes of count parsed messages and their events kept alive."""
+    (msg_type, msg_len, version, xid) = mcp_parser.header(buf)
+    tracemalloc.start()
+    events = [mcp_event.mcp_msg_to_ev(mcproto_parser.msg_parser(conn, msg_type, msg_len, version, xid, buf))
+              for _ in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del events
+    return size / count
+
+
+def main(rate, seconds):
+    conn = SimpleNamespace(mcproto_parser=mcproto_parser, local_capability=Capability())
+    buf = frame(conn)
+
+    msg = mcproto_parser.CaptureServiceSendPKT(conn, 1, PKT)
+    ev = mcp_event.mcp_msg_to_ev(msg)
+    print(f'message {sys.getsizeof(msg)} bytes, __dict__ {hasattr(msg, "__dict__")}; '
+          f'event {sys.getsizeof(ev)} bytes, __dict__ {hasattr(ev, "__dict__")}')
+
+    achieved, cpu_share, collections = run(conn, buf, rate, seconds)
+    print(f'{achieved:,.0f} msg/s, cpu {cpu_share * 100:.1f}% of one core, {collections} gc collections')
+    print(f'{retained(conn, buf, 10000):.0f} bytes for each message kept with its event')
+
+
+if __name__ == '__main__':
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RATE
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SECONDS
+    main(rate, seconds)